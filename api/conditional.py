@@ -0,0 +1,124 @@
+'''conditional.py
+Conditional GET: strong ETags and Last-Modified from version columns
+
+Routes look the version up first (a covered index lookup) and answer 304
+without loading or serialising the resource when the client copy is
+still current:
+
+    version = await crud_user.get_user_version(db=db, user_id=user_id)
+    tag = make_etag("user", user_id, version.version, fields)
+    if is_fresh(request, tag, version.updated_at):
+        return not_modified(tag, version.updated_at)
+'''
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from fastapi import status
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Build a strong ETag from the parts identifying a representation: the
+    resource, its version and anything changing the body (e.g. fields)
+    """
+    digest = hashlib.sha1("/".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def validators(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    """
+    Get the ETag and Last-Modified headers of a representation
+    """
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header with an ETag (RFC 7232)
+    """
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def parse_http_date(value: str) -> Optional[datetime]:
+    """
+    Parse an HTTP date into a naive UTC datetime, None when invalid
+    """
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def check_fresh(
+    if_none_match: Optional[str],
+    if_modified_since: Optional[str],
+    etag: Optional[str],
+    last_modified: Optional[datetime]
+) -> bool:
+    """
+    Check the conditional headers of a request against the validators
+
+    If-None-Match wins over If-Modified-Since when both are sent; the
+    dates are compared at the second resolution of HTTP dates.
+    """
+    if if_none_match is not None:
+        return etag is not None and etag_matches(if_none_match, etag)
+    if if_modified_since is None or last_modified is None:
+        return False
+    since = parse_http_date(if_modified_since)
+    return since is not None and last_modified.replace(microsecond=0) <= since
+
+
+def is_fresh(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """
+    Check whether the client copy is current
+
+    Parameters
+    ----------
+    request : Request
+        The request of app
+    etag : str
+        The current ETag of the representation
+    last_modified : Optional[datetime]
+        The current updated_at of the resource (UTC)
+
+    Returns
+    -------
+    bool
+        True when a 304 can be sent
+    """
+    return check_fresh(
+        request.headers.get("if-none-match"), request.headers.get("if-modified-since"), etag, last_modified)
+
+
+def not_modified(etag: str, last_modified: Optional[datetime]) -> Response:
+    """
+    Get a bodiless 304 response carrying the validators
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validators(etag, last_modified))
+
+
+def with_validators(response: Response, etag: str, last_modified: Optional[datetime]) -> Response:
+    """
+    Set the validators on a response, returned for chaining
+    """
+    response.headers.update(validators(etag, last_modified))
+    return response
@@ -1,33 +1,70 @@
 from fastapi.security import OAuth2PasswordBearer
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
 from api.schemas.token import TokenData
 from crud.crud_user import crud_user
 from core.config import settings
 from database.setup import SessionLocal
+from api.routing import register_session
+from database.timeouts import timeout_ms
 
 
-def get_db():
+def get_db(request: Request):
+    """
+    Get a database session for the request
+
+    The session only checks out a connection on its first query, and
+    SessionReleasingRoute gives it back as soon as the endpoint returns.
+    Sub-requests of POST /batch share the session of the batch request.
+    """
+    shared_db = getattr(request.state, "db", None)
+    if shared_db is not None:
+        yield shared_db
+        return
     db = SessionLocal()
+    register_session(db)
     try:
         yield db
     finally:
         db.close()
 
 
+def statement_timeout(ms: int):
+    """
+    Get a dependency bounding the statements of a route, in place of
+    settings.STATEMENT_TIMEOUT_MS (0 for no limit)
+
+        @router.post("/import", dependencies=[Depends(statement_timeout(60000))])
+
+    Route dependencies run first, so the deadline is set before get_db
+    opens a transaction.
+    """
+    async def set_statement_timeout():
+        timeout_ms.set(ms or None)  # async: set in the request task, not in a worker thread
+
+    return set_statement_timeout
+
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 
 async def get_current_user(
+    request: Request,
     db: Session = Depends(get_db),
     token: str = Depends(oauth2_scheme)
 ):
     """
     Get current user by access token jwt
 
+    Sub-requests of POST /batch reuse the user authenticated once by the
+    batch request, as long as they carry the same token.
+
     Parameters
     ----------
+    request : Request
+        The request of app
     db : Session
         The session database of app
     token: str
@@ -38,6 +75,9 @@ async def get_current_user(
     Any
         An object of UserSchema, or raise error 401
     """
+    shared_user = getattr(request.state, "user", None)
+    if shared_user is not None and getattr(request.state, "token", None) == token:
+        return shared_user
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid authentication credentials",
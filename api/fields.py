@@ -0,0 +1,77 @@
+'''fields.py
+Sparse fieldsets: `?fields=id,title` on list and detail routes
+'''
+
+from functools import lru_cache
+from typing import Any, Optional, Tuple, Type
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, create_model
+
+
+def parse_fields(fields: Optional[str], schema: Type[BaseModel]) -> Optional[Tuple[str, ...]]:
+    """
+    Parse a comma separated fields query parameter
+
+    Parameters
+    ----------
+    fields : Optional[str]
+        A comma separated list of field names, or None for every field
+    schema : Type[BaseModel]
+        A response schema the fields belong to
+
+    Returns
+    -------
+    Optional[Tuple[str, ...]]
+        The requested field names in schema order, or None, or raise error 400
+    """
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(schema.__fields__)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(name for name in schema.__fields__ if name in requested)
+
+
+@lru_cache(maxsize=256)
+def pruned_model(schema: Type[BaseModel], fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """
+    Build (once per field set) a copy of schema holding only some fields
+    """
+    definitions = {
+        name: (field.outer_type_, ... if field.required else field.default)
+        for name, field in schema.__fields__.items() if name in fields
+    }
+    return create_model(
+        f"{schema.__name__}Fields", __config__=schema.__config__, **definitions)
+
+
+def sparse_response(schema: Type[BaseModel], content: Any, fields: Tuple[str, ...]) -> JSONResponse:
+    """
+    Serialise an ORM object or list with the pruned schema of the fields
+
+    Parameters
+    ----------
+    schema : Type[BaseModel]
+        A full response schema (orm_mode)
+    content : Any
+        An ORM object, or a list of ORM objects
+    fields : Tuple[str, ...]
+        The field names returned by parse_fields
+
+    Returns
+    -------
+    JSONResponse
+        A response holding only the requested fields
+    """
+    model = pruned_model(schema, fields)
+    if isinstance(content, list):
+        data = [model.from_orm(obj) for obj in content]
+    else:
+        data = model.from_orm(content)
+    return JSONResponse(content=jsonable_encoder(data))
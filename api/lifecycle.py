@@ -0,0 +1,215 @@
+'''lifecycle.py
+Warm-up, readiness and graceful drain of an app process
+
+    startup   warm_up() runs in a background thread: it opens
+              settings.WARMUP_CONNECTIONS pooled connections, runs the hot
+              CRUD statements once (compiled statement cache), loads the
+              bcrypt backend and waits for the user indexes;
+              GET /health/ready answers 200 once it is done
+    SIGTERM   begin_drain() refuses new requests (503, Connection: close)
+              and ends the event streams, from the signal handler of
+              uvicorn (install_exit_hook): uvicorn then waits for every
+              open connection to close before the lifespan shutdown, which
+              an event stream would never do by itself
+    shutdown  drain() waits up to settings.DRAIN_TIMEOUT seconds for the
+              requests still in flight, before the queues are flushed
+              (main.py)
+
+GET /health/ready also answers 503 while draining. POST /health/drain, with
+`X-Drain-Token: <settings.DRAIN_TOKEN>`, starts the drain from a pre-stop
+hook: the load balancer stops routing to the process before the server
+closes its socket.
+'''
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy.engine import Engine
+from starlette.responses import JSONResponse
+
+from core.config import settings
+from crud.crud_item import crud_item
+from crud.crud_user import crud_user, pwd_context
+from database.setup import SessionLocal
+from database.shards import shard_router
+from services.events.items import broker
+from services.indexes.prefix import index as prefix_index
+from services.indexes.users import index as user_index
+
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PREFIX = "/health/"
+WARMUP_RETRY = 5  # seconds between warm-up attempts while the database is down
+INDEX_WAIT = 30  # seconds the warm-up waits for the in-memory user indexes
+
+
+class Lifecycle:
+    """
+    State of this process: warmed up, draining, requests in flight
+
+    Methods
+    -------
+    start_warm_up(self, engine: Engine) -> None
+        Warm up in a background thread
+    warm_up(self, engine: Engine) -> Dict[str, Any]
+        Open connections, run the hot statements, load the lazy dependencies
+    begin_drain(self) -> None
+        Refuse new requests and end the event streams
+    drain(self, timeout: float) -> int
+        Refuse new requests and wait for the ones in flight
+    dict(self) -> Dict[str, Any]
+        Get the state
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self.in_flight = 0
+        self.warm_up_report: Dict[str, Any] = {}
+        self.thread: Optional[threading.Thread] = None
+
+    def start_warm_up(self, engine: Engine) -> None:
+        self.draining = False
+        if self.thread is None or not self.thread.is_alive() and not self.ready:
+            self.thread = threading.Thread(target=self.run_warm_up, args=(engine,), name="warm-up", daemon=True)
+            self.thread.start()
+
+    def run_warm_up(self, engine: Engine) -> None:
+        while not self.draining:
+            try:
+                self.warm_up_report = self.warm_up(engine)
+            except Exception:
+                logger.exception("Warm-up failed, retrying in %ss", WARMUP_RETRY)
+                time.sleep(WARMUP_RETRY)
+                continue
+            self.ready = True
+            logger.info("Warmed up in %.2fs", self.warm_up_report["seconds"])
+            return
+
+    def warm_up(self, engine: Engine) -> Dict[str, Any]:
+        started = time.monotonic()
+        connections = 0
+        for bind in [engine, *shard_router.engines]:
+            size = bind.pool.size() if hasattr(bind.pool, "size") else 1
+            opened = [bind.connect() for _ in range(min(settings.WARMUP_CONNECTIONS, size))]
+            connections += len(opened)
+            for conn in opened:
+                conn.close()
+
+        # the statements of the hot paths, with keys matching nothing
+        with SessionLocal() as db:
+            asyncio.run(self.run_statements(db))
+        pwd_context().handler().get_backend()
+
+        deadline = time.monotonic() + INDEX_WAIT
+        for index in (user_index, prefix_index):
+            while not index.ready and index.building and time.monotonic() < deadline:
+                time.sleep(0.05)
+        return {
+            "seconds": round(time.monotonic() - started, 3),
+            "connections": connections,
+            "user_index_ready": user_index.ready,
+            "prefix_index_ready": prefix_index.ready,
+        }
+
+    async def run_statements(self, db) -> None:
+        await crud_user.get_user_by_username(db=db, username="")
+        await crud_user.get_user_version(db=db, user_id=0)
+        await crud_user.get_user(db=db, user_id=0)
+        await crud_user.get_user_rows(db=db, limit=1)
+        await crud_item.get_item_rows(db=db, limit=1)
+        await crud_item.get_user_items(db=db, user_id=0, limit=1)
+        await crud_item.get_user_item_version(db=db, id=0, user_id=0)
+
+    def begin_drain(self) -> None:
+        if not self.draining:
+            logger.info("Draining, %s requests in flight", self.in_flight)
+        self.draining = True
+        broker.close_all()  # streaming clients resume on another process
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Refuse new requests, end the event streams and wait for the
+        requests in flight
+
+        Parameters
+        ----------
+        timeout : float
+            A maximum wait in seconds
+
+        Returns
+        -------
+        int
+            The number of requests still in flight after the wait
+        """
+        self.begin_drain()
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.in_flight:
+            logger.warning("Drain timed out with %s requests in flight", self.in_flight)
+        return self.in_flight
+
+    def dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready and not self.draining,
+            "warmed_up": self.ready,
+            "draining": self.draining,
+            "in_flight": self.in_flight,
+            **self.warm_up_report,
+        }
+
+
+lifecycle = Lifecycle()
+
+
+def install_exit_hook() -> None:
+    """
+    Begin the drain when uvicorn receives SIGINT or SIGTERM
+
+    Called when the app is imported: uvicorn loads the app before it
+    installs its signal handlers. Does nothing, and imports nothing, when
+    uvicorn is not serving the app.
+    """
+    server = getattr(sys.modules.get("uvicorn.main"), "Server", None)
+    if server is None or getattr(server.handle_exit, "begins_drain", False):
+        return
+    handle_exit = server.handle_exit
+
+    def begin_drain_and_exit(self, sig, frame):
+        lifecycle.begin_drain()
+        handle_exit(self, sig, frame)
+
+    begin_drain_and_exit.begins_drain = True
+    server.handle_exit = begin_drain_and_exit
+
+
+class DrainMiddleware:
+    """
+    ASGI middleware counting the requests in flight, and refusing the new
+    ones while draining (health checks and batch sub-requests excepted)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(HEALTH_PREFIX) or "db" in scope.get("state", {}):
+            await self.app(scope, receive, send)
+            return
+        if lifecycle.draining:
+            response = JSONResponse(
+                {"detail": "The server is shutting down, try again"},
+                status_code=503, headers={"Connection": "close", "Retry-After": "1"})
+            await response(scope, receive, send)
+            return
+        lifecycle.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lifecycle.in_flight -= 1
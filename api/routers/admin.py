@@ -0,0 +1,133 @@
+from typing import Any
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from api.deps import get_current_user, get_db
+from database.setup import engine
+from services.cache.responses import cache
+from services.indexes.prefix import index as prefix_index
+from services.indexes.users import index as user_index
+from services.jobs.queue import enqueue
+from services.observability import pool, queries
+from services.stats import rollups
+
+
+router = APIRouter()
+
+
+@router.get(
+    "/admin/queries",
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def read_query_stats(
+    limit: int = 10,
+    sort: str = Query("total", regex="^(total|max|count|mean)$")
+) -> Any:
+    """
+    GET Get the most expensive statement fingerprints
+    """
+    return queries.registry.top(limit=limit, sort=sort)
+
+
+@router.delete(
+    "/admin/queries",
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def reset_query_stats() -> Any:
+    """
+    DELETE Reset statement statistics
+    """
+    queries.registry.reset()
+    return {"detail": "Statement statistics reset"}
+
+
+@router.get(
+    "/admin/statement-cache",
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def read_statement_cache_stats() -> Any:
+    """
+    GET Get compiled statement cache hit/miss counters
+    """
+    return queries.registry.cache_stats()
+
+
+@router.get(
+    "/admin/response-cache",
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def read_response_cache_stats() -> Any:
+    """
+    GET Get response cache size and hit/miss counters of this process
+    """
+    return cache.stats()
+
+
+@router.get(
+    "/admin/user-index",
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def read_user_index_stats() -> Any:
+    """
+    GET Get the username/email availability filter and the username prefix
+    index of this process
+    """
+    return {**user_index.stats(), "prefix": prefix_index.stats()}
+
+
+@router.get(
+    "/admin/pool",
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def read_pool_stats() -> Any:
+    """
+    GET Get connection pool status and connection hold times
+    """
+    return {"status": engine.pool.status(), **pool.stats.dict()}
+
+
+@router.post(
+    "/admin/item-counts/reconcile",
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def reconcile_item_counts(db: Session = Depends(get_db)) -> Any:
+    """
+    POST Queue a repair of the users item counters
+    """
+    job = enqueue(db, "reconcile_item_counts")
+    db.commit()
+    return {"detail": "Item counters reconciliation queued", "job_id": job.id}
+
+
+@router.get(
+    "/admin/stats",
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def read_stats(
+    days: int = Query(30, ge=1, le=366),
+    db: Session = Depends(get_db)
+) -> Any:
+    """
+    GET Get users, items per user and signups statistics
+
+    The figures come from rollup tables, as of refreshed_at; a refresh is
+    queued when they are stale.
+    """
+    stats = rollups.read_stats(db, days=days)
+    if stats["stale"] and rollups.queue_refresh(db):
+        db.commit()
+    return stats
+
+
+@router.post(
+    "/admin/stats/refresh",
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def refresh_stats(db: Session = Depends(get_db)) -> Any:
+    """
+    POST Queue a refresh of the stats rollups
+    """
+    queued = rollups.queue_refresh(db)
+    db.commit()
+    return {"detail": "Stats refresh queued" if queued else "Stats refresh already queued"}
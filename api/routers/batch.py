@@ -0,0 +1,138 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy.orm import Session
+
+from api.routing import SessionReleasingRoute
+from api.deps import get_db, get_current_user, oauth2_scheme_optional
+from api.schemas.batch import BatchRequest, BatchRequestItem, BatchResponse, BatchResponseItem
+from core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(route_class=SessionReleasingRoute)
+
+
+async def call_sub_request(
+    request: Request,
+    sub: BatchRequestItem,
+    state: Dict[str, Any]
+) -> BatchResponseItem:
+    """
+    Run one sub-request through the ASGI app, in process
+
+    An unhandled error of the sub-request answers 500 for it alone: the
+    shared session is rolled back and the batch goes on.
+
+    Parameters
+    ----------
+    request : Request
+        The batch request, whose headers are forwarded
+    sub : BatchRequestItem
+        A sub-request
+    state : Dict[str, Any]
+        A request state shared with the sub-request (db, user, token)
+
+    Returns
+    -------
+    Object
+        An object of BatchResponseItem
+    """
+    url = urlsplit(sub.path)
+    body = b"" if sub.body is None else json.dumps(sub.body).encode()
+    headers = [
+        (key, value) for key, value in request.scope["headers"]
+        if key in (b"authorization", b"accept", b"user-agent")
+    ]
+    headers += [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    scope = {
+        "type": "http",
+        "http_version": request.scope.get("http_version", "1.1"),
+        "method": sub.method.upper(),
+        "scheme": request.scope.get("scheme", "http"),
+        "server": request.scope.get("server"),
+        "client": request.scope.get("client"),
+        "root_path": request.scope.get("root_path", ""),
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+        "state": dict(state),
+    }
+    sent_body = False
+
+    async def receive() -> dict:
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    response: Dict[str, Any] = {"status": 500, "headers": {}, "body": b""}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {
+                key.decode("latin-1"): value.decode("latin-1")
+                for key, value in message.get("headers", [])
+            }
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    try:
+        await request.app(scope, receive, send)
+    except Exception:
+        logger.exception("Batch sub-request %s %s failed", sub.method.upper(), url.path)
+        state["db"].rollback()
+        return BatchResponseItem(status=500, body={"detail": "Internal Server Error"})
+
+    content: Optional[Any] = response["body"].decode() or None
+    if content and response["headers"].get("content-type", "").startswith("application/json"):
+        content = json.loads(content)
+    return BatchResponseItem(status=response["status"], headers=response["headers"], body=content)
+
+
+@router.post("/batch", response_model=BatchResponse, tags=['batch'])
+async def batch(
+    obj_in: BatchRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    token: Optional[str] = Depends(oauth2_scheme_optional)
+) -> BatchResponse:
+    """
+    POST Run many API calls in one round trip
+
+    The sub-requests run in order, each one seeing the writes of the
+    previous ones. They share one database session and the user
+    authenticated by the Authorization header of the batch.
+    """
+    if len(obj_in.requests) > settings.BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch accepts at most {settings.BATCH_MAX_REQUESTS} requests")
+    if any(urlsplit(sub.path).path.rstrip("/") == "/batch" for sub in obj_in.requests):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="A batch cannot contain a batch")
+
+    state: Dict[str, Any] = {"db": db}
+    if token:
+        try:
+            state["user"] = await get_current_user(request=request, db=db, token=token)
+            state["token"] = token
+        except HTTPException:
+            pass  # sub-requests needing a user answer 401 on their own
+
+    responses: List[BatchResponseItem] = []
+    for sub in obj_in.requests:
+        responses.append(await call_sub_request(request, sub, state))
+        if not db.is_active:  # a failed write must not poison the next ones
+            db.rollback()
+    return BatchResponse(responses=responses)
@@ -0,0 +1,46 @@
+from typing import Any, Optional
+
+from fastapi import APIRouter, Header, HTTPException, status
+from starlette.responses import JSONResponse
+
+from api.lifecycle import lifecycle
+from core.config import settings
+
+
+router = APIRouter()
+
+
+@router.get(
+    "/health/live",
+    tags=['health'])
+async def read_liveness() -> Any:
+    """
+    GET Check that the process answers
+    """
+    return {"live": True}
+
+
+@router.get(
+    "/health/ready",
+    tags=['health'])
+async def read_readiness() -> Any:
+    """
+    GET Check that the process is warmed up and not draining, 503 otherwise
+    """
+    state = lifecycle.dict()
+    return JSONResponse(
+        state, status_code=status.HTTP_200_OK if state["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@router.post(
+    "/health/drain",
+    tags=['health'])
+async def drain(x_drain_token: Optional[str] = Header(None)) -> Any:
+    """
+    POST Stop taking requests and wait for the ones in flight, from a
+    pre-stop hook (X-Drain-Token header)
+    """
+    if not settings.DRAIN_TOKEN or x_drain_token != settings.DRAIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid drain token")
+    remaining = await lifecycle.drain(settings.DRAIN_TIMEOUT)
+    return {"detail": "Drained" if not remaining else f"{remaining} requests still in flight"}
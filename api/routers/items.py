@@ -1,41 +1,216 @@
-from fastapi import APIRouter, Depends
-from typing import List
+import json
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set
 from sqlalchemy.orm import Session
+from starlette.responses import StreamingResponse
 
-from api.schemas.item import ItemSchema, ItemCreate
+from api.schemas.item import ItemSchema, ItemCreate, ItemUpdate
 from api.schemas.user import UserSchema
-from api.deps import get_db, get_current_user
+from api.conditional import is_fresh, make_etag, not_modified, with_validators
+from api.routing import SessionReleasingRoute
+from api.deps import get_db, get_current_user, statement_timeout
+from api.fields import parse_fields, sparse_response
 from crud.crud_item import crud_item
+from crud.crud_user import crud_user
+from core.config import settings
+from services.cache.responses import ITEMS, cache_tags, owner_items_tag
+from services.events import items as events
+from services.events.broker import Subscription
+from services.importer.items import CSV, NDJSON, import_items
+from api import dresp
 
 
-router = APIRouter()
+router = APIRouter(route_class=SessionReleasingRoute)
 
 
 @router.get("/items", response_model=List[ItemSchema], tags=['admin'])
 async def read_items(
-    skip: int = 0,
-    limit: int = 100,
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=settings.MAX_PAGE_LIMIT),
+    fields: Optional[str] = None,
+    after: Optional[str] = Query(None, regex=r"^\d+:\d+$"),
     db: Session = Depends(get_db)
 ):
     """
     GET Get items list
+
+    after is an "owner_id:id" cursor, the next one is sent in the
+    X-Next-Cursor header; cursor pages are ordered by owner and id.
+    Items are read as plain rows, not ORM objects.
     """
-    items = await crud_item.get_items(db=db, skip=skip, limit=limit)
-    return items
+    cache_tags(request, ITEMS)
+    requested = parse_fields(fields, ItemSchema)
+    cursor = tuple(int(key) for key in after.split(":")) if after else None
+    items = await crud_item.get_item_rows(db=db, skip=skip, limit=limit, fields=requested, after=cursor)
+    if requested:
+        response = sparse_response(ItemSchema, items, requested)
+    if items and len(items) == limit:
+        response.headers["X-Next-Cursor"] = f"{items[-1].owner_id}:{items[-1].id}"
+    return response if requested else items
 
 
 @router.get("/users/me/items", response_model=List[ItemSchema], tags=['items'])
 async def read_user_items(
-    skip: int = 0,
-    limit: int = 0,
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=settings.MAX_PAGE_LIMIT),
+    fields: Optional[str] = None,
     current_user: UserSchema = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     GET Get user me items list
+
+    Every item write bumps the user version, so the ETag comes from the
+    authenticated user without another query.
     """
-    items = await crud_item.get_user_items(db=db, user_id=current_user.id)
-    return items
+    cache_tags(request, owner_items_tag(current_user.id))
+    requested = parse_fields(fields, ItemSchema)
+    etag = make_etag("user-items", current_user.id, current_user.version, requested, skip, limit)
+    if is_fresh(request, etag, current_user.updated_at):
+        return not_modified(etag, current_user.updated_at)
+    items = await crud_item.get_user_items(
+        db=db, user_id=current_user.id, skip=skip, limit=limit, fields=requested)
+    if requested:
+        response = sparse_response(ItemSchema, items, requested)
+    with_validators(response, etag, current_user.updated_at)
+    return response if requested else items
+
+
+def format_event(message: Dict[str, Any]) -> str:
+    """
+    Format an event message as a server-sent event
+    """
+    return f"id: {message['id']}\nevent: {message['type']}\ndata: {json.dumps(message['data'], default=str)}\n\n"
+
+
+async def event_stream(
+    subscription: Subscription,
+    missed: List[Dict[str, Any]],
+    reset: bool,
+    after: Optional[int]
+) -> AsyncIterator[str]:
+    """
+    Stream the item events of a user: the missed ones first when resuming,
+    then the live ones (skipping those already sent), with a keep-alive
+    comment when idle
+
+    Sent ids are remembered rather than the highest one: a lower id may
+    commit after a higher one was sent.
+    """
+    sent: Set[int] = set() if after is None else {after}
+    order: Deque[int] = deque(sent)
+
+    def first_time(message: Dict[str, Any]) -> bool:
+        if message["id"] in sent:
+            return False
+        sent.add(message["id"])
+        order.append(message["id"])
+        if len(order) > settings.EVENTS_REPLAY_LIMIT + settings.EVENTS_QUEUE_SIZE:
+            sent.discard(order.popleft())
+        return True
+
+    try:
+        yield f"retry: {int(settings.EVENTS_HEARTBEAT * 1000)}\n\n"
+        if reset:
+            yield "event: reset\ndata: {}\n\n"
+        for message in missed:
+            if first_time(message):
+                yield format_event(message)
+        while not subscription.closed:
+            message = await subscription.get(timeout=settings.EVENTS_HEARTBEAT)
+            if message is None:
+                yield ": keep-alive\n\n"
+            elif first_time(message):
+                yield format_event(message)
+    finally:
+        events.broker.unsubscribe(subscription)
+
+
+# declared before /users/me/items/{item_id}, which would take "events" for an id
+@router.get("/users/me/items/events", tags=['items'])
+async def read_user_item_events(
+    last_event_id: Optional[int] = Query(None),
+    last_event_id_header: Optional[int] = Header(None, alias="Last-Event-ID"),
+    current_user: UserSchema = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    GET Stream user me items changes (text/event-stream)
+
+    Events are created, updated, deleted and imported, with the item (or
+    the imported count) as data. A client resumes with the Last-Event-ID
+    header, or last_event_id; a reset event means it must reload its items.
+    Ids are not sent in increasing order, and the events of the seconds
+    before a resume point are sent again: apply them by id.
+    """
+    after = last_event_id_header if last_event_id_header is not None else last_event_id
+    subscription = events.broker.subscribe(current_user.id)  # before the replay, so nothing falls in between
+    missed, reset = events.resume(db, current_user.id, after) if after is not None else ([], False)
+    return StreamingResponse(
+        event_stream(subscription, missed, reset, after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/users/me/items/{item_id}", response_model=ItemSchema, tags=['items'])
+async def read_user_item(
+    item_id: int,
+    request: Request,
+    response: Response,
+    current_user: UserSchema = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    GET Get user me item by id
+    """
+    version = await crud_item.get_user_item_version(db=db, id=item_id, user_id=current_user.id)
+    if version is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=dresp.NOT_FOUND)
+    etag = make_etag("item", current_user.id, item_id, version.version)
+    if is_fresh(request, etag, version.updated_at):
+        return not_modified(etag, version.updated_at)
+    db_item = await crud_item.get_user_item(db=db, id=item_id, user_id=current_user.id)
+    with_validators(response, etag, version.updated_at)
+    return db_item
+
+
+@router.put("/users/me/items/{item_id}", response_model=ItemSchema, tags=['items'])
+async def update_user_item(
+    item_id: int,
+    obj_in: ItemUpdate,
+    current_user: UserSchema = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    PUT Update user me item
+    """
+    db_item = await crud_item.update_user_item(db=db, id=item_id, user_id=current_user.id, obj_in=obj_in)
+    if db_item is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=dresp.NOT_FOUND)
+    return db_item
+
+
+@router.delete("/users/me/items/{item_id}", tags=['items'])
+async def remove_user_item(
+    item_id: int,
+    current_user: UserSchema = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    DELETE Delete user me item
+    """
+    db_item = await crud_item.remove(db=db, id=item_id, user_id=current_user.id)
+    if db_item is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=dresp.NOT_FOUND)
+    return {"detail": f"Item with id {item_id} successfully deleted"}
 
 
 @router.post("/users/{user_id}/items", response_model=ItemSchema, tags=['items'])
@@ -48,3 +223,26 @@ async def create_item_for_user(
     GET Get user list by user id
     """
     return await crud_item.create_user_item(db=db, obj_in=item, user_id=user_id)
+
+
+@router.post(
+    "/users/{user_id}/items/import",
+    tags=['admin'],
+    dependencies=[Depends(statement_timeout(settings.IMPORT_STATEMENT_TIMEOUT_MS)), Depends(get_current_user)])
+async def import_items_for_user(
+    user_id: int,
+    request: Request,
+    format: Optional[str] = Query(None, regex="^(csv|ndjson)$"),
+    db: Session = Depends(get_db)
+):
+    """
+    POST Import user items from a streamed CSV (title,description header) or NDJSON body
+    """
+    if await crud_user.get_user(db=db, user_id=user_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=dresp.NOT_FOUND)
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = NDJSON if "json" in content_type else CSV
+    result = await import_items(db=db, user_id=user_id, stream=request.stream(), format=format)
+    return result.dict()
@@ -1,21 +1,27 @@
-from typing import Any, List
+from typing import Any, List, Optional
 from datetime import timedelta
 
-from fastapi import APIRouter, HTTPException, Depends, status, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 
+from crud.crud_item import crud_item
 from crud.crud_user import crud_user
 from core.config import settings
-from services.messaging.email import send_email
+from services.cache.responses import cache_tags, user_tag
+from services.indexes.users import EMAIL, USERNAME
+from services.jobs.queue import enqueue
+from api.routing import SessionReleasingRoute
 from api.deps import get_db, oauth2_scheme, get_current_user
-from api.schemas.user import UserSchema, UserCreate, UserUpdate
+from api.fields import parse_fields, sparse_response
+from api.schemas.user import UserSchema, UserCreate, UserUpdate, UserSummary, UserMatch
+from api.conditional import is_fresh, make_etag, not_modified, with_validators
 from database.base import User
 from api import dresp
 
 
-router = APIRouter()
+router = APIRouter(route_class=SessionReleasingRoute)
 
 
 @router.post("/token", tags=['auth'])
@@ -47,14 +53,18 @@ async def login(
     tags=['admin'],
     dependencies=[Depends(get_current_user)])
 async def read_users(
-    skip: int = 0,
-    limit: int = 100,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=settings.MAX_PAGE_LIMIT),
+    fields: Optional[str] = None,
     db: Session = Depends(get_db)
 ) -> UserSchema:
     """
-    GET Get users list
+    GET Get users list, read as plain rows
     """
-    db_users = await crud_user.get_users(db=db, skip=skip, limit=limit)
+    requested = parse_fields(fields, UserSchema)
+    db_users = await crud_user.get_user_rows(db=db, skip=skip, limit=limit, fields=requested)
+    if requested:
+        return sparse_response(UserSchema, db_users, requested)
     return db_users
 
 
@@ -63,13 +73,84 @@ async def read_users(
     response_model=UserSchema,
     tags=['users'])
 async def read_users_me(
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,
     current_user: UserSchema = Depends(get_current_user),
     db: Session = Depends(get_db)
 ) -> UserSchema:
     """
     GET Get current user
     """
-    return current_user
+    requested = parse_fields(fields, UserSchema)
+    etag = make_etag("user", current_user.id, current_user.version, requested)
+    if is_fresh(request, etag, current_user.updated_at):
+        return not_modified(etag, current_user.updated_at)
+    if not requested or "items" in requested:
+        await crud_item.attach_user_items([current_user])
+    if requested:
+        response = sparse_response(UserSchema, current_user, requested)
+    with_validators(response, etag, current_user.updated_at)
+    return response if requested else current_user
+
+
+@router.get(
+    "/users/summary",
+    response_model=List[UserSummary],
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def read_user_summaries(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=settings.MAX_PAGE_LIMIT),
+    db: Session = Depends(get_db)
+) -> List[UserSummary]:
+    """
+    GET Get users list with their item counters
+    """
+    return await crud_user.get_user_summaries(db=db, skip=skip, limit=limit)
+
+
+@router.get(
+    "/users/availability",
+    tags=['users'])
+async def read_availability(
+    username: Optional[str] = Query(None, min_length=1),
+    email: Optional[str] = Query(None, min_length=1),
+    db: Session = Depends(get_db)
+) -> Any:
+    """
+    GET Check whether a username and/or an email are free, for signup forms
+
+    Most checks are answered by an in-memory filter, without a query.
+    """
+    if username is None and email is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="username or email is required")
+    availability = {}
+    if username is not None:
+        availability[USERNAME] = await crud_user.is_available(db=db, kind=USERNAME, value=username)
+    if email is not None:
+        availability[EMAIL] = await crud_user.is_available(db=db, kind=EMAIL, value=email)
+    return availability
+
+
+@router.get(
+    "/users/search",
+    response_model=List[UserMatch],
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def search_users(
+    prefix: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+) -> List[UserMatch]:
+    """
+    GET Find users by username prefix, for type-ahead
+
+    Served from an in-memory sorted index once built, else from the database.
+    """
+    matches = await crud_user.search_usernames(db=db, prefix=prefix, limit=limit)
+    return [{"id": id, "username": username} for id, username in matches]
 
 
 @router.get(
@@ -79,16 +160,53 @@ async def read_users_me(
     dependencies=[Depends(get_current_user)])
 async def read_user(
     user_id: int,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db)
 ) -> UserSchema:
     """
     GET Get user by id
+
+    The version is looked up first: an unchanged user costs one index
+    lookup and a bodiless 304.
     """
-    db_user = await crud_user.get_user(db=db, user_id=user_id)
+    cache_tags(request, user_tag(user_id))
+    requested = parse_fields(fields, UserSchema)
+    version = await crud_user.get_user_version(db=db, user_id=user_id)
+    if version is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=dresp.NOT_FOUND)
+    etag = make_etag("user", user_id, version.version, requested)
+    if is_fresh(request, etag, version.updated_at):
+        return not_modified(etag, version.updated_at)
+    db_user = await crud_user.get_user(db=db, user_id=user_id, fields=requested)
     if db_user is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=dresp.NOT_FOUND)
-    return db_user
+    if requested:
+        response = sparse_response(UserSchema, db_user, requested)
+    with_validators(response, etag, version.updated_at)
+    return response if requested else db_user
+
+
+@router.get(
+    "/users/{user_id}/summary",
+    response_model=UserSummary,
+    tags=['admin'],
+    dependencies=[Depends(get_current_user)])
+async def read_user_summary(
+    user_id: int,
+    db: Session = Depends(get_db)
+) -> UserSummary:
+    """
+    GET Get user item counters by user id
+    """
+    summary = await crud_user.get_user_summary(db=db, user_id=user_id)
+    if summary is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=dresp.NOT_FOUND)
+    return summary
 
 
 @router.post(
@@ -97,19 +215,18 @@ async def read_user(
     tags=['users'])
 async def create_user(
     obj_in: UserCreate,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ) -> UserSchema:
     """
     POST Create user
     """
-    db_user = await crud_user.get_user_by_email(db=db, email=obj_in.email)
-    if db_user:
+    if await crud_user.get_user_by_email(db=db, email=obj_in.email) is not None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Email already registered")
     if settings.SMTP_SERVER != "your_stmp_server_here":
-        background_tasks.add_task(send_email, obj_in.email,
-                                  message=f"You've created your account!")
+        # committed together with the user by create_user
+        enqueue(db, "send_email", email_recipient=obj_in.email,
+                message=f"You've created your account!")
     try:
         return await crud_user.create_user(db=db, obj_in=obj_in)
     except IntegrityError:
@@ -148,5 +265,5 @@ async def remove_user(
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail=dresp.NOT_FOUND)
-    await crud_user.remove(db=db, id=id)
+    await crud_user.remove(db=db, id=user_id)
     return {"detail": f"User with id {db_user.id} successfully deleted"}
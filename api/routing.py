@@ -0,0 +1,217 @@
+'''routing.py
+Route class releasing database connections before response serialisation,
+bounding the statements of a request, dropping the work of the requests
+whose client went away and retrying the reads cut by a lost connection
+'''
+
+import asyncio
+import functools
+import logging
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, List, Optional
+
+from fastapi import status
+from fastapi.routing import APIRoute
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import Session
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+from core.config import settings
+from database.timeouts import is_timeout, timeout_ms
+from services.observability import tracing
+
+
+logger = logging.getLogger(__name__)
+
+# methods whose work can be dropped half way or done twice, see
+# cancel_on_disconnect and retry_on_lost_connection
+CANCELLABLE_METHODS = ("GET", "HEAD")
+CLIENT_CLOSED_REQUEST = 499
+
+
+# sessions opened by get_db for the current request
+request_sessions: ContextVar[Optional[List[Session]]] = ContextVar("request_sessions", default=None)
+
+
+def register_session(db: Session) -> None:
+    """
+    Let the route release a session opened for the current request
+    """
+    sessions = request_sessions.get()
+    if sessions is not None:
+        sessions.append(db)
+
+
+def release_session(db: Session) -> None:
+    """
+    End the transaction of a session so its connection goes back to the pool
+
+    The loaded objects are kept as they are (no expiry), so serialising
+    them does not query again; a lazy load still works, with a new short
+    checkout. Sessions holding unflushed changes are left untouched.
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    """
+    if not db.in_transaction() or db.new or db.dirty or db.deleted:
+        return
+    expire_on_commit = db.expire_on_commit
+    db.expire_on_commit = False
+    try:
+        db.commit()
+    finally:
+        db.expire_on_commit = expire_on_commit
+
+
+def release_after(endpoint: Callable) -> Callable:
+    """
+    Wrap an endpoint to release the request sessions as soon as it returns
+    """
+    if getattr(endpoint, "releases_sessions", False):  # already wrapped, see include_router
+        return endpoint
+
+    def release() -> None:
+        for db in request_sessions.get() or ():
+            release_session(db)
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            response = await endpoint(*args, **kwargs)
+            release()
+            return response
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            response = endpoint(*args, **kwargs)
+            release()
+            return response
+    wrapper.releases_sessions = True
+    return wrapper
+
+
+async def wait_disconnect(request: Request) -> None:
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def cancel_on_disconnect(request: Request, work: Awaitable[Response]) -> Response:
+    """
+    Run the work of a request, cancelled if the client disconnects first
+
+    The database calls are synchronous and block the event loop, so the
+    disconnect is only seen between two statements: the running one
+    completes (bounded by its statement timeout), the next ones are not
+    sent. The open transaction is rolled back when get_db closes its
+    session.
+
+    Parameters
+    ----------
+    request : Request
+        The request of app
+    work : Awaitable[Response]
+        The route handler call
+
+    Returns
+    -------
+    Response
+        The response of work, or a 499 nobody reads
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if task.done():
+        return task.result()
+    task.cancel()
+    await asyncio.wait({task})
+    logger.info("Client disconnected, %s %s cancelled", request.method, request.url.path)
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+
+async def retry_on_lost_connection(request: Request, handler: Callable[[Request], Awaitable[Response]]) -> Response:
+    """
+    Run a route handler, once more if a database connection was found dead
+    during it (database/liveness.py)
+
+    The pool has been invalidated by then, so the second run gets a new
+    connection; the sessions of the first run are rolled back and left to
+    get_db to close. Only for idempotent requests.
+
+    Parameters
+    ----------
+    request : Request
+        The request of app
+    handler : Callable[[Request], Awaitable[Response]]
+        The route handler
+
+    Returns
+    -------
+    Response
+        The response of the first or second run
+    """
+    try:
+        return await handler(request)
+    except DBAPIError as exc:
+        if not exc.connection_invalidated:
+            raise
+        logger.warning("Connection lost during %s %s, retrying once", request.method, request.url.path)
+    sessions = request_sessions.get()
+    for db in sessions or ():
+        db.rollback()
+    if sessions is not None:
+        sessions.clear()
+    return await handler(request)
+
+
+async def statement_timeout_handler(request: Request, exc: OperationalError) -> Response:
+    """
+    Answer 503 when a statement ran past the deadline of its request
+    """
+    if not is_timeout(exc):
+        raise exc
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "The request took too long, try again with a smaller page"})
+
+
+class SessionReleasingRoute(APIRoute):
+    """
+    APIRoute whose database connections are returned to the pool when the
+    endpoint returns, before response_model serialisation and the network
+    write, instead of when the get_db dependency is torn down
+
+    Its statements are bounded by settings.STATEMENT_TIMEOUT_MS, unless a
+    route sets its own (Depends(statement_timeout(ms)) in api/deps.py).
+    GET requests stop once their client has disconnected, and run once
+    more when their connection is lost. Sub-requests of POST /batch live as
+    long as the batch request.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs: Any):
+        super().__init__(path, release_after(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            tracing.set_route(request.method, self.path)
+            token = request_sessions.set([])
+            deadline_token = timeout_ms.set(settings.STATEMENT_TIMEOUT_MS or None)
+            try:
+                if request.method in CANCELLABLE_METHODS and getattr(request.state, "db", None) is None:
+                    return await cancel_on_disconnect(request, retry_on_lost_connection(request, handler))
+                return await handler(request)
+            finally:
+                timeout_ms.reset(deadline_token)
+                request_sessions.reset(token)
+
+        return route_handler
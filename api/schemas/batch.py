@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+
+
+class BatchRequestItem(BaseModel):
+    method: str = "GET"
+    path: str
+    body: Optional[Any] = None
+
+
+class BatchRequest(BaseModel):
+    requests: List[BatchRequestItem]
+
+
+class BatchResponseItem(BaseModel):
+    status: int
+    headers: Dict[str, str] = {}
+    body: Optional[Any] = None
+
+
+class BatchResponse(BaseModel):
+    responses: List[BatchResponseItem]
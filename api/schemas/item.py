@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 
@@ -8,9 +8,11 @@ class ItemBase(BaseModel):
 
 
 class ItemCreate(ItemBase):
-    pass
+    # the lengths of the items columns (models/item.py)
+    title: str = Field(..., max_length=150)
+    description: Optional[str] = Field(None, max_length=300)
 
-class ItemUpdate(ItemBase):
+class ItemUpdate(ItemCreate):
     pass
 
 
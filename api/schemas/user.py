@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel, EmailStr
 from api.schemas.item import ItemSchema
@@ -25,3 +26,18 @@ class UserSchema(UserBase):
 
     class Config:
         orm_mode = True
+
+
+class UserSummary(BaseModel):
+    id: int
+    username: Optional[str]
+    item_count: int
+    last_item_at: Optional[datetime]
+
+    class Config:
+        orm_mode = True
+
+
+class UserMatch(BaseModel):
+    id: int
+    username: str
@@ -0,0 +1,79 @@
+'''crud_statements.py
+Per call overhead of the CRUD queries, legacy Query API versus the prebuilt
+select() statements of crud/*, on an in-memory SQLite database.
+
+Run with `python -m benchmarks.crud_statements [--calls N]`
+'''
+
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from crud.crud_item import crud_item
+from crud.crud_user import crud_user
+from database.base import Base, Item, User
+from services.observability import queries
+
+
+def legacy_get(db, id):
+    return db.query(User).filter(User.id == id).first()
+
+
+def legacy_get_user_by_username(db, username):
+    return db.query(User).filter(User.username == username).first()
+
+
+def legacy_get_user_items(db, user_id):
+    return db.query(Item).filter(Item.owner_id == user_id).offset(0).limit(100).all()
+
+
+async def measure(name: str, calls: int, func, *args) -> float:
+    result = func(*args)
+    if asyncio.iscoroutine(result):
+        await result
+    started = time.perf_counter()
+    for _ in range(calls):
+        result = func(*args)
+        if asyncio.iscoroutine(result):
+            await result
+    per_call = (time.perf_counter() - started) / calls * 1e6
+    print(f"{name:<40} {per_call:>10.1f} us/call")
+    return per_call
+
+
+async def main(calls: int) -> None:
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    queries.install(engine)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    for i in range(1000):
+        db.add(User(username=f"user{i}", email=f"user{i}@app.com", hashed_password="x"))
+    db.flush()
+    for i in range(1000):
+        db.add(Item(title=f"item{i}", owner_id=i % 10 + 1))
+    db.commit()
+
+    pairs = [
+        ("get", (legacy_get, db, 5), (crud_user.get, db, 5)),
+        ("get_user_by_username",
+         (legacy_get_user_by_username, db, "user5"),
+         (crud_user.get_user_by_username, db, "user5")),
+        ("get_user_items",
+         (legacy_get_user_items, db, 3),
+         (crud_item.get_user_items, db, 3)),
+    ]
+    for name, legacy, current in pairs:
+        before = await measure(f"{name} (db.query)", calls, *legacy)
+        after = await measure(f"{name} (select)", calls, *current)
+        print(f"{'':<40} {before / after:>10.2f}x")
+    print("statement cache:", queries.registry.cache_stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=5000)
+    asyncio.run(main(parser.parse_args().calls))
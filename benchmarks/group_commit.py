@@ -0,0 +1,67 @@
+'''group_commit.py
+Throughput of concurrent item creates, one transaction each versus group
+commit (settings.ITEM_BATCH_WINDOW_MS), on a SQLite file database synced
+on every commit.
+
+Run with `python -m benchmarks.group_commit [--creates 2000] [--concurrency 200] [--window-ms 2]`
+'''
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event
+
+from api.schemas.item import ItemCreate
+from core.config import settings
+from crud.crud_item import crud_item
+from database.base import Base, User
+from database.setup import SessionLocal
+
+
+async def run(creates: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def create(i):
+        async with semaphore:
+            with SessionLocal() as db:
+                await crud_item.create_user_item(
+                    db=db, obj_in=ItemCreate(title=f"item{i}", description="description"), user_id=i % 100 + 1)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[create(i) for i in range(creates)])
+    return creates / (time.perf_counter() - started)
+
+
+def main(creates: int, concurrency: int, window_ms: float) -> None:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+
+    @event.listens_for(engine, "connect")
+    def synchronous_full(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA synchronous = FULL")
+
+    Base.metadata.create_all(bind=engine)
+    SessionLocal.configure(bind=engine)
+    with SessionLocal() as db:
+        db.add_all([User(username=f"user{i}", email=f"user{i}@app.com", hashed_password="x") for i in range(100)])
+        db.commit()
+
+    loop = asyncio.get_event_loop()
+    settings.ITEM_BATCH_WINDOW_MS = 0
+    single = loop.run_until_complete(run(creates, concurrency))
+    print(f"{'one transaction each':<24} {single:>10.0f} creates/s")
+    settings.ITEM_BATCH_WINDOW_MS = window_ms
+    batched = loop.run_until_complete(run(creates, concurrency))
+    print(f"{'group commit':<24} {batched:>10.0f} creates/s  {batched / single:.1f}x  {crud_item.batcher.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--creates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--window-ms", type=float, default=2)
+    args = parser.parse_args()
+    main(args.creates, args.concurrency, args.window_ms)
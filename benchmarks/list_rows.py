@@ -0,0 +1,75 @@
+'''list_rows.py
+Cost of a list page, ORM objects versus the plain rows of
+CRUDBase.get_multi_rows, read and serialised with the response schema,
+on an in-memory SQLite database.
+
+Run with `python -m benchmarks.list_rows [--pages 100 1000 10000]`
+'''
+
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from api.schemas.item import ItemSchema
+from crud.crud_item import crud_item
+from database.base import Base, Item, User
+
+
+def serialise(items):
+    return jsonable_encoder([ItemSchema.from_orm(item) for item in items])
+
+
+async def orm_page(db, limit):
+    return serialise(await crud_item.get_multi(db=db, limit=limit))
+
+
+async def rows_page(db, limit):
+    return serialise(await crud_item.get_item_rows(db=db, limit=limit))
+
+
+async def measure(db, func, limit: int, repeat: int):
+    await func(db, limit)
+    db.expunge_all()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await func(db, limit)
+        db.expunge_all()  # a new session per request
+    per_page = (time.perf_counter() - started) / repeat * 1000
+    tracemalloc.start()
+    await func(db, limit)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.expunge_all()
+    return per_page, peak
+
+
+async def main(pages) -> None:
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(User(username="user", email="user@app.com", hashed_password="x"))
+    db.flush()
+    db.execute(insert(Item), [
+        {"title": f"item{i}", "description": "description", "owner_id": 1} for i in range(max(pages))
+    ])
+    db.commit()
+
+    print(f"{'rows':>8} {'orm ms':>10} {'rows ms':>10} {'cpu':>7} {'orm KiB':>10} {'rows KiB':>10} {'memory':>7}")
+    for limit in pages:
+        repeat = max(3, 20000 // limit)
+        orm_ms, orm_peak = await measure(db, orm_page, limit, repeat)
+        rows_ms, rows_peak = await measure(db, rows_page, limit, repeat)
+        print(f"{limit:>8} {orm_ms:>10.2f} {rows_ms:>10.2f} {orm_ms / rows_ms:>6.2f}x "
+              f"{orm_peak / 1024:>10.0f} {rows_peak / 1024:>10.0f} {orm_peak / rows_peak:>6.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 1000, 10000])
+    asyncio.run(main(parser.parse_args().pages))
@@ -0,0 +1,91 @@
+'''startup.py
+Import time of the app, measured in fresh interpreters with -X importtime
+
+    python -m benchmarks.startup [--module main] [--runs 5] [--top 15]
+
+Prints the median wall time of `import main`, then the slowest imports
+by cumulative and by self time (of the median run), to find what to defer.
+Heavy optional dependencies (DEFERRED) must not be imported by the app at
+startup: they are loaded by the code path that needs them.
+
+tests/test_startup.py always checks DEFERRED; it only checks BUDGET_MS, a
+wall time, when STARTUP_BUDGET is set (1, or a budget in ms).
+'''
+
+import argparse
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+
+BUDGET_MS = 1500  # import main, in a fresh interpreter
+DEFERRED = ("sentry_sdk", "numpy", "passlib.context", "uvicorn")
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def import_profile(module: str = "main") -> Tuple[float, List[Tuple[str, int, int, int]]]:
+    """
+    Import a module in a fresh interpreter
+
+    Parameters
+    ----------
+    module : str, default="main"
+        A module to import
+
+    Returns
+    -------
+    Tuple[float, List[Tuple[str, int, int, int]]]
+        The wall time in ms, and (name, self us, cumulative us, depth) per
+        imported module
+    """
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    imports = [
+        (match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2)
+        for match in map(LINE.match, result.stderr.splitlines()) if match
+    ]
+    return elapsed, imports
+
+
+def loaded_modules(module: str = "main") -> List[str]:
+    """
+    Get the modules in sys.modules after importing a module in a fresh
+    interpreter
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys, {module}; print(*sorted(sys.modules))"],
+        capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def main(module: str, runs: int, top: int) -> None:
+    profiles = sorted((import_profile(module) for _ in range(runs)), key=lambda profile: profile[0])
+    elapsed, imports = profiles[len(profiles) // 2]
+    print(f"import {module}: {elapsed:.0f} ms median of {runs} "
+          f"(min {profiles[0][0]:.0f}, max {profiles[-1][0]:.0f}, budget {BUDGET_MS})")
+
+    by_name: Dict[str, Tuple[int, int, int]] = {name: (own, cumulative, depth) for name, own, cumulative, depth in imports}
+    print(f"\n{'cumulative ms':>14} {'self ms':>8}  module")
+    for name, (own, cumulative, depth) in sorted(by_name.items(), key=lambda item: -item[1][1])[:top]:
+        print(f"{cumulative / 1000:>14.1f} {own / 1000:>8.1f}  {'  ' * depth}{name}")
+    print(f"\n{'self ms':>8}  module")
+    for name, (own, _, _) in sorted(by_name.items(), key=lambda item: -item[1][0])[:top]:
+        print(f"{own / 1000:>8.1f}  {name}")
+
+    loaded = set(loaded_modules(module))
+    eager = [name for name in DEFERRED if name in loaded]
+    print(f"\ndeferred dependencies imported at startup: {', '.join(eager) or 'none'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+    main(args.module, args.runs, args.top)
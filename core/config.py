@@ -35,4 +35,75 @@ class Settings(BaseSettings):
     CORS_ORIGINS: str = os.environ.get("CORS_ORIGINS", "")
     SENTRY_URL: str = os.environ.get("SENTRY_URL", "")
 
+    # background jobs (services/jobs)
+    JOB_BATCH_SIZE: int = os.environ.get("JOB_BATCH_SIZE", 10)
+    JOB_VISIBILITY_TIMEOUT: int = os.environ.get("JOB_VISIBILITY_TIMEOUT", 60)  # seconds
+    JOB_MAX_ATTEMPTS: int = os.environ.get("JOB_MAX_ATTEMPTS", 5)
+    JOB_POLL_INTERVAL: float = os.environ.get("JOB_POLL_INTERVAL", 1.0)  # seconds
+    JOB_WORKER_PROCESSES: int = os.environ.get("JOB_WORKER_PROCESSES", 1)
+
+    # batch endpoint
+    BATCH_MAX_REQUESTS: int = os.environ.get("BATCH_MAX_REQUESTS", 20)
+
+    # request profiler (services/observability/profiler.py)
+    PROFILE_TOKEN: str = os.environ.get("PROFILE_TOKEN", "")  # X-Profile header value, disabled when empty
+    PROFILE_SAMPLE_RATE: float = os.environ.get("PROFILE_SAMPLE_RATE", 0.0)
+    PROFILE_INTERVAL: float = os.environ.get("PROFILE_INTERVAL", 0.001)  # seconds between stack samples
+    PROFILE_DIR: str = os.environ.get("PROFILE_DIR", "profiles")
+
+    # request tracing (services/observability/tracing.py)
+    TRACE_SAMPLE_RATE: float = os.environ.get("TRACE_SAMPLE_RATE", 0.0)  # share of traces kept, at the root
+    TRACE_EXPORTER: str = os.environ.get("TRACE_EXPORTER", "file")  # file or otlp
+    TRACE_FILE: str = os.environ.get("TRACE_FILE", "traces/spans.jsonl")
+    TRACE_OTLP_ENDPOINT: str = os.environ.get("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+
+    # statement statistics (services/observability/queries.py)
+    SLOW_QUERY_MS: float = os.environ.get("SLOW_QUERY_MS", 200)
+
+    # bulk item import (services/importer)
+    IMPORT_CHUNK_SIZE: int = os.environ.get("IMPORT_CHUNK_SIZE", 5000)  # rows per transaction
+    IMPORT_MAX_ERRORS: int = os.environ.get("IMPORT_MAX_ERRORS", 100)  # row errors kept in the report
+
+    # item create batching (database/batching.py), off when the window is 0
+    ITEM_BATCH_WINDOW_MS: float = os.environ.get("ITEM_BATCH_WINDOW_MS", 0)  # wait of the first create of a batch
+    ITEM_BATCH_MAX_ROWS: int = os.environ.get("ITEM_BATCH_MAX_ROWS", 100)  # creates per transaction
+
+    # items shards (database/shards.py), comma separated urls, off when empty
+    SHARD_URLS: str = os.environ.get("SHARD_URLS", "")
+
+    # item change feed (services/events)
+    EVENTS_CHANNEL: str = os.environ.get("EVENTS_CHANNEL", "item_events")  # postgres NOTIFY channel
+    EVENTS_HEARTBEAT: float = os.environ.get("EVENTS_HEARTBEAT", 15)  # seconds between keep-alive comments
+    EVENTS_QUEUE_SIZE: int = os.environ.get("EVENTS_QUEUE_SIZE", 1000)  # undelivered events per stream
+    EVENTS_REPLAY_LIMIT: int = os.environ.get("EVENTS_REPLAY_LIMIT", 1000)  # events replayed on resume
+    EVENTS_RESUME_WINDOW: float = os.environ.get("EVENTS_RESUME_WINDOW", 10)  # seconds of late events replayed again on resume
+    EVENTS_RETENTION_HOURS: int = os.environ.get("EVENTS_RETENTION_HOURS", 24)
+
+    # response cache (services/cache), off when the TTL is 0
+    RESPONSE_CACHE_TTL: float = os.environ.get("RESPONSE_CACHE_TTL", 60)  # seconds
+    RESPONSE_CACHE_SIZE: int = os.environ.get("RESPONSE_CACHE_SIZE", 10000)  # entries per process
+    CACHE_CHANNEL: str = os.environ.get("CACHE_CHANNEL", "cache_purge")  # postgres NOTIFY channel
+
+    # request limits (database/timeouts.py, api/routing.py)
+    STATEMENT_TIMEOUT_MS: int = os.environ.get("STATEMENT_TIMEOUT_MS", 5000)  # per statement, off when 0
+    IMPORT_STATEMENT_TIMEOUT_MS: int = os.environ.get("IMPORT_STATEMENT_TIMEOUT_MS", 60000)
+    MAX_PAGE_LIMIT: int = os.environ.get("MAX_PAGE_LIMIT", 1000)  # largest limit of the list endpoints
+
+    # connection liveness (database/liveness.py), in place of pool_pre_ping
+    LIVENESS_IDLE_PING: float = os.environ.get("LIVENESS_IDLE_PING", 30)  # seconds idle before a checkout pings
+    LIVENESS_PING_INTERVAL: float = os.environ.get("LIVENESS_PING_INTERVAL", 10)  # seconds, pinger off when 0
+
+    # warm-up and drain (api/lifecycle.py)
+    WARMUP_CONNECTIONS: int = os.environ.get("WARMUP_CONNECTIONS", 5)  # pooled connections opened on startup
+    DRAIN_TIMEOUT: float = os.environ.get("DRAIN_TIMEOUT", 30)  # seconds waited for the requests in flight
+    DRAIN_TOKEN: str = os.environ.get("DRAIN_TOKEN", "")  # X-Drain-Token of POST /health/drain, disabled when empty
+
+    # username/email availability filter (services/indexes)
+    AVAILABILITY_CAPACITY: int = os.environ.get("AVAILABILITY_CAPACITY", 1000000)  # keys, 2 per user
+    AVAILABILITY_ERROR_RATE: float = os.environ.get("AVAILABILITY_ERROR_RATE", 0.001)  # share of checks querying
+    USERS_INDEX_CHANNEL: str = os.environ.get("USERS_INDEX_CHANNEL", "users_index")  # postgres NOTIFY channel
+
+    # admin stats rollups (services/stats)
+    STATS_REFRESH_INTERVAL: int = os.environ.get("STATS_REFRESH_INTERVAL", 300)  # seconds before a refresh is queued
+
 settings = Settings()
@@ -1,8 +1,13 @@
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Generic, List, Optional, Sequence, Tuple, Type, TypeVar, Union
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, inspect, select
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session, load_only, noload, selectinload
+from sqlalchemy.sql import Select
 
 from database.base import Base
 
@@ -11,6 +16,20 @@ CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
 
+@lru_cache(maxsize=64)
+def record_type(name: str, fields: Tuple[str, ...]) -> type:
+    """
+    Build (once per field set) a __slots__ class holding one row and the
+    values attached to it (e.g. the items of a user row), for the read
+    only list paths: no instance dict, no ORM state
+    """
+    def __init__(self, *values: Any) -> None:
+        for field, value in zip(fields, values):
+            setattr(self, field, value)
+
+    return type(name, (), {"__slots__": fields, "__init__": __init__})
+
+
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     """
     CRUD object with default methods to Create, Read, Update, Delete (CRUD).
@@ -24,25 +43,79 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     ----------
     model: Type[ModelType]
         model object bound Base
+    page_order: Tuple[Any, ...]
+        The columns ordering the pages, the primary key when empty: offset
+        pages without an order may repeat or skip rows
+    get_statement: Select
+        SELECT by id, built once and executed with an "id" parameter
+    get_multi_statement: Select
+        SELECT page, built once and executed with "skip" and "limit" parameters
+    row_statements: Dict[Tuple[str, ...], Select]
+        SELECT page of some columns, built once per field set
 
     Methods
     -------
-    get(self, db: Session, id: Any) -> Optional[ModelType]
+    load_options(self, fields: Optional[Sequence[str]]) -> List[Any]
+        Get loader options that only load the requested fields
+    get(self, db: Session, id: Any, fields: Optional[Sequence[str]] = None) -> Optional[ModelType]
         Get query by id
-    get_multi(self, db: Session, *, skip: int = 0, limit: int = 100) -> List[ModelType]
+    get_multi(self, db: Session, *, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None) -> List[ModelType]
         Get queries list with skip and limit filter query
+    columns(self, fields: Sequence[str]) -> Tuple[Any, ...]
+        Get the table columns of fields
+    get_multi_rows(self, db: Session, *, skip: int = 0, limit: int = 100, fields: Sequence[str]) -> List[Row]
+        Get a page of plain rows, for read only lists
     create(self, db: Session, *, obj_in: CreateSchemaType) -> ModelType
         Create new query
+    assign(self, db_obj: ModelType, obj_in: Union[UpdateSchemaType, Dict[str, Any]]) -> ModelType
+        Set the updated columns of an object and bump its version
     update(db: Session, *, db_obj: ModelType, obj_in: Union[UpdateSchemaType, Dict[str, Any]]) -> ModelType
         Update existing query
     remove(self, db: Session, *, id: int) -> ModelType
         Delete existing query by id
     """
 
-    def __init__(self, model: Type[ModelType]):
+    def __init__(self, model: Type[ModelType], page_order: Sequence[Any] = ()):
         self.model = model
+        self.page_order = tuple(page_order) or (model.id,)
+        # statements are built once and only bound per call, which skips the
+        # Python side construction and always hits the compiled cache
+        self.get_statement = select(model).where(model.id == bindparam("id"))
+        self.get_multi_statement = select(model).order_by(*self.page_order) \
+            .offset(bindparam("skip")).limit(bindparam("limit"))
+        self.row_statements: Dict[Tuple[str, ...], Select] = {}
+
+    def load_options(self, fields: Optional[Sequence[str]]) -> List[Any]:
+        """
+        Get loader options that only load the requested fields
+
+        Columns outside fields are deferred (the primary key is always
+        loaded), relationships outside fields are not loaded at all and
+        requested relationships are loaded with one extra SELECT IN query.
+
+        Parameters
+        ----------
+        fields : Optional[Sequence[str]]
+            A list of column or relationship names, or None for the defaults
+
+        Returns
+        -------
+        List[Any]
+            A list of loader options for Query.options
+        """
+        if not fields:
+            return []
+        mapper = inspect(self.model)
+        columns = [
+            getattr(self.model, attr.key) for attr in mapper.column_attrs if attr.key in fields
+        ]
+        options = [load_only(*(columns or [self.model.id]))]
+        for relationship in mapper.relationships:
+            attr = getattr(self.model, relationship.key)
+            options.append(selectinload(attr) if relationship.key in fields else noload(attr))
+        return options
 
-    async def get(self, db: Session, id: Any) -> Optional[ModelType]:
+    async def get(self, db: Session, id: Any, fields: Optional[Sequence[str]] = None) -> Optional[ModelType]:
         """
         Get query by id
 
@@ -52,16 +125,19 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             The session database of app
         id : int
             An id that wanted to get
+        fields : Optional[Sequence[str]], default=None
+            A list of fields to load, every field when empty
 
         Returns
         -------
         Object
             An object of ModelType (depend on schema inheritance used)
         """
-        return db.query(self.model).filter(self.model.id == id).first()
+        stmt = self.get_statement.options(*self.load_options(fields)) if fields else self.get_statement
+        return db.execute(stmt, {"id": id}).scalars().first()
 
     async def get_multi(
-        self, db: Session, *, skip: int = 0, limit: int = 100
+        self, db: Session, *, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None
     ) -> List[ModelType]:
         """
         Get queries list with skip and limit filter query
@@ -74,13 +150,56 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             A id that wanted to skip
         limit : int, default=100
             A limit of list data
+        fields : Optional[Sequence[str]], default=None
+            A list of fields to load, every field when empty
 
         Returns
         -------
         List[Object]
             An object list of ModelType (depend on schema inheritance used)
         """
-        return db.query(self.model).offset(skip).limit(limit).all()
+        stmt = self.get_multi_statement.options(*self.load_options(fields)) if fields else self.get_multi_statement
+        return db.execute(stmt, {"skip": skip, "limit": limit}).scalars().all()
+
+    def columns(self, fields: Sequence[str]) -> Tuple[Any, ...]:
+        """
+        Get the table columns of fields, in table order; names that are not
+        columns (relationships) are left out
+        """
+        return tuple(column for column in self.model.__table__.columns if column.key in fields)
+
+    async def get_multi_rows(
+        self, db: Session, *, skip: int = 0, limit: int = 100, fields: Sequence[str]
+    ) -> List[Row]:
+        """
+        Get a page of plain rows with skip and limit filter query
+
+        The rows come straight from a Core select() of the columns: no
+        object is built, tracked in the identity map or instrumented,
+        which is all a read only list serialised at once needs.
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        skip : int, default=0
+            A id that wanted to skip
+        limit : int, default=100
+            A limit of list data
+        fields : Sequence[str]
+            A list of fields to select, usually those of the response schema
+
+        Returns
+        -------
+        List[Row]
+            A list of named rows, read by attribute like the objects
+        """
+        key = tuple(fields)
+        stmt = self.row_statements.get(key)
+        if stmt is None:
+            stmt = self.row_statements[key] = select(*self.columns(key)).order_by(*self.page_order) \
+                .offset(bindparam("skip")).limit(bindparam("limit"))
+        return db.execute(stmt, {"skip": skip, "limit": limit}).all()
 
     async def create(self, db: Session, *, obj_in: CreateSchemaType) -> ModelType:
         """
@@ -133,17 +252,42 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         Object
             An object of ModelType (depend on schema inheritance used)
         """
-        obj_data = jsonable_encoder(db_obj)
+        self.assign(db_obj, obj_in)
+        db.add(db_obj)
+        db.commit()
+        db.refresh(db_obj)
+        return db_obj
+
+    def assign(self, db_obj: ModelType, obj_in: Union[UpdateSchemaType, Dict[str, Any]]) -> ModelType:
+        """
+        Set the updated columns of an object and bump its version
+
+        Only mapped columns are set (relationships and unknown keys are
+        ignored). Models with a version column get version + 1, computed
+        by the database, and a new updated_at.
+
+        Parameters
+        ----------
+        db_obj : ModelType
+            A model type object
+        obj_in : Union[UpdateSchemaType, Dict[str, Any]]
+            A body request object
+
+        Returns
+        -------
+        Object
+            The same object of ModelType, not flushed
+        """
         if isinstance(obj_in, dict):
             update_data = obj_in
         else:
             update_data = obj_in.dict(exclude_unset=True)
-        for field in obj_data:
-            if field in update_data:
-                setattr(db_obj, field, update_data[field])
-        db.add(db_obj)
-        db.commit()
-        db.refresh(db_obj)
+        columns = {attr.key for attr in inspect(self.model).column_attrs}
+        for field in columns & update_data.keys():
+            setattr(db_obj, field, update_data[field])
+        if "version" in columns:
+            db_obj.version = self.model.version + 1
+            db_obj.updated_at = datetime.utcnow()
         return db_obj
 
     async def remove(self, db: Session, *, id: int) -> ModelType:
@@ -162,7 +306,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         Object
             An object of ModelType (depend on schema inheritance used)
         """
-        obj = db.query(self.model).get(id)
+        obj = db.get(self.model, id)
         db.delete(obj)
         db.commit()
         return obj
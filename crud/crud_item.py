@@ -1,8 +1,53 @@
+import csv
+import io
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from core.config import settings
+from database.batching import GroupCommitter
+from database.setup import SessionLocal
+from database.shards import scatter_gather_items, shard_router
 from models.item import Item
+from models.user import User
 from api.schemas.item import ItemCreate
 from crud.base import CRUDBase
 from api.schemas.item import ItemSchema, ItemCreate, ItemUpdate
+from services.cache import responses as cache
+from services.events import items as events
+from services.observability import tracing
+
+
+get_user_items_statement = select(Item).where(Item.owner_id == bindparam("user_id")) \
+    .offset(bindparam("skip")).limit(bindparam("limit"))
+get_user_item_statement = select(Item) \
+    .where(Item.id == bindparam("id"), Item.owner_id == bindparam("user_id"))
+get_user_item_version_statement = select(Item.version, Item.updated_at) \
+    .where(Item.id == bindparam("id"), Item.owner_id == bindparam("user_id"))
+add_user_items_statement = update(User).where(User.id == bindparam("user_id")) \
+    .values(item_count=User.item_count + bindparam("count"), last_item_at=bindparam("now"),
+            version=User.version + 1, updated_at=bindparam("now")) \
+    .execution_options(synchronize_session=False)
+# columns of ItemSchema, and the (owner_id, id) cursor key
+ITEM_FIELDS = tuple(ItemSchema.__fields__)
+KEY_FIELDS = ("id", "owner_id")
+
+logger = logging.getLogger(__name__)
+
+touch_user_statement = update(User).where(User.id == bindparam("user_id")) \
+    .values(version=User.version + 1, updated_at=bindparam("now")) \
+    .execution_options(synchronize_session=False)
+
+
+def purge_user_items(db: Session, user_id: int) -> None:
+    """
+    Purge the cached responses showing the items of a user
+    """
+    cache.purge(db, cache.ITEMS, cache.owner_items_tag(user_id), cache.user_tag(user_id))
 
 
 class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
@@ -18,13 +63,43 @@ class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
     -------
     get_item_by_id(self, db: Session, id: int) -> ItemSchema
         Get item by id
-    get_items(self, db: Session, skip: int = 0, limit: int = 100) -> ItemSchema
-        Get items list with skip and limit filter query
-    get_user_items(self, db: Session, user_id: int, skip: int = 0, limit: int = 100) -> ItemSchema
+    get_items(self, db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None, after: Optional[Tuple[int, int]] = None) -> ItemSchema
+        Get items list with skip and limit filter query, or after a (owner_id, id) cursor
+    get_item_rows(self, db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None, after: Optional[Tuple[int, int]] = None) -> List[Row]
+        Get items list as plain rows, for read only lists
+    get_owner_item_rows(self, db: Session, user_ids: Sequence[int]) -> Dict[int, List[Row]]
+        Get the items of users as plain rows, by owner
+    get_user_items(self, db: Session, user_id: int, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None) -> ItemSchema
         Get user items list with skip and limit filter query
+    get_user_item(self, db: Session, id: int, user_id: int) -> ItemSchema
+        Get user item by id
+    get_user_item_version(self, db: Session, id: int, user_id: int) -> Any
+        Get user item version and updated_at
     create_user_item(self, db: Session, item: ItemCreate, user_id: int) -> ItemSchema
-        Create new user item
+        Create new user item, batched with concurrent creates when enabled
+    write_item_batch(self, entries: List[Tuple[ItemCreate, int]]) -> List[Union[Item, Exception]]
+        Create the items of a batch in one transaction
+    bulk_create_user_items(self, db: Session, rows: List[Dict[str, Any]], user_id: int) -> int
+        Create many user items in one transaction
+    update_user_item(self, db: Session, *, id: int, user_id: int, obj_in: ItemUpdate) -> ItemSchema
+        Update existing user item
+    remove(self, db: Session, *, id: int, user_id: Optional[int] = None) -> ItemSchema
+        Delete existing item by id
+    attach_user_items(self, users: List[User]) -> None
+        Load the items relationship of users from their shards
+
+    Every write keeps users.item_count and users.last_item_at in step and
+    records an event of the change feed (services/events) and purges the
+    cached responses of the owner (services/cache), in the same
+    transaction. With settings.SHARD_URLS the items live on the
+    shard of their owner (database/shards.py): the item write commits
+    first, then the counters on the primary database, and a crash between
+    the two is repaired by crud_user.reconcile_item_counts.
+
+    With settings.ITEM_BATCH_WINDOW_MS, the creates of concurrent requests
+    are committed together (database/batching.py).
     """
+    batcher: Optional[GroupCommitter] = None
 
     async def get_item_by_id(self, db: Session, id: int) -> ItemSchema:
         """
@@ -44,10 +119,20 @@ class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
         """
         return super().get(db=db, id=id)
 
-    async def get_items(self, db: Session, skip: int = 0, limit: int = 100) -> ItemSchema:
+    async def get_items(
+        self,
+        db: Session,
+        skip: int = 0,
+        limit: int = 100,
+        fields: Optional[Sequence[str]] = None,
+        after: Optional[Tuple[int, int]] = None
+    ) -> ItemSchema:
         """
         Get items list with skip and limit filter query
 
+        The items are ordered by (owner_id, id), the key of the cursors;
+        sharded, they are read from every shard (scatter-gather).
+
         Parameters
         ----------
         db : Session
@@ -56,15 +141,97 @@ class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
             An id that wanted to skip
         limit : int, default=100
             A limit of list data
+        fields : Optional[Sequence[str]], default=None
+            A list of fields to load, every field when empty
+        after : Optional[Tuple[int, int]], default=None
+            A (owner_id, id) cursor, items strictly after it are returned
 
         Returns
         -------
         Object
             An object of ItemSchema
         """
-        return db.query(Item).offset(skip).limit(limit).all()
+        if fields and "owner_id" not in fields:  # the cursor key is always loaded
+            fields = (*fields, "owner_id")
+        if not shard_router.enabled and after is None:
+            return await super().get_multi(db=db, skip=skip, limit=limit, fields=fields)
+        with shard_router.items_sessions(db) as sessions:
+            return scatter_gather_items(
+                sessions, skip=skip, limit=limit, after=after, options=self.load_options(fields))
+
+    async def get_item_rows(
+        self,
+        db: Session,
+        skip: int = 0,
+        limit: int = 100,
+        fields: Optional[Sequence[str]] = None,
+        after: Optional[Tuple[int, int]] = None
+    ) -> List[Row]:
+        """
+        Get items list as plain rows (CRUDBase.get_multi_rows), same
+        paging as get_items
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        skip : int, default=0
+            An id that wanted to skip
+        limit : int, default=100
+            A limit of list data
+        fields : Optional[Sequence[str]], default=None
+            A list of fields to select, those of ItemSchema when empty
+        after : Optional[Tuple[int, int]], default=None
+            A (owner_id, id) cursor, items strictly after it are returned
+
+        Returns
+        -------
+        List[Row]
+            A list of named rows, owner_id and id always included
+        """
+        fields = tuple(name for name in ITEM_FIELDS if name in (fields or ITEM_FIELDS) or name in KEY_FIELDS)
+        if not shard_router.enabled and after is None:
+            return await super().get_multi_rows(db=db, skip=skip, limit=limit, fields=fields)
+        with shard_router.items_sessions(db) as sessions:
+            return scatter_gather_items(
+                sessions, skip=skip, limit=limit, after=after, columns=self.columns(fields))
 
-    async def get_user_items(self, db: Session, user_id: int, skip: int = 0, limit: int = 100) -> ItemSchema:
+    async def get_owner_item_rows(self, db: Session, user_ids: Sequence[int]) -> Dict[int, List[Row]]:
+        """
+        Get the items of users as plain rows, one query per shard
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        user_ids : Sequence[int]
+            A list of owner ids
+
+        Returns
+        -------
+        Dict[int, List[Row]]
+            The rows of ItemSchema fields by owner id, ordered by id
+        """
+        items: Dict[int, List[Row]] = {user_id: [] for user_id in user_ids}
+        if not items:
+            return items
+        by_shard: Dict[int, List[int]] = {}
+        for user_id in items:
+            by_shard.setdefault(shard_router.shard_for(user_id) if shard_router.enabled else -1, []).append(user_id)
+        for index, owner_ids in by_shard.items():
+            stmt = select(*self.columns(ITEM_FIELDS)).where(Item.owner_id.in_(owner_ids)).order_by(Item.id)
+            if index < 0:
+                rows = db.execute(stmt).all()
+            else:
+                with shard_router.sessionmakers[index]() as shard_db:
+                    rows = shard_db.execute(stmt).all()
+            for row in rows:
+                items[row.owner_id].append(row)
+        return items
+
+    async def get_user_items(
+        self, db: Session, user_id: int, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None
+    ) -> ItemSchema:
         """
         Get user items list with skip and limit filter query
 
@@ -78,13 +245,59 @@ class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
             An id that wanted to skip
         limit : int, default=100
             A limit of list data
+        fields : Optional[Sequence[str]], default=None
+            A list of fields to load, every field when empty
 
         Returns
         -------
         Object
             An object of ItemSchema
         """
-        return db.query(Item).filter(Item.owner_id == user_id).offset(skip).limit(limit).all()
+        stmt = get_user_items_statement.options(*self.load_options(fields)) if fields else get_user_items_statement
+        with shard_router.items_session(db, user_id) as items_db:
+            return items_db.execute(stmt, {"user_id": user_id, "skip": skip, "limit": limit}).scalars().all()
+
+    async def get_user_item(self, db: Session, id: int, user_id: int) -> ItemSchema:
+        """
+        Get user item by id
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        id : int
+            An id that wanted to get
+        user_id : int
+            An owner id of the item
+
+        Returns
+        -------
+        Object
+            An object of ItemSchema, or None when not found
+        """
+        with shard_router.items_session(db, user_id) as items_db:
+            return items_db.execute(get_user_item_statement, {"id": id, "user_id": user_id}).scalars().first()
+
+    async def get_user_item_version(self, db: Session, id: int, user_id: int) -> Any:
+        """
+        Get user item version and updated_at, without loading the item
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        id : int
+            An id that wanted to get
+        user_id : int
+            An owner id of the item
+
+        Returns
+        -------
+        Any
+            A (version, updated_at) row, or None when not found
+        """
+        with shard_router.items_session(db, user_id) as items_db:
+            return items_db.execute(get_user_item_version_statement, {"id": id, "user_id": user_id}).first()
 
     async def create_user_item(self, db: Session, obj_in: ItemCreate, user_id: int) -> ItemSchema:
         """
@@ -104,10 +317,263 @@ class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
         Object
             An object of ItemSchema
         """
-        db_item = Item(**obj_in.dict(), owner_id=user_id)
-        db.add(db_item)
+        if settings.ITEM_BATCH_WINDOW_MS:
+            if self.batcher is None:
+                self.batcher = GroupCommitter(
+                    self.write_item_batch, settings.ITEM_BATCH_WINDOW_MS, settings.ITEM_BATCH_MAX_ROWS)
+            return await self.batcher.submit((obj_in, user_id))
+        now = datetime.utcnow()
+        with shard_router.items_session(db, user_id) as items_db:
+            db_item = Item(**obj_in.dict(), owner_id=user_id, created_at=now, updated_at=now)
+            items_db.add(db_item)
+            items_db.flush()
+            data = ItemSchema.from_orm(db_item).dict()
+            if items_db is not db:
+                items_db.commit()
+            db.execute(add_user_items_statement, {"user_id": user_id, "count": 1, "now": now})
+            events.record(db, user_id, events.CREATED, data)
+            purge_user_items(db, user_id)
+            db.commit()
+            items_db.refresh(db_item)
+        return db_item
+
+    def write_item_batch(self, entries: List[Tuple[ItemCreate, int]]) -> List[Union[Item, Exception]]:
+        """
+        Create the items of a batch of create_user_item calls in one
+        transaction, with their own session: the items inserted together
+        (batched with RETURNING by psycopg2), the counters, version and
+        cache purge once per owner, and the events with one flush. When the
+        batch fails before any item is committed, each item is written alone,
+        so only the failing ones get their error; items already committed on
+        their shard are returned, as create_user_item does.
+
+        Parameters
+        ----------
+        entries : List[Tuple[ItemCreate, int]]
+            The body and owner id of each item
+
+        Returns
+        -------
+        List[Union[Item, Exception]]
+            The created item, or the error, of each entry
+        """
+        written: Dict[int, Item] = {}
+        try:
+            return self._write_items(entries, written)
+        except Exception:
+            if len(entries) == 1 and not written:
+                raise
+            logger.warning("Batch of %s items failed, writing them one by one", len(entries), exc_info=True)
+        results: List[Union[Item, Exception]] = []
+        for index, entry in enumerate(entries):
+            if index in written:
+                results.append(written[index])
+                continue
+            try:
+                results.extend(self._write_items([entry], {}))
+            except Exception as exc:
+                results.append(exc)
+        return results
+
+    def _write_items(self, entries: List[Tuple[ItemCreate, int]], written: Dict[int, Item]) -> List[Item]:
+        # written gets the items committed on their shard, by entry index
+        now = datetime.utcnow()
+        items = [Item(**obj_in.dict(), owner_id=user_id, created_at=now, updated_at=now) for obj_in, user_id in entries]
+        counts: Dict[int, int] = {}
+        for item in items:
+            counts[item.owner_id] = counts.get(item.owner_id, 0) + 1
+        with SessionLocal(expire_on_commit=False) as db:
+            if shard_router.enabled:
+                by_shard: Dict[int, List[int]] = {}
+                for index, item in enumerate(items):
+                    by_shard.setdefault(shard_router.shard_for(item.owner_id), []).append(index)
+                for shard, indexes in by_shard.items():
+                    with shard_router.sessionmakers[shard](expire_on_commit=False) as shard_db:
+                        shard_db.add_all([items[index] for index in indexes])
+                        shard_db.commit()
+                    written.update((index, items[index]) for index in indexes)
+            else:
+                db.add_all(items)
+                db.flush()
+            try:
+                db.execute(add_user_items_statement, [
+                    {"user_id": user_id, "count": count, "now": now} for user_id, count in counts.items()
+                ])
+                events.record_many(db, [
+                    (item.owner_id, events.CREATED, ItemSchema.from_orm(item).dict()) for item in items
+                ])
+                for user_id in counts:
+                    purge_user_items(db, user_id)
+                db.commit()
+            except Exception:
+                if not written:
+                    raise
+                # the items are committed on their shards: writing them again would duplicate them
+                db.rollback()
+                logger.exception("Counters of %s owners not updated, repaired by reconcile_item_counts", len(counts))
+        return items
+
+    async def bulk_create_user_items(self, db: Session, rows: List[Dict[str, Any]], user_id: int) -> int:
+        """
+        Create many user items in one transaction
+
+        PostgreSQL loads the rows with COPY, other databases with one
+        executemany INSERT. No object is loaded back.
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        rows : List[Dict[str, Any]]
+            A list of validated ItemCreate dicts
+        user_id : int
+            An user id that wanted to get
+
+        Returns
+        -------
+        int
+            A number of created items
+        """
+        if not rows:
+            return 0
+        now = datetime.utcnow()
+        with shard_router.items_session(db, user_id) as items_db:
+            self._insert_rows(items_db, rows, user_id, now)
+            if items_db is not db:
+                items_db.commit()
+        db.execute(add_user_items_statement, {"user_id": user_id, "count": len(rows), "now": now})
+        events.record(db, user_id, events.IMPORTED, {"count": len(rows)})
+        purge_user_items(db, user_id)
         db.commit()
-        db.refresh(db_item)
+        return len(rows)
+
+    def _insert_rows(self, db: Session, rows: List[Dict[str, Any]], user_id: int, now: datetime) -> None:
+        """
+        Insert item rows, with COPY on PostgreSQL
+        """
+        if db.get_bind().dialect.name == "postgresql":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow((row["title"], row.get("description"), user_id, now.isoformat(), now.isoformat()))
+            buffer.seek(0)
+            cursor = db.connection().connection.cursor()
+            cursor.copy_expert(
+                "COPY items (title, description, owner_id, created_at, updated_at) FROM STDIN WITH (FORMAT csv)",
+                buffer)
+        else:
+            db.execute(insert(Item), [
+                {"title": row["title"], "description": row.get("description"),
+                 "owner_id": user_id, "created_at": now, "updated_at": now}
+                for row in rows
+            ])
+
+    async def update_user_item(self, db: Session, *, id: int, user_id: int, obj_in: ItemUpdate) -> ItemSchema:
+        """
+        Update existing user item
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        id : int
+            An id that wanted to get
+        user_id : int
+            An owner id of the item
+        obj_in : ItemUpdate
+            A body request object
+
+        Returns
+        -------
+        Object
+            An object of ItemSchema, or None when not found
+        """
+        with shard_router.items_session(db, user_id) as items_db:
+            db_item = items_db.get(Item, id)
+            if db_item is None or db_item.owner_id != user_id:
+                return None
+            self.assign(db_item, obj_in)
+            now = db_item.updated_at
+            items_db.flush()
+            data = ItemSchema.from_orm(db_item).dict()
+            if items_db is not db:
+                items_db.commit()
+            db.execute(touch_user_statement, {"user_id": user_id, "now": now})
+            events.record(db, user_id, events.UPDATED, data)
+            purge_user_items(db, user_id)
+            db.commit()
+            items_db.refresh(db_item)
         return db_item
 
-crud_item = CRUDItem(Item)
+    async def remove(self, db: Session, *, id: int, user_id: Optional[int] = None) -> ItemSchema:
+        """
+        Delete existing item by id
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        id : int
+            An id that wanted to get
+        user_id : Optional[int], default=None
+            An owner id of the item, required when items are sharded since
+            item ids are only unique per shard
+
+        Returns
+        -------
+        Object
+            An object of ItemSchema, or None when not found
+        """
+        if shard_router.enabled and user_id is None:
+            raise ValueError("Sharded items are removed by id and user_id")
+        with shard_router.items_session(db, user_id) as items_db:
+            db_item = items_db.get(Item, id)
+            if db_item is None or user_id is not None and db_item.owner_id != user_id:
+                return None
+            owner_id = db_item.owner_id
+            items_db.delete(db_item)
+            items_db.flush()
+            last_item_at = select(func.max(Item.created_at)).where(Item.owner_id == owner_id)
+            if items_db is db:
+                last_item_at = last_item_at.scalar_subquery()
+            else:
+                last_item_at = items_db.execute(last_item_at).scalar()
+                items_db.commit()
+            db.execute(
+                update(User).where(User.id == owner_id)
+                .values(item_count=User.item_count - 1, last_item_at=last_item_at,
+                        version=User.version + 1, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            events.record(db, owner_id, events.DELETED, {"id": id, "owner_id": owner_id})
+            purge_user_items(db, owner_id)
+            db.commit()
+        return db_item
+
+    async def attach_user_items(self, users: List[User]) -> None:
+        """
+        Load the items relationship of users from their shards, one query
+        per shard; a no-op when sharding is off (the relationship loads
+        from the primary database as usual)
+
+        Parameters
+        ----------
+        users : List[User]
+            A list of users loaded from the primary database
+        """
+        if not shard_router.enabled or not users:
+            return
+        by_shard: Dict[int, List[User]] = {}
+        for user in users:
+            by_shard.setdefault(shard_router.shard_for(user.id), []).append(user)
+        for index, shard_users in by_shard.items():
+            items: Dict[int, List[Item]] = {user.id: [] for user in shard_users}
+            with shard_router.sessionmakers[index]() as shard_db:
+                stmt = select(Item).where(Item.owner_id.in_(list(items))).order_by(Item.id)
+                for item in shard_db.execute(stmt).scalars():
+                    items[item.owner_id].append(item)
+            for user in shard_users:
+                set_committed_value(user, "items", items[user.id])
+
+crud_item = CRUDItem(Item, page_order=(Item.owner_id, Item.id))  # the key of the after cursors
+tracing.instrument(crud_item, "crud_item")
@@ -1,19 +1,56 @@
-from typing import Any, Optional
+from typing import Any, List, Optional, Sequence, Tuple
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
+from functools import lru_cache
 from jose import JWTError, jwt
 
 from fastapi import Depends
+from sqlalchemy import bindparam, delete, func, or_, select, text, update
 from sqlalchemy.orm import Session
 from sqlalchemy.sql.functions import ReturnTypeFromArgs
 
 from core.config import settings
 from models.user import User
-from crud.base import CRUDBase
-from api.schemas.user import UserSchema, UserCreate, UserUpdate
-
-
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
+from models.item import Item
+from crud.base import CRUDBase, record_type
+from crud.crud_item import crud_item, purge_user_items
+from services.cache import responses as cache
+from services.observability import tracing
+from services.indexes import users as user_index
+from services.indexes.prefix import PREFIX_END, index as prefix_index
+from services.indexes.users import EMAIL, USERNAME, index_key
+from database.shards import shard_router
+from api.schemas.user import UserSchema, UserCreate, UserUpdate, UserSummary
+
+
+@lru_cache(maxsize=None)
+def pwd_context() -> Any:
+    """
+    Get the password hashing context, built (and passlib imported) on the
+    first login or signup rather than at startup
+    """
+    from passlib.context import CryptContext
+    return CryptContext(schemes=['bcrypt'], deprecated="auto")
+
+
+get_user_by_username_statement = select(User).where(User.username == bindparam("username"))
+get_user_by_email_statement = select(User).where(User.email == bindparam("email"))
+get_user_version_statement = select(User.version, User.updated_at).where(User.id == bindparam("id"))
+user_summary_columns = (User.id, User.username, User.item_count, User.last_item_at)
+get_user_summary_statement = select(*user_summary_columns).where(User.id == bindparam("id"))
+get_user_summaries_statement = select(*user_summary_columns).order_by(User.id) \
+    .offset(bindparam("skip")).limit(bindparam("limit"))
+search_usernames_statement = select(User.id, User.username) \
+    .where(User.username >= bindparam("prefix"), User.username < bindparam("end")) \
+    .order_by(User.username).limit(bindparam("limit"))
+# the pattern operators of text_pattern_ops compare bytes, whatever the collation
+search_usernames_pattern_statement = select(User.id, User.username) \
+    .where(User.username.op("~>=~")(bindparam("prefix")), User.username.op("~<~")(bindparam("end"))) \
+    .order_by(text("users.username USING ~<~")).limit(bindparam("limit"))
+USER_FIELDS = tuple(UserSchema.__fields__)  # items included, attached to the rows
+
+set_item_counts_statement = update(User).where(User.id == bindparam("user_id")) \
+    .values(item_count=bindparam("count"), last_item_at=bindparam("last")) \
+    .execution_options(synchronize_session=False)
 
 
 class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
@@ -28,18 +65,34 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
     Methods
     -------
     - User -
-    get_user(self, db: Session, user_id: int) -> UserSchema
+    get_user(self, db: Session, user_id: int, fields: Optional[Sequence[str]] = None) -> UserSchema
         Get user by id
+    get_user_version(self, db: Session, user_id: int) -> Any
+        Get user version and updated_at
     get_user_by_username(self, db: Session, username: int) -> UserSchema
         Get user by username filter query
     get_user_by_email(self, db: Session, email: int) -> UserSchema
         Get user by email filter query
-    get_users(self, db: Session, skip: int = 0, limit: int = 100) -> UserSchema
+    is_available(self, db: Session, kind: str, value: str) -> bool
+        Check a username or email is free, querying only on a filter positive
+    search_usernames(self, db: Session, prefix: str, limit: int = 20) -> List[Tuple[int, str]]
+        Get the users whose username starts with a prefix, from memory when ready
+    get_users(self, db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None) -> UserSchema
         Get users list with skip and limit filter query
+    get_user_rows(self, db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None) -> List[Any]
+        Get users list as plain records, for read only lists
     create_user(self, db: Session, user: UserCreate) -> UserSchema
         Create new user
     update_user(self, db: Session, user:UserSchema, obj_in: UserUpdate) -> UserSchema
         Update existing user
+    remove(self, db: Session, *, id: int) -> UserSchema
+        Delete existing user and its items
+    get_user_summary(self, db: Session, user_id: int) -> UserSummary
+        Get user id, username and item counters
+    get_user_summaries(self, db: Session, skip: int = 0, limit: int = 100) -> List[UserSummary]
+        Get users id, username and item counters list
+    reconcile_item_counts(self, db: Session, batch_size: int = 10000) -> int
+        Repair item counters that drifted from the items table
 
     - Auth -
     is_active(self, user: User) -> bool
@@ -56,7 +109,7 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
         Create access token jwt
     """
 
-    async def get_user(self, db: Session, user_id: int) -> UserSchema:
+    async def get_user(self, db: Session, user_id: int, fields: Optional[Sequence[str]] = None) -> UserSchema:
         """
         Get user by id
 
@@ -66,15 +119,22 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
             The session database of app
         user_id : int
             An id that wanted to get
+        fields : Optional[Sequence[str]], default=None
+            A list of fields to load, every field when empty
 
         Returns
         -------
         Object
             An object of UserSchema
         """
-        return await super().get(db=db, id=user_id)
+        db_user = await super().get(db=db, id=user_id, fields=fields)
+        if db_user is not None and (not fields or "items" in fields):
+            await crud_item.attach_user_items([db_user])
+        return db_user
 
-    async def get_users(self, db: Session, skip: int = 0, limit: int = 100) -> UserSchema:
+    async def get_users(
+        self, db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None
+    ) -> UserSchema:
         """
         Get users list with skip and limit filter query
 
@@ -86,13 +146,67 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
             A id that wanted to skip
         limit : int, default=100
             A limit of list data
+        fields : Optional[Sequence[str]], default=None
+            A list of fields to load, every field when empty
 
         Returns
         -------
         Object
             An object of UserSchema list
         """
-        return await super().get_multi(db=db, skip=skip, limit=limit)
+        db_users = await super().get_multi(db=db, skip=skip, limit=limit, fields=fields)
+        if not fields or "items" in fields:
+            await crud_item.attach_user_items(db_users)
+        return db_users
+
+    async def get_user_rows(
+        self, db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None
+    ) -> List[Any]:
+        """
+        Get users list as plain records (CRUDBase.get_multi_rows), with
+        their items as plain rows too
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        skip : int, default=0
+            A id that wanted to skip
+        limit : int, default=100
+            A limit of list data
+        fields : Optional[Sequence[str]], default=None
+            A list of fields to select, those of UserSchema when empty
+
+        Returns
+        -------
+        List[Any]
+            A list of __slots__ records, read by attribute like the objects
+        """
+        fields = tuple(name for name in USER_FIELDS if name in (fields or USER_FIELDS) or name == "id")
+        rows = await super().get_multi_rows(db=db, skip=skip, limit=limit, fields=fields)
+        if "items" not in fields:
+            return rows
+        items = await crud_item.get_owner_item_rows(db, [row.id for row in rows])
+        record = record_type("UserRecord", (*(column.key for column in self.columns(fields)), "items"))
+        return [record(*row, items[row.id]) for row in rows]
+
+    async def get_user_version(self, db: Session, user_id: int) -> Any:
+        """
+        Get user version and updated_at, without loading the user
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        user_id : int
+            An id that wanted to get
+
+        Returns
+        -------
+        Any
+            A (version, updated_at) row, or None when not found
+        """
+        return db.execute(get_user_version_statement, {"id": user_id}).first()
 
     async def get_user_by_username(self, db: Session, username: str) -> UserSchema:
         """
@@ -110,7 +224,7 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
         Object
             An object of UserSchema
         """
-        return db.query(User).filter(User.username == username).first()
+        return db.execute(get_user_by_username_statement, {"username": username}).scalars().first()
 
     async def get_user_by_email(self, db: Session, email: str) -> UserSchema:
         """
@@ -128,7 +242,68 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
         Object
             An object of UserSchema
         """
-        return db.query(User).filter(User.email == email).first()
+        return db.execute(get_user_by_email_statement, {"email": email}).scalars().first()
+
+    async def is_available(self, db: Session, kind: str, value: str) -> bool:
+        """
+        Check a username or email is not taken
+
+        The Bloom filter of this process (services/indexes/users.py)
+        answers most checks on PostgreSQL; the database is only queried
+        when the value might be taken. Writes check the database.
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        kind : str
+            USERNAME or EMAIL
+        value : str
+            A username or an email
+
+        Returns
+        -------
+        bool
+            True when no user has this value
+        """
+        if not user_index.index.might_exist(kind, value):
+            return True
+        if kind == EMAIL:
+            return await self.get_user_by_email(db=db, email=value) is None
+        return await self.get_user_by_username(db=db, username=value) is None
+
+    async def search_usernames(self, db: Session, prefix: str, limit: int = 20) -> List[Tuple[int, str]]:
+        """
+        Get the users whose username starts with a prefix, in username
+        (code point) order
+
+        The sorted arrays of this process (services/indexes/prefix.py)
+        answer without a query once built; until then a range scan of the
+        ix_users_username_pattern index (text_pattern_ops on PostgreSQL,
+        whose byte order matches the arrays) does.
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        prefix : str
+            The start of the usernames
+        limit : int, default=20
+            A maximum number of users
+
+        Returns
+        -------
+        List[Tuple[int, str]]
+            The (id, username) of the matching users
+        """
+        found = prefix_index.search(prefix, limit)
+        if found is not None:
+            return found
+        if db.get_bind().dialect.name == "postgresql":
+            stmt = search_usernames_pattern_statement
+        else:
+            stmt = search_usernames_statement
+        return [tuple(row) for row in db.execute(stmt, {"prefix": prefix, "end": prefix + PREFIX_END, "limit": limit})]
 
     async def create_user(self, db: Session, obj_in: UserCreate) -> UserSchema:
         """
@@ -151,6 +326,10 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
             username=obj_in.username, email=obj_in.email, hashed_password=hashed_password
         )
         db.add(db_user)
+        db.flush()  # the id, announced with the username
+        user_index.announce(
+            db, added=[index_key(USERNAME, obj_in.username), index_key(EMAIL, obj_in.email)],
+            names_added=[(db_user.id, obj_in.username)])
         db.commit()
         db.refresh(db_user)
         return db_user
@@ -182,8 +361,154 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
             del update_data["password"]
             update_data["hashed_password"] = hashed_password
             user.hashed_password = update_data["hashed_password"]
+        cache.purge(db, cache.user_tag(user.id))
+        changed = [kind for kind in (USERNAME, EMAIL)
+                   if update_data.get(kind) is not None and update_data[kind] != getattr(user, kind)]
+        if changed:
+            renamed = USERNAME in changed
+            user_index.announce(
+                db,
+                added=[index_key(kind, update_data[kind]) for kind in changed],
+                removed=[index_key(kind, getattr(user, kind)) for kind in changed if getattr(user, kind) is not None],
+                names_added=[(user.id, update_data[USERNAME])] if renamed else [],
+                names_removed=[(user.id, user.username)] if renamed and user.username is not None else [])
         return await super().update(db, db_obj=user, obj_in=update_data)
 
+    async def remove(self, db: Session, *, id: int) -> UserSchema:
+        """
+        Delete existing user and its items
+
+        Items on a shard are deleted first: a crash in between leaves a
+        user without items, never items without a user.
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        id : int
+            An id that wanted to get
+
+        Returns
+        -------
+        Object
+            An object of UserSchema
+        """
+        if shard_router.enabled:
+            with shard_router.session_for(id) as shard_db:
+                shard_db.execute(delete(Item).where(Item.owner_id == id))
+                shard_db.commit()
+        purge_user_items(db, id)
+        user = db.get(User, id)
+        if user is not None:
+            user_index.announce(
+                db,
+                removed=[index_key(kind, getattr(user, kind)) for kind in (USERNAME, EMAIL) if getattr(user, kind) is not None],
+                names_removed=[(user.id, user.username)] if user.username is not None else [])
+        return await super().remove(db=db, id=id)
+
+    async def get_user_summary(self, db: Session, user_id: int) -> UserSummary:
+        """
+        Get user id, username and item counters, reading the users row only
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        user_id : int
+            An id that wanted to get
+
+        Returns
+        -------
+        Object
+            A row of UserSummary columns
+        """
+        return db.execute(get_user_summary_statement, {"id": user_id}).first()
+
+    async def get_user_summaries(self, db: Session, skip: int = 0, limit: int = 100) -> List[UserSummary]:
+        """
+        Get users id, username and item counters list, reading the users table only
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        skip : int, default=0
+            A id that wanted to skip
+        limit : int, default=100
+            A limit of list data
+
+        Returns
+        -------
+        List[Object]
+            A list of rows of UserSummary columns
+        """
+        return db.execute(get_user_summaries_statement, {"skip": skip, "limit": limit}).all()
+
+    async def reconcile_item_counts(self, db: Session, batch_size: int = 10000) -> int:
+        """
+        Repair item counters that drifted from the items table
+
+        Users are processed by id ranges, one short transaction per range.
+        With shards the counts of a range are gathered from every shard and
+        only the users that differ are written.
+
+        Parameters
+        ----------
+        db : Session
+            The session database of app
+        batch_size : int, default=10000
+            A number of user ids per transaction
+
+        Returns
+        -------
+        int
+            A number of repaired users
+        """
+        item_count = select(func.count(Item.id)).where(Item.owner_id == User.id).scalar_subquery()
+        last_item_at = select(func.max(Item.created_at)).where(Item.owner_id == User.id).scalar_subquery()
+        max_id = db.execute(select(func.max(User.id))).scalar() or 0
+        repaired = 0
+        for start in range(0, max_id + 1, batch_size):
+            if shard_router.enabled:
+                repaired += self._reconcile_sharded_range(db, start, start + batch_size)
+                continue
+            result = db.execute(
+                update(User)
+                .where(
+                    User.id >= start, User.id < start + batch_size,
+                    or_(User.item_count != item_count, User.last_item_at.is_distinct_from(last_item_at)))
+                .values(item_count=item_count, last_item_at=last_item_at)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            repaired += result.rowcount
+        return repaired
+
+    def _reconcile_sharded_range(self, db: Session, start: int, stop: int) -> int:
+        """
+        Repair the item counters of users start <= id < stop from the shards
+        """
+        counts = {}
+        stmt = select(Item.owner_id, func.count(Item.id), func.max(Item.created_at)) \
+            .where(Item.owner_id >= start, Item.owner_id < stop).group_by(Item.owner_id)
+        with shard_router.items_sessions(db) as sessions:
+            for shard_db in sessions:
+                for owner_id, count, last_item_at in shard_db.execute(stmt):
+                    total, last = counts.get(owner_id, (0, None))
+                    counts[owner_id] = (total + count, max(filter(None, (last, last_item_at)), default=None))
+        users = db.execute(
+            select(User.id, User.item_count, User.last_item_at).where(User.id >= start, User.id < stop))
+        changes = [
+            {"user_id": id, "count": expected[0], "last": expected[1]}
+            for id, item_count, last_item_at in users
+            for expected in [counts.get(id, (0, None))]
+            if (item_count, last_item_at) != expected
+        ]
+        if changes:
+            db.execute(set_item_counts_statement, changes)
+        db.commit()
+        return len(changes)
+
 
     # ===== AUTH ===== #
     async def is_active(self, user: User) -> bool:
@@ -234,7 +559,8 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
         bool
             True of False
         """
-        return pwd_context.verify(plain_password, hashed_password)
+        with tracing.span("bcrypt.verify", tracing.CPU):
+            return pwd_context().verify(plain_password, hashed_password)
 
     async def get_password_hash(self, password) -> Any:
         """
@@ -250,7 +576,8 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
         Any
             hashed password from database
         """
-        return pwd_context.hash(password)
+        with tracing.span("bcrypt.hash", tracing.CPU):
+            return pwd_context().hash(password)
 
     async def authenticate_user(self, username: str, password: str, db: Session = Depends()) -> Any:
         """
@@ -302,4 +629,5 @@ class CRUDUser(CRUDBase[UserSchema, UserCreate, UserUpdate]):
         enconded_jwt = jwt.encode(to_encode, key=settings.SECRET_KEY, algorithm=settings.ALGORITHM)
         return enconded_jwt
 
-crud_user = CRUDUser(User)
\ No newline at end of file
+crud_user = CRUDUser(User)
+tracing.instrument(crud_user, "crud_user")
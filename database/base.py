@@ -9,3 +9,6 @@ from database.setup import Base
 # for Alembic migration
 from models.user import User
 from models.item import Item
+from models.job import Job
+from models.item_event import ItemEvent
+from models.stats import ItemCountBucket, SignupsDaily, StatsRollup
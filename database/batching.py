@@ -0,0 +1,101 @@
+'''batching.py
+Group commit: writes of concurrent requests committed together
+
+    committer = GroupCommitter(write_many, window_ms=2, max_entries=100)
+    result = await committer.submit(entry)
+
+The first entry of a batch waits up to window_ms for others (or until
+max_entries are collected), then write_many(entries) runs in a thread
+and writes them in one transaction: one commit, so one fsync, for the
+whole batch. It returns one result per entry, an exception for the
+entries that failed, and each caller gets its own. Batches are written
+one at a time: the next one is collected while the current one commits,
+so under load the batch size follows the commit latency.
+'''
+
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitter:
+    """
+    Collect the entries submitted from the event loop and write them in
+    batches
+
+    Parameters
+    ----------
+    write_many : Callable[[List[Any]], List[Any]]
+        A blocking function writing entries in one transaction, returning
+        a result or an exception per entry
+    window_ms : float
+        A maximum wait in milliseconds of the first entry of a batch
+    max_entries : int
+        A maximum number of entries per batch
+
+    Methods
+    -------
+    submit(self, entry: Any) -> Any
+        Queue an entry and wait for its result
+    stats(self) -> Dict[str, Any]
+        Get the batch counters
+    """
+
+    def __init__(self, write_many: Callable[[List[Any]], List[Any]], window_ms: float, max_entries: int):
+        self.write_many = write_many
+        self.window = window_ms / 1000
+        self.max_entries = max_entries
+        self.pending: List[Tuple[Any, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.writing = False
+        self.batches = 0
+        self.entries = 0
+
+    async def submit(self, entry: Any) -> Any:
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.pending.append((entry, future))
+        if len(self.pending) >= self.max_entries:
+            self.flush()
+        elif self.timer is None and not self.writing:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.writing or not self.pending:
+            return  # written once the current batch is done
+        batch, self.pending = self.pending[:self.max_entries], self.pending[self.max_entries:]
+        self.writing = True
+        loop = asyncio.get_event_loop()
+        write = loop.run_in_executor(None, self.write_many, [entry for entry, _ in batch])
+        write.add_done_callback(lambda done: self.written(batch, done))
+
+    def written(self, batch: List[Tuple[Any, asyncio.Future]], done: asyncio.Future) -> None:
+        self.writing = False
+        self.batches += 1
+        self.entries += len(batch)
+        error = done.exception()
+        results = [error] * len(batch) if error is not None else done.result()
+        for (_, future), result in zip(batch, results):
+            if future.done():  # the caller was cancelled
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        # the entries queued meanwhile have waited long enough
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "entries": self.entries,
+            "mean_batch": round(self.entries / self.batches, 2) if self.batches else 0.0,
+            "pending": len(self.pending),
+        }
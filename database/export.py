@@ -0,0 +1,303 @@
+'''export.py
+Snapshot the users and items tables to compressed chunk files
+
+    python -m database.export --out exports/2026-10-19 [--format csv|parquet]
+        [--tables users items] [--chunk-size 1000000] [--processes N]
+
+Each table is split into id ranges of --chunk-size ids (per shard for the
+items when sharding is on), and a pool of processes reads the ranges in
+parallel, streaming each with a server-side cursor into one file:
+<table>/<table>[-s<shard>]-<start>.csv.gz (gzip CSV with a header) or .parquet
+(needs pyarrow). users.hashed_password is never exported.
+
+The directory holds a manifest.json listing the columns of the tables and
+every chunk with its rows, size and sha256. It is rewritten as chunks
+complete, and a chunk file only appears once complete (written aside,
+then renamed), so an interrupted export resumes where it stopped: run the
+same command again, the ranges of the manifest are kept and only the
+missing chunks are read.
+
+On PostgreSQL the chunks of a run read one snapshot per database
+(pg_export_snapshot), so they are consistent with each other; a resumed
+run reads a newer snapshot for the chunks it completes.
+'''
+
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Engine
+
+from database.base import *
+from database.setup import engine
+from database.shards import shard_router
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+FORMATS = {"csv": ".csv.gz", "parquet": ".parquet"}
+EXCLUDED_COLUMNS = {"users": {"hashed_password"}}
+
+
+def export_tables() -> Dict[str, Tuple[Any, List[Engine]]]:
+    """
+    Get the exportable tables and the engines holding their rows
+    """
+    return {
+        "users": (User.__table__, [engine]),
+        "items": (Item.__table__, shard_router.engines if shard_router.enabled else [engine]),
+    }
+
+
+def table_columns(table: Any) -> List[str]:
+    return [column.name for column in table.columns if column.name not in EXCLUDED_COLUMNS.get(table.name, ())]
+
+
+def plan(tables: List[str], chunk_size: int, format: str) -> Dict[str, Any]:
+    """
+    Split the tables into id ranges of chunk_size ids
+
+    Parameters
+    ----------
+    tables : List[str]
+        The names of the tables to export
+    chunk_size : int
+        A number of ids per chunk
+    format : str
+        csv or parquet
+
+    Returns
+    -------
+    Dict[str, Any]
+        A new manifest, with no chunk done
+    """
+    available = export_tables()
+    manifest = {"format": format, "created_at": datetime.utcnow().isoformat(), "tables": {}, "chunks": []}
+    for name in tables:
+        table, engines = available[name]
+        manifest["tables"][name] = {"columns": table_columns(table)}
+        for shard, bind in enumerate(engines):
+            with bind.connect() as conn:
+                low, high = conn.execute(select(func.min(table.c.id), func.max(table.c.id))).one()
+            if low is None:
+                continue
+            suffix = f"-s{shard}" if len(engines) > 1 else ""
+            for start in range(low, high + 1, chunk_size):
+                manifest["chunks"].append({
+                    "table": name, "shard": shard, "start": start, "end": min(start + chunk_size, high + 1),
+                    "file": f"{name}/{name}{suffix}-{start:012d}{FORMATS[format]}",
+                    "rows": None, "bytes": None, "sha256": None,
+                })
+    return manifest
+
+
+def save_manifest(out: str, manifest: Dict[str, Any]) -> None:
+    path = os.path.join(out, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def write_csv(path: str, table: Any, columns: List[str], partitions, level: int) -> int:
+    rows = 0
+    with gzip.open(path, "wt", newline="", compresslevel=level) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for batch in partitions:
+            writer.writerows(batch)
+            rows += len(batch)
+    return rows
+
+
+def write_parquet(path: str, table: Any, columns: List[str], partitions, level: int) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {int: pa.int64(), str: pa.string(), float: pa.float64(), bool: pa.bool_(), datetime: pa.timestamp("us")}
+    schema = pa.schema([(name, types[table.c[name].type.python_type]) for name in columns])
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for batch in partitions:
+            writer.write_table(pa.Table.from_pydict(
+                {name: [row[i] for row in batch] for i, name in enumerate(columns)}, schema=schema))
+            rows += len(batch)
+    return rows
+
+
+WRITERS = {"csv": write_csv, "parquet": write_parquet}
+
+
+def init_worker() -> None:
+    # connections inherited from the parent process must not be shared
+    for bind in {engine, *shard_router.engines}:
+        bind.dispose(close=False)
+
+
+def export_chunk(job: Tuple[str, Dict[str, Any], str, Optional[str], int, int]) -> Dict[str, Any]:
+    """
+    Read one id range with a server-side cursor and write its chunk file
+
+    Parameters
+    ----------
+    job : Tuple[str, Dict[str, Any], str, Optional[str], int, int]
+        The output directory, the chunk, the format, the snapshot of its
+        database (PostgreSQL), the rows per fetch and the gzip level
+
+    Returns
+    -------
+    Dict[str, Any]
+        The chunk, with its rows, bytes and sha256
+    """
+    out, chunk, format, snapshot, batch_size, level = job
+    table, engines = export_tables()[chunk["table"]]
+    columns = table_columns(table)
+    path = os.path.join(out, chunk["file"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    started = time.monotonic()
+    with engines[chunk["shard"]].connect() as conn:
+        with conn.begin():
+            if snapshot is not None:
+                conn.exec_driver_sql("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                conn.exec_driver_sql(f"SET TRANSACTION SNAPSHOT '{snapshot}'")
+            result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(
+                select(*[table.c[name] for name in columns])
+                .where(table.c.id >= chunk["start"], table.c.id < chunk["end"])
+                .order_by(table.c.id))
+            rows = WRITERS[format](path + ".tmp", table, columns, result.partitions(batch_size), level)
+    digest = hashlib.sha256()
+    with open(path + ".tmp", "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    os.replace(path + ".tmp", path)
+    return {**chunk, "rows": rows, "bytes": os.path.getsize(path), "sha256": digest.hexdigest(),
+            "seconds": round(time.monotonic() - started, 3)}
+
+
+def export(
+    out: str,
+    tables: List[str],
+    *,
+    format: str = "csv",
+    chunk_size: int = 1000000,
+    processes: Optional[int] = None,
+    batch_size: int = 10000,
+    level: int = 1
+) -> Dict[str, Any]:
+    """
+    Export tables to chunk files and a manifest, resuming a previous run
+    of the same directory
+
+    Parameters
+    ----------
+    out : str
+        An output directory
+    tables : List[str]
+        The names of the tables to export
+    format : str, default="csv"
+        csv (gzip) or parquet
+    chunk_size : int, default=1000000
+        A number of ids per chunk, for a new export
+    processes : Optional[int], default=None
+        A number of reading processes, the CPU count when empty
+    batch_size : int, default=10000
+        A number of rows per fetch
+    level : int, default=1
+        A gzip compression level
+
+    Returns
+    -------
+    Dict[str, Any]
+        The manifest
+    """
+    os.makedirs(out, exist_ok=True)
+    path = os.path.join(out, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest["format"] != format or sorted(manifest["tables"]) != sorted(tables):
+            raise ValueError(f"{out} holds a {manifest['format']} export of {', '.join(manifest['tables'])}")
+        logger.info("Resuming the export of %s", out)
+    else:
+        manifest = plan(tables, chunk_size, format)
+        save_manifest(out, manifest)
+    todo = [
+        index for index, chunk in enumerate(manifest["chunks"])
+        if chunk["sha256"] is None or not os.path.exists(os.path.join(out, chunk["file"]))
+    ]
+    logger.info("%s of %s chunks to export", len(todo), len(manifest["chunks"]))
+    if not todo:
+        return manifest
+
+    available = export_tables()
+    positions = {manifest["chunks"][index]["file"]: index for index in todo}
+    started = time.monotonic()
+    rows = 0
+    with ExitStack() as stack:
+        # one snapshot per database, held open by this process while the workers read it
+        snapshots: Dict[Engine, Optional[str]] = {}
+        jobs = []
+        for index in todo:
+            chunk = manifest["chunks"][index]
+            bind = available[chunk["table"]][1][chunk["shard"]]
+            if bind not in snapshots:
+                snapshots[bind] = None
+                if bind.dialect.name == "postgresql":
+                    conn = stack.enter_context(bind.connect())
+                    stack.enter_context(conn.begin())
+                    conn.exec_driver_sql("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                    snapshots[bind] = conn.execute(text("SELECT pg_export_snapshot()")).scalar()
+            jobs.append((out, chunk, format, snapshots[bind], batch_size, level))
+        with multiprocessing.Pool(processes, initializer=init_worker) as pool:
+            for done, chunk in enumerate(pool.imap_unordered(export_chunk, jobs), 1):
+                seconds = chunk.pop("seconds")
+                manifest["chunks"][positions[chunk["file"]]] = chunk
+                save_manifest(out, manifest)
+                rows += chunk["rows"]
+                logger.info("%s/%s %s: %s rows in %.1fs (%.0f rows/s overall)", done, len(jobs), chunk["file"],
+                            chunk["rows"], seconds, rows / (time.monotonic() - started))
+    manifest["completed_at"] = datetime.utcnow().isoformat()
+    save_manifest(out, manifest)
+    return manifest
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Export tables to compressed chunk files and a manifest")
+    parser.add_argument("--out", required=True, help="output directory, resumed when it holds a manifest")
+    parser.add_argument("--tables", nargs="+", choices=sorted(export_tables()), default=["users", "items"])
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--chunk-size", type=int, default=1000000, help="ids per chunk file")
+    parser.add_argument("--processes", type=int, default=None, help="reading processes, CPU count by default")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per fetch")
+    parser.add_argument("--level", type=int, default=1, help="gzip compression level")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet needs pyarrow (pip install pyarrow)")
+
+    started = time.monotonic()
+    try:
+        manifest = export(
+            args.out, args.tables, format=args.format, chunk_size=args.chunk_size,
+            processes=args.processes, batch_size=args.batch_size, level=args.level)
+    except ValueError as exc:
+        parser.error(str(exc))
+    rows = sum(chunk["rows"] or 0 for chunk in manifest["chunks"])
+    logger.info("%s rows in %s chunks exported in %.1fs", rows, len(manifest["chunks"]), time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
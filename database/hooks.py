@@ -0,0 +1,47 @@
+'''hooks.py
+Callbacks run once the current transaction of a session commits
+
+    on_commit(db, lambda: broker.publish(message))
+
+The callbacks are dropped when the transaction rolls back, so nothing is
+announced for a write that did not happen.
+'''
+
+import logging
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+logger = logging.getLogger(__name__)
+
+KEY = "on_commit"
+
+
+def on_commit(db: Session, callback: Callable[[], None]) -> None:
+    """
+    Run a callback after the current transaction of db commits
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    callback : Callable[[], None]
+        A function without arguments, its errors are logged, not raised
+    """
+    db.info.setdefault(KEY, []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def run_commit_hooks(session: Session) -> None:
+    for callback in session.info.pop(KEY, ()):
+        try:
+            callback()
+        except Exception:
+            logger.exception("Commit hook %r failed", callback)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_commit_hooks(session: Session) -> None:
+    session.info.pop(KEY, None)
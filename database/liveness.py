@@ -0,0 +1,107 @@
+'''liveness.py
+Dead connections found without a SELECT 1 before every request
+
+pool_pre_ping costs a round trip per checkout. Instead:
+
+    - a checkout pings only a connection idle for settings.LIVENESS_IDLE_PING
+      seconds (the ones a firewall or the server may have closed); a dead
+      one is replaced by the pool before the request sees it
+    - a pinger thread (start(engine), on startup) pings an idle connection
+      every settings.LIVENESS_PING_INTERVAL seconds, so a server restart is
+      noticed between requests
+    - a disconnect, including the shutdown errors of PostgreSQL (sqlstate
+      classes 08 and 57P), invalidates the whole pool: every connection
+      opened before it is reconnected on its next checkout
+    - GET and HEAD requests failing on a connection found dead are run once
+      more (SessionReleasingRoute in api/routing.py)
+'''
+
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, DisconnectionError
+
+from core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+DISCONNECT_SQLSTATES = ("08", "57P")  # connection exception, operator intervention (shutdown)
+
+
+def handle_error(context) -> None:
+    code = getattr(context.original_exception, "pgcode", None) or ""
+    if code.startswith(DISCONNECT_SQLSTATES):
+        context.is_disconnect = True  # and invalidate_pool_on_disconnect, True by default
+
+
+def install(engine: Engine) -> None:
+    """
+    Check the connections of an engine on checkout when idle for a while,
+    in place of pool_pre_ping
+    """
+    def checkin(dbapi_connection, connection_record) -> None:
+        connection_record.info["idle_since"] = time.monotonic()
+
+    def checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+        idle_since = connection_record.info.pop("idle_since", None)
+        if idle_since is None or time.monotonic() - idle_since < settings.LIVENESS_IDLE_PING:
+            return
+        if not engine.dialect.do_ping(dbapi_connection):  # False on a disconnect error
+            # the pool discards the connection and checks out another one
+            raise DisconnectionError(f"Connection idle for {time.monotonic() - idle_since:.0f}s is closed")
+
+    event.listen(engine, "checkin", checkin)
+    event.listen(engine, "checkout", checkout)
+    event.listen(engine, "handle_error", handle_error)
+
+
+class Pinger(threading.Thread):
+    """
+    Ping an idle pooled connection of each engine at an interval
+    """
+
+    def __init__(self, engines: List[Engine]):
+        super().__init__(name="pool-pinger", daemon=True)
+        self.engines = engines
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(settings.LIVENESS_PING_INTERVAL):
+            for engine in self.engines:
+                self.ping(engine)
+
+    def ping(self, engine: Engine) -> None:
+        if not engine.pool.checkedin():  # nothing idle, requests are checking their own
+            return
+        try:
+            with engine.connect() as conn:
+                conn.exec_driver_sql("SELECT 1")
+        except DBAPIError as exc:
+            # a disconnect has invalidated the pool, the next checkouts reconnect
+            logger.warning("Pool ping failed on %s: %s", engine.url.host, exc.orig)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+pinger: Optional[Pinger] = None
+lock = threading.Lock()
+
+
+def start(*engines: Engine) -> None:
+    """
+    Start the pinger thread of this process, for the engines with a
+    connection pool (QueuePool), unless LIVENESS_PING_INTERVAL is 0
+    """
+    global pinger
+    engines = [engine for engine in engines if hasattr(engine.pool, "checkedin")]
+    with lock:
+        if not engines or not settings.LIVENESS_PING_INTERVAL or pinger is not None:
+            return
+        pinger = Pinger(engines)
+    pinger.start()
@@ -0,0 +1,150 @@
+'''notify.py
+Announce committed writes to every process of the app
+
+    notify.subscribe("item_events", handler)  # at import time
+    notify.notify(db, "item_events", {...})   # in the writing transaction
+
+On PostgreSQL the payload is sent with NOTIFY by the writing transaction
+and delivered by the LISTEN thread of each process (listen(engine), on
+startup). Other databases deliver in process once the transaction
+commits (database/hooks.py), so they never reach the other processes:
+state that other processes keep current with notifications must check
+listening(). Either way a handler only sees committed writes. Notifications sent while the LISTEN connection is down, or before
+it first listens, are lost: the on_reconnect handlers are called instead.
+'''
+
+import json
+import logging
+import select
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func, select as sql_select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database.hooks import on_commit
+
+
+logger = logging.getLogger(__name__)
+
+handlers: Dict[str, List[Callable[[Any], None]]] = {}
+reconnect_handlers: List[Callable[[], None]] = []
+
+
+def subscribe(channel: str, handler: Callable[[Any], None], on_reconnect: Optional[Callable[[], None]] = None) -> None:
+    """
+    Call a handler with the payload of every notification of a channel
+
+    Parameters
+    ----------
+    channel : str
+        A channel name
+    handler : Callable[[Any], None]
+        A function called with the JSON payload, from the LISTEN thread
+    on_reconnect : Optional[Callable[[], None]], default=None
+        A function called when notifications may have been lost: when
+        the LISTEN connection fails, and each time it listens again
+    """
+    handlers.setdefault(channel, []).append(handler)
+    if on_reconnect is not None:
+        reconnect_handlers.append(on_reconnect)
+
+
+def dispatch(channel: str, payload: Any) -> None:
+    for handler in handlers.get(channel, ()):
+        try:
+            handler(payload)
+        except Exception:
+            logger.exception("Notification handler %r failed", handler)
+
+
+def notify(db: Session, channel: str, payload: Any) -> None:
+    """
+    Send a notification when the current transaction of db commits
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    channel : str
+        A channel name
+    payload : Any
+        A JSON serialisable payload, under 8000 bytes on PostgreSQL
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(sql_select(func.pg_notify(channel, json.dumps(payload, default=str))))
+    else:
+        on_commit(db, lambda: dispatch(channel, payload))
+
+
+class Listener(threading.Thread):
+    """
+    LISTEN on the subscribed channels with a dedicated connection
+    """
+
+    def __init__(self, engine: Engine):
+        super().__init__(name="notify-listener", daemon=True)
+        self.engine = engine
+        self.stopped = threading.Event()
+        self.listening = False
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except Exception:
+                logger.exception("Notification listener disconnected")
+                for handler in reconnect_handlers:
+                    handler()
+                self.stopped.wait(1)
+
+    def listen(self) -> None:
+        connection = self.engine.raw_connection()
+        connection.detach()  # a long lived connection, kept out of the pool
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                for channel in handlers:
+                    cursor.execute(f'LISTEN "{channel}"')
+            self.listening = True
+            for handler in reconnect_handlers:  # what was sent before listening is lost too
+                handler()
+            while not self.stopped.is_set():
+                if select.select([dbapi_connection], [], [], 5) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    message = dbapi_connection.notifies.pop(0)
+                    dispatch(message.channel, json.loads(message.payload))
+        finally:
+            self.listening = False
+            connection.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+listener: Optional[Listener] = None
+lock = threading.Lock()
+
+
+def listen(engine: Engine) -> None:
+    """
+    Start the LISTEN thread of this process, on PostgreSQL only
+    """
+    global listener
+    with lock:
+        if engine.dialect.name != "postgresql" or listener is not None:
+            return
+        listener = Listener(engine)
+    listener.start()
+
+
+def listening() -> bool:
+    """
+    Check the notifications of every process reach this one: the LISTEN
+    thread of this process is connected, on PostgreSQL
+    """
+    return listener is not None and listener.listening
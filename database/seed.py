@@ -1,11 +1,46 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
+'''seed.py
+Seed the database: the initial users, or a synthetic dataset for load tests
+
+    python database/seed.py                    # superuser and admin (start.sh)
+    python -m database.seed --users 1000000 --items 10000000 --skew 1.1
+
+Synthetic users are user<N> / user<N>@example.com with the --password
+password: one precomputed hash shared by every user, or one hash each with
+--unique-passwords, computed by a process pool (--bcrypt-rounds lowers the
+cost for large datasets). Items are spread over the users by a Zipf law of
+exponent --skew (0 for uniform), with random titles and descriptions of
+--title-length / --description-length characters, created after their
+owner, who signed up in the last --days days. The counters of the users
+(item_count, last_item_at) match their items.
+
+Rows are generated with NumPy and loaded with COPY on PostgreSQL (batched
+executemany elsewhere), one transaction per --batch-size rows; items go to
+the shard of their owner when sharding is on.
+'''
+
+import argparse
+import csv
+import io
+import logging
+import multiprocessing
+import time
+from datetime import datetime
+from itertools import repeat
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
 from passlib.context import CryptContext
+from passlib.hash import bcrypt
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.engine import Engine
 
 from database.base import *
-from database.setup import SessionLocal
+from database.setup import SessionLocal, engine
+from database.shards import shard_router
 
 
+logger = logging.getLogger(__name__)
+
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
 
 # Database initial data
@@ -14,12 +49,12 @@ INITIAL_DATA = {
             {
                   'username': 'superuser',
                   'email': 'superuser@example.com',
-                  'hashed_password': pwd_context.hash('123')
+                  'password': '123'
             },
             {
                   'username': 'admin',
                   'email': 'admin@example.com',
-                  'hashed_password': pwd_context.hash('123')
+                  'password': '123'
             }
       ],
     #   'sometable': [
@@ -27,8 +62,246 @@ INITIAL_DATA = {
     #   ]
 }
 
-with SessionLocal() as session:
-    for data in INITIAL_DATA["User"]:
-        session.add(User(**data))
+USER_COLUMNS = ("id", "username", "email", "hashed_password", "is_active", "item_count",
+                "last_item_at", "version", "created_at", "updated_at")
+ITEM_COLUMNS = ("title", "description", "owner_id", "version", "created_at", "updated_at")
+ALPHABET = np.frombuffer(b"abcdefghijklmnopqrstuvwxyz     ", dtype=np.uint8)  # about one word in 6 letters
+
+
+def seed_initial() -> int:
+    """
+    Create the users of INITIAL_DATA that do not exist yet
+
+    Returns
+    -------
+    int
+        The number of users created
+    """
+    users = INITIAL_DATA["User"]
+    with SessionLocal() as session:
+        existing = set(session.execute(
+            select(User.username).where(User.username.in_([data["username"] for data in users]))).scalars())
+        missing = [data for data in users if data["username"] not in existing]
+        for data in missing:
+            session.add(User(
+                username=data["username"], email=data["email"],
+                hashed_password=pwd_context.hash(data["password"])))
         session.commit()
-        session.flush()
\ No newline at end of file
+    return len(missing)
+
+
+def parse_range(value: str) -> Tuple[int, int]:
+    """
+    Parse a "min:max" (or "n") length range
+    """
+    low, _, high = value.partition(":")
+    low, high = int(low), int(high or low)
+    if not 0 <= low <= high:
+        raise argparse.ArgumentTypeError(f"invalid range {value!r}")
+    return low, high
+
+
+def hash_password(args: Tuple[str, Optional[int]]) -> str:
+    password, rounds = args
+    return (bcrypt.using(rounds=rounds) if rounds else bcrypt).hash(password)
+
+
+def random_strings(rng: np.random.Generator, count: int, length: Tuple[int, int]) -> List[str]:
+    """
+    Generate count random lowercase strings with spaces, of a length in range
+    """
+    sizes = rng.integers(length[0], length[1] + 1, size=count)
+    letters = ALPHABET[rng.integers(0, len(ALPHABET), size=int(sizes.sum()))].tobytes().decode("ascii")
+    ends = np.cumsum(sizes)
+    return [letters[start:end] for start, end in zip((ends - sizes).tolist(), ends.tolist())]
+
+
+def item_counts(rng: np.random.Generator, users: int, items: int, skew: float) -> np.ndarray:
+    """
+    Draw the number of items of each user, Zipf distributed over users in
+    random order (the heavy users are not the first ids)
+    """
+    if skew <= 0:
+        weights = np.ones(users)
+    else:
+        weights = 1.0 / (rng.permutation(users) + 1.0) ** skew
+    return rng.multinomial(items, weights / weights.sum())
+
+
+def timestamps(values: np.ndarray, dialect: str) -> List[Any]:
+    """
+    Convert datetime64[us] values to COPY text (PostgreSQL) or datetimes
+    """
+    if dialect == "postgresql":
+        return np.datetime_as_string(values, unit="us").tolist()
+    return values.astype("datetime64[us]").tolist()
+
+
+def load(bind: Engine, table: Any, columns: Sequence[str], rows: Iterable[Tuple]) -> None:
+    """
+    Load rows in one transaction: COPY on PostgreSQL, executemany elsewhere
+
+    COPY reads an unquoted empty CSV field as NULL, which is also how
+    csv.writer writes an empty string: the string columns are read with
+    FORCE_NOT_NULL, so they hold '' as on the other databases.
+    """
+    with bind.begin() as conn:
+        if bind.dialect.name == "postgresql":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            strings = [name for name in columns if table.c[name].type.python_type is str]
+            options = f", FORCE_NOT_NULL ({', '.join(strings)})" if strings else ""
+            conn.connection.cursor().copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv{options})", buffer)
+        else:
+            conn.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+
+
+def seed_synthetic(
+    users: int,
+    items: int,
+    *,
+    skew: float = 1.0,
+    title_length: Tuple[int, int] = (8, 40),
+    description_length: Tuple[int, int] = (0, 120),
+    password: str = "password",
+    unique_passwords: bool = False,
+    bcrypt_rounds: Optional[int] = None,
+    processes: Optional[int] = None,
+    batch_size: int = 50000,
+    days: int = 365,
+    seed: Optional[int] = None
+) -> Tuple[int, int]:
+    """
+    Generate and load a synthetic dataset
+
+    Parameters
+    ----------
+    users : int
+        A number of users to create
+    items : int
+        A number of items to create, spread over the new users
+    skew : float, default=1.0
+        A Zipf exponent of the items per user, 0 for uniform
+    title_length : Tuple[int, int], default=(8, 40)
+        A range of title lengths
+    description_length : Tuple[int, int], default=(0, 120)
+        A range of description lengths
+    password : str, default="password"
+        The password of every user
+    unique_passwords : bool, default=False
+        Hash the password once per user (distinct salts) in a process pool,
+        instead of sharing one hash
+    bcrypt_rounds : Optional[int], default=None
+        A bcrypt cost, the passlib default when empty
+    processes : Optional[int], default=None
+        A size of the hashing pool, the CPU count when empty
+    batch_size : int, default=50000
+        A number of rows per transaction
+    days : int, default=365
+        A signup period, ending now
+    seed : Optional[int], default=None
+        A random seed, for reproducible datasets
+
+    Returns
+    -------
+    Tuple[int, int]
+        The numbers of users and items created
+    """
+    rng = np.random.default_rng(seed)
+    dialect = engine.dialect.name
+    with engine.connect() as conn:
+        first_id = (conn.execute(select(func.max(User.id))).scalar() or 0) + 1
+    ids = np.arange(first_id, first_id + users)
+
+    now = np.datetime64(datetime.utcnow(), "us")
+    signup = now - rng.integers(0, days * 86400 * 10 ** 6, size=users).astype("timedelta64[us]")
+    counts = item_counts(rng, users, items, skew) if users else np.zeros(0, dtype=np.int64)
+    owners = rng.permutation(np.repeat(np.arange(users, dtype=np.int64), counts))
+    # an item is created after its owner signed up
+    age = (now - signup[owners]).astype(np.int64)
+    created = signup[owners] + (rng.random(len(owners)) * age).astype("timedelta64[us]")
+    last_item = np.full(users, np.datetime64("NaT"), dtype="datetime64[us]")
+    if len(owners):
+        latest = np.zeros(users, dtype=np.int64)
+        np.maximum.at(latest, owners, created.astype(np.int64))
+        last_item = np.where(counts > 0, latest.astype("datetime64[us]"), last_item)
+
+    started = time.monotonic()
+    shared_hash = None if unique_passwords else hash_password((password, bcrypt_rounds))
+    pool = multiprocessing.Pool(processes) if unique_passwords else None
+    try:
+        for start in range(0, users, batch_size):
+            end = min(start + batch_size, users)
+            if pool is not None:
+                hashes = pool.map(hash_password, repeat((password, bcrypt_rounds), end - start), chunksize=64)
+            else:
+                hashes = repeat(shared_hash)
+            batch_ids = ids[start:end].tolist()
+            signed_up = timestamps(signup[start:end], dialect)
+            last = [value if count else None for value, count in zip(
+                timestamps(last_item[start:end], dialect), counts[start:end].tolist())]
+            load(engine, User.__table__, USER_COLUMNS, zip(
+                batch_ids, (f"user{id}" for id in batch_ids), (f"user{id}@example.com" for id in batch_ids),
+                hashes, repeat(True), counts[start:end].tolist(), last, repeat(1), signed_up, signed_up))
+            logger.info("%s/%s users (%.0f/s)", end, users, end / (time.monotonic() - started))
+    finally:
+        if pool is not None:
+            pool.close()
+    if dialect == "postgresql" and users:
+        with engine.begin() as conn:
+            conn.execute(text("SELECT setval(pg_get_serial_sequence('users', 'id'), (SELECT max(id) FROM users))"))
+
+    started = time.monotonic()
+    for start in range(0, len(owners), batch_size):
+        end = min(start + batch_size, len(owners))
+        batch_owners = ids[owners[start:end]]
+        created_at = timestamps(created[start:end], dialect)
+        rows = list(zip(
+            random_strings(rng, end - start, title_length),
+            random_strings(rng, end - start, description_length),
+            batch_owners.tolist(), repeat(1), created_at, created_at))
+        if shard_router.enabled:
+            by_shard = {}
+            for row in rows:
+                by_shard.setdefault(shard_router.shard_for(row[2]), []).append(row)
+            for index, shard_rows in by_shard.items():
+                load(shard_router.engines[index], Item.__table__, ITEM_COLUMNS, shard_rows)
+        else:
+            load(engine, Item.__table__, ITEM_COLUMNS, rows)
+        logger.info("%s/%s items (%.0f/s)", end, len(owners), end / (time.monotonic() - started))
+    return users, len(owners)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Seed the initial users, or a synthetic dataset")
+    parser.add_argument("--users", type=int, default=0, help="synthetic users, none (initial data) by default")
+    parser.add_argument("--items", type=int, default=0, help="synthetic items, spread over the synthetic users")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of items per user, 0 for uniform")
+    parser.add_argument("--title-length", type=parse_range, default=(8, 40), metavar="MIN:MAX")
+    parser.add_argument("--description-length", type=parse_range, default=(0, 120), metavar="MIN:MAX")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--unique-passwords", action="store_true", help="hash once per user in a process pool")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None)
+    parser.add_argument("--processes", type=int, default=None, help="hashing processes, CPU count by default")
+    parser.add_argument("--batch-size", type=int, default=50000, help="rows per transaction")
+    parser.add_argument("--days", type=int, default=365, help="signup period, ending now")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if not args.users:
+        logger.info("%s initial users created", seed_initial())
+        return
+    started = time.monotonic()
+    users, items = seed_synthetic(
+        args.users, args.items, skew=args.skew, title_length=args.title_length,
+        description_length=args.description_length, password=args.password,
+        unique_passwords=args.unique_passwords, bcrypt_rounds=args.bcrypt_rounds,
+        processes=args.processes, batch_size=args.batch_size, days=args.days, seed=args.seed)
+    logger.info("%s users and %s items seeded in %.1fs", users, items, time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from core.config import settings
+from database import liveness, timeouts
+from services.observability import pool, profiler, queries, tracing
 
 
 def get_url():
@@ -23,12 +25,18 @@ SQLALCHEMY_DATABASE_URL = get_url()
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    pool_pre_ping=True,
     pool_size=10,
     max_overflow=2,
     pool_recycle=300,
     pool_use_lifo=True
 )
+profiler.install(engine)
+queries.install(engine)
+pool.install(engine)
+timeouts.install(engine)
+tracing.install(engine)
+liveness.install(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -0,0 +1,320 @@
+'''shards.py
+Hash sharding of the items table across several databases
+
+The users table stays on the primary database (database/setup.engine), it
+is the directory that assigns user ids and keeps usernames and emails
+unique. Items are partitioned by owner_id over the engines listed in
+settings.SHARD_URLS, with a jump consistent hash, so adding a shard only
+moves about 1/N of the owners. Sharding is off when SHARD_URLS is empty.
+
+Usage (several SQLite files work for local testing):
+
+    SHARD_URLS=sqlite:///shard0.db,sqlite:///shard1.db python -m database.shards init
+    python -m database.shards rebalance [--dry-run]
+'''
+
+import argparse
+import heapq
+import logging
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, Index, MetaData, Table, and_, create_engine, delete, func, insert, or_, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from core.config import settings
+from database import liveness, timeouts
+from database.setup import SessionLocal
+from models.item import Item
+from services.events import items as events
+from services.observability import pool, profiler, queries, tracing
+
+
+logger = logging.getLogger(__name__)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping & Veach) of an integer key
+
+    Parameters
+    ----------
+    key : int
+        A key to place
+    buckets : int
+        A number of buckets
+
+    Returns
+    -------
+    int
+        A bucket in range(buckets)
+    """
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_metadata() -> MetaData:
+    """
+    Schema of a shard database: the items table without its foreign key
+    to users, which lives on the primary database
+    """
+    metadata = MetaData()
+    Table(
+        Item.__table__.name, metadata,
+        *(Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable,
+                 server_default=column.server_default.arg if column.server_default else None)
+          for column in Item.__table__.columns),
+        *(Index(index.name, *(column.name for column in index.columns))
+          for index in Item.__table__.indexes))
+    return metadata
+
+
+class ShardRouter:
+    """
+    Map user ids to shard engines and open sessions on them
+
+    Parameters
+    ----------
+    urls : Sequence[str]
+        A list of shard database urls, sharding is off when empty
+
+    Methods
+    -------
+    configure(self, urls: Sequence[str]) -> None
+        Replace the shard engines
+    shard_for(self, user_id: int) -> int
+        Get the shard index of a user
+    session_for(self, user_id: int) -> Session
+        Open a session on the shard of a user
+    items_session(self, db: Session, user_id: int) -> Iterator[Session]
+        Get the session holding the items of a user
+    items_sessions(self, db: Session) -> Iterator[List[Session]]
+        Get the sessions of every items partition
+    """
+
+    def __init__(self, urls: Sequence[str] = ()):
+        self.engines = []
+        self.sessionmakers = []
+        self.configure(urls)
+
+    def configure(self, urls: Sequence[str]) -> None:
+        for engine in self.engines:
+            engine.dispose()
+        self.engines = [create_engine(url) for url in urls]
+        for engine in self.engines:
+            profiler.install(engine)
+            queries.install(engine)
+            pool.install(engine)
+            timeouts.install(engine)
+            tracing.install(engine)
+            liveness.install(engine)
+        self.sessionmakers = [
+            sessionmaker(autocommit=False, autoflush=False, bind=engine) for engine in self.engines
+        ]
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    def shard_for(self, user_id: int) -> int:
+        return jump_hash(user_id, len(self.engines))
+
+    def session_for(self, user_id: int) -> Session:
+        return self.sessionmakers[self.shard_for(user_id)]()
+
+    @contextmanager
+    def items_session(self, db: Session, user_id: int) -> Iterator[Session]:
+        """
+        Get the session holding the items of a user: db itself when sharding
+        is off, else a new session on the user shard, closed on exit
+        """
+        if not self.enabled:
+            yield db
+            return
+        with self.session_for(user_id) as shard_db:
+            yield shard_db
+
+    @contextmanager
+    def items_sessions(self, db: Session) -> Iterator[List[Session]]:
+        """
+        Get the sessions of every items partition, for scatter-gather reads
+        """
+        if not self.enabled:
+            yield [db]
+            return
+        sessions = [factory() for factory in self.sessionmakers]
+        try:
+            yield sessions
+        finally:
+            for shard_db in sessions:
+                shard_db.close()
+
+
+shard_router = ShardRouter([url.strip() for url in settings.SHARD_URLS.split(",") if url.strip()])
+
+
+def after_key(after: Optional[Tuple[int, int]]):
+    """
+    Keyset condition (owner_id, id) > after, spelled without row values
+    """
+    owner_id, id = after
+    return or_(Item.owner_id > owner_id, and_(Item.owner_id == owner_id, Item.id > id))
+
+
+def scatter_gather_items(
+    sessions: List[Session],
+    *,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[Tuple[int, int]] = None,
+    options: Sequence = (),
+    columns: Sequence = ()
+) -> List[Item]:
+    """
+    Read a page of items ordered by (owner_id, id) from every partition
+
+    Each partition returns at most skip + limit rows of its own order; the
+    sorted streams are merged and the page is cut from the merged stream.
+    Keyset pagination (after) keeps skip at 0 and the reads short.
+
+    Parameters
+    ----------
+    sessions : List[Session]
+        The sessions of every items partition
+    skip : int, default=0
+        A number of items to skip after the cursor
+    limit : int, default=100
+        A limit of list data
+    after : Optional[Tuple[int, int]], default=None
+        A (owner_id, id) cursor, items strictly after it are returned
+    options : Sequence, default=()
+        Loader options (CRUDBase.load_options)
+    columns : Sequence, default=()
+        Columns to select as plain rows instead of Item objects, owner_id
+        and id included
+
+    Returns
+    -------
+    List[Object]
+        An object list of Item, or of rows
+    """
+    stmt = select(*columns) if columns else select(Item).options(*options)
+    stmt = stmt.order_by(Item.owner_id, Item.id).limit(skip + limit)
+    if after is not None:
+        stmt = stmt.where(after_key(after))
+    if columns:
+        streams = [shard_db.execute(stmt).all() for shard_db in sessions]
+    else:
+        streams = [shard_db.execute(stmt).scalars().all() for shard_db in sessions]
+    merged = heapq.merge(*streams, key=lambda item: (item.owner_id, item.id))
+    return list(merged)[skip:skip + limit]
+
+
+def init_shards() -> None:
+    """
+    Create the items table on every shard
+    """
+    metadata = shard_metadata()
+    for engine in shard_router.engines:
+        metadata.create_all(bind=engine)
+        logger.info("Shard %s ready", engine.url)
+
+
+def rebalance(dry_run: bool = False) -> int:
+    """
+    Move the items of every owner stored on a shard other than its own
+
+    Owners are moved one at a time: their items are copied to the target
+    shard and committed, then deleted from the source shard. Rows already
+    present on the target (same owner_id, title, description, created_at)
+    are not copied again, so an interrupted run can simply be restarted.
+
+    Items keep their id, which each shard assigns on its own: an id already
+    taken on the target by another owner is assigned again by the target,
+    and a reset event tells the streams of that owner to reload its items.
+
+    Parameters
+    ----------
+    dry_run : bool, default=False
+        Only count the items to move
+
+    Returns
+    -------
+    int
+        A number of moved items
+    """
+    items = Item.__table__
+    natural_key = [items.c.owner_id, items.c.title, items.c.description, items.c.created_at]
+    moved = 0
+    for source_index, source in enumerate(shard_router.engines):
+        with source.connect() as source_conn:
+            owners = source_conn.execute(select(items.c.owner_id).distinct()).scalars().all()
+        for owner_id in owners:
+            target_index = shard_router.shard_for(owner_id)
+            if target_index == source_index:
+                continue
+            with source.connect() as source_conn:
+                rows = source_conn.execute(select(items).where(items.c.owner_id == owner_id)).mappings().all()
+            logger.info(
+                "Owner %s: %s items from shard %s to shard %s",
+                owner_id, len(rows), source_index, target_index)
+            moved += len(rows)
+            if dry_run:
+                continue
+            with shard_router.engines[target_index].begin() as target_conn:
+                present = set(target_conn.execute(
+                    select(*natural_key).where(items.c.owner_id == owner_id)).all())
+                missing = [
+                    dict(row) for row in rows
+                    if tuple(row[column.name] for column in natural_key) not in present
+                ]
+                taken = set(target_conn.execute(
+                    select(items.c.id).where(items.c.id.in_([row["id"] for row in missing]))).scalars())
+                kept = [row for row in missing if row["id"] not in taken]
+                renumbered = [
+                    {name: value for name, value in row.items() if name != "id"}
+                    for row in missing if row["id"] in taken
+                ]
+                for batch in (kept, renumbered):
+                    if batch:
+                        target_conn.execute(insert(items), batch)
+                if kept and target_conn.dialect.name == "postgresql":
+                    # explicit ids do not advance the id sequence of the target
+                    sequence = func.pg_get_serial_sequence(items.name, items.c.id.name)
+                    target_conn.execute(select(func.setval(sequence, func.greatest(
+                        func.max(items.c.id), func.nextval(sequence)))))
+                owned = set(target_conn.execute(
+                    select(items.c.id).where(items.c.owner_id == owner_id)).scalars())
+            # from the target rows rather than this run, so a restarted run records it too
+            if any(row["id"] not in owned for row in rows):
+                with SessionLocal() as db:
+                    events.record(db, owner_id, events.RESET, {})
+                    db.commit()
+            with source.begin() as source_conn:
+                source_conn.execute(delete(items).where(items.c.owner_id == owner_id))
+    return moved
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Manage the items shards (settings.SHARD_URLS)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="create the items table on every shard")
+    rebalance_parser = commands.add_parser("rebalance", help="move items to the shard of their owner")
+    rebalance_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if not shard_router.enabled:
+        parser.error("SHARD_URLS is empty, sharding is off")
+    if args.command == "init":
+        init_shards()
+    else:
+        print(f"{rebalance(dry_run=args.dry_run)} items {'to move' if args.dry_run else 'moved'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+'''timeouts.py
+Statement deadlines of the current request
+
+    timeout_ms.set(2000)  # statements of this request stop after 2 s
+
+On PostgreSQL every transaction opened while a deadline is set starts
+with SET LOCAL statement_timeout, so the server cancels the statement.
+SQLite has no such setting: a progress handler aborts the statement
+once its deadline has passed. Either way the statement fails with an
+OperationalError recognised by is_timeout.
+
+Outside requests (jobs, CLI) no deadline is set and nothing changes.
+'''
+
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+
+# statement timeout of the current request in milliseconds, None for no limit
+timeout_ms: ContextVar[Optional[int]] = ContextVar("timeout_ms", default=None)
+
+QUERY_CANCELED = "57014"  # postgres sqlstate
+PROGRESS_STEPS = 1000  # sqlite virtual machine instructions between deadline checks
+
+
+@event.listens_for(Session, "after_begin")
+def set_local_timeout(session: Session, transaction, connection) -> None:
+    ms = timeout_ms.get()
+    if ms and connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(ms)}")
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    ms = timeout_ms.get()
+    if not ms:
+        return
+    deadline = time.monotonic() + ms / 1000
+    conn.connection.connection.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+
+
+def clear_progress_handler(conn, *args) -> None:
+    conn.connection.connection.set_progress_handler(None, 0)
+
+
+def handle_error(context) -> None:
+    if context.connection is not None and not context.connection.invalidated:
+        clear_progress_handler(context.connection)
+
+
+def install(engine) -> None:
+    """
+    Enforce the request deadlines on an engine (PostgreSQL needs nothing
+    more than the session listener)
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", clear_progress_handler)
+    event.listen(engine, "handle_error", handle_error)
+
+
+def is_timeout(exc: Exception) -> bool:
+    """
+    Check whether a database error is a statement cancelled by its deadline
+    """
+    if not isinstance(exc, DBAPIError):
+        return False
+    if getattr(exc.orig, "pgcode", None) == QUERY_CANCELED:
+        return True
+    return str(exc.orig) == "interrupted"  # sqlite progress handler
@@ -1,10 +1,18 @@
 
-import uvicorn
-import sentry_sdk
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
-from api.routers import items, users
+from sqlalchemy.exc import OperationalError
+from api.lifecycle import DrainMiddleware, install_exit_hook, lifecycle
+from api.routers import admin, batch, health, items, users
+from api.routing import statement_timeout_handler
 from core.config import settings
+from database import liveness, notify
+from database.setup import engine
+from database.shards import shard_router
+from services.cache.responses import CacheMiddleware
+from services.observability import tracing
+from services.observability.profiler import ProfilerMiddleware
+from services.observability.tracing import TracingMiddleware
 
 
 tags_metadata = [
@@ -23,6 +31,14 @@ tags_metadata = [
     {
         "name": "auth",
         "description": "Authenticate operations"
+    },
+    {
+        "name": "batch",
+        "description": "Many operations in one request"
+    },
+    {
+        "name": "health",
+        "description": "Liveness, readiness and drain of the process"
     }
 ]
 
@@ -34,6 +50,11 @@ app = FastAPI(
 )
 
 
+# Response cache (added first: innermost, so CORS headers stay per request)
+app.add_middleware(CacheMiddleware)
+# ==========
+
+
 # CORS
 cors_origins = [i.strip() for i in settings.CORS_ORIGINS.split(",")]
 app.add_middleware(
@@ -46,15 +67,32 @@ app.add_middleware(
 # ==========
 
 
-# Sentry log
-# sentry_sdk.init(
-#     settings.SENTRY_URL,
+# Profiler (enabled by X-Profile header or PROFILE_SAMPLE_RATE)
+app.add_middleware(ProfilerMiddleware)
+# ==========
 
-#     # Set traces_sample_rate to 1.0 to capture 100%
-#     # of transactions for performance monitoring.
-#     # We recommend adjusting this value in production.
-#     traces_sample_rate=1.0
-# )
+
+# Tracing (TRACE_SAMPLE_RATE, or the sampled flag of a traceparent header)
+app.add_middleware(TracingMiddleware)
+# ==========
+
+
+# Drain (added last: outermost, so requests are counted until fully sent)
+app.add_middleware(DrainMiddleware)
+# ==========
+
+
+# Sentry log (sentry_sdk is only imported when SENTRY_URL is set)
+if settings.SENTRY_URL:
+    import sentry_sdk
+    sentry_sdk.init(
+        settings.SENTRY_URL,
+
+        # Set traces_sample_rate to 1.0 to capture 100%
+        # of transactions for performance monitoring.
+        # We recommend adjusting this value in production.
+        # traces_sample_rate=1.0
+    )
 
 # @app.middleware("http")
 # async def sentry_exception(request, call_next):
@@ -74,9 +112,65 @@ app.add_middleware(
 # ==========
 
 
+# Statements past their deadline (database/timeouts.py) answer 503
+app.add_exception_handler(OperationalError, statement_timeout_handler)
+# ==========
+
+
+# Cross-process notifications (change feed, cache purges, user indexes)
+@app.on_event("startup")
+def start_notify_listener():
+    notify.listen(engine)
+
+
+# Background ping of idle pooled connections (database/liveness.py)
+@app.on_event("startup")
+def start_pool_pinger():
+    liveness.start(engine, *shard_router.engines)
+# ==========
+
+
 # API register
 app.include_router(items.router)
 app.include_router(users.router)
+app.include_router(batch.router)
+app.include_router(admin.router)
+app.include_router(health.router)
+
+
+# OpenAPI schema, generated once at startup (after every route is
+# registered) and served from memory by /openapi.json and /docs
+@app.on_event("startup")
+def build_openapi():
+    app.openapi()
+# ==========
+
+
+# Lifecycle (api/lifecycle.py): warm up in the background, GET /health/ready
+# answers 200 once done; SIGTERM begins the drain before uvicorn waits for
+# the open connections, the shutdown waits for the requests left, then
+# flushes and closes
+install_exit_hook()
+
+
+@app.on_event("startup")
+def start_warm_up():
+    lifecycle.start_warm_up(engine)
+
+
+@app.on_event("shutdown")
+async def drain_and_flush():
+    await lifecycle.drain(settings.DRAIN_TIMEOUT)
+    for thread in (notify.listener, liveness.pinger):
+        if thread is not None:
+            thread.stop()
+    tracing.exporter.flush()
+    engine.dispose()
+    for shard_engine in shard_router.engines:
+        shard_engine.dispose()
+# ==========
 
 if __name__ == "__main__":
+    import uvicorn
+    install_exit_hook()
     uvicorn.run(app, host="0.0.0.0", port="8000", debug_level="info")
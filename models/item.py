@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Integer, ForeignKey
+from datetime import datetime
+from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from database.setup import Base
 
@@ -13,6 +14,15 @@ class Item(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(150), index=True)
     description = Column(String(300), index=True)
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # bumped by every write of the item (ETag, Last-Modified)
+    version = Column(Integer, default=1, server_default="1", nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
     owner = relationship("User", back_populates="items")
+
+    __table_args__ = (
+        # covers the version lookups of conditional GETs (index-only scan)
+        Index("ix_items_id_version", "id", "owner_id", "version", "updated_at"),
+    )
@@ -0,0 +1,21 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from database.setup import Base
+
+
+class ItemEvent(Base):
+    """
+    Table model of item_events (change feed of the items of a user)
+    """
+
+    __tablename__ = "item_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    type = Column(String(20), nullable=False)
+    data = Column(Text, default="{}")
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        Index("ix_item_events_user_id_id", "user_id", "id"),
+    )
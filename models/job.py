@@ -0,0 +1,27 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from database.setup import Base
+
+
+class Job(Base):
+    """
+    Table model of jobs (background work queue)
+    """
+
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), index=True)
+    payload = Column(Text, default="{}")
+    status = Column(String(20), default="queued")
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=5)
+    run_at = Column(DateTime, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)
+    locked_by = Column(String(100), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+    )
@@ -0,0 +1,36 @@
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime
+from database.setup import Base
+
+
+class SignupsDaily(Base):
+    """
+    Table model of stats_signups_daily (rollup of users.created_at)
+    """
+
+    __tablename__ = "stats_signups_daily"
+
+    day = Column(Date, primary_key=True)
+    signups = Column(Integer, nullable=False)
+
+
+class ItemCountBucket(Base):
+    """
+    Table model of stats_item_counts (users by item count and status)
+    """
+
+    __tablename__ = "stats_item_counts"
+
+    item_count = Column(Integer, primary_key=True)
+    is_active = Column(Boolean, primary_key=True)
+    users = Column(Integer, nullable=False)
+
+
+class StatsRollup(Base):
+    """
+    Table model of stats_rollups (last refresh of each rollup)
+    """
+
+    __tablename__ = "stats_rollups"
+
+    name = Column(String(50), primary_key=True)
+    refreshed_at = Column(DateTime, nullable=False)
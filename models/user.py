@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Index
 from sqlalchemy.orm import relationship
 from database.setup import Base
 
@@ -15,6 +16,22 @@ class User(Base):
     email = Column(String(100), unique=True, index=True)
     hashed_password = Column(String(500))
     is_active = Column(Boolean, default=True)
+    # maintained by CRUDItem writes, repaired by the reconcile_item_counts job
+    item_count = Column(Integer, default=0, server_default="0", nullable=False)
+    last_item_at = Column(DateTime, nullable=True)
+    # bumped by every write of the user or of its items (ETag, Last-Modified)
+    version = Column(Integer, default=1, server_default="1", nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
     items = relationship("Item", back_populates="owner",
                          cascade="all, delete")
+
+    __table_args__ = (
+        # covers the version lookups of conditional GETs (index-only scan)
+        Index("ix_users_id_version", "id", "version", "updated_at"),
+        # covers the item count histogram of the stats rollups
+        Index("ix_users_is_active_item_count", "is_active", "item_count"),
+        # covers the username prefix searches (range scan in byte order)
+        Index("ix_users_username_pattern", "username", "id", postgresql_ops={"username": "text_pattern_ops"}),
+    )
@@ -0,0 +1,279 @@
+'''responses.py
+Response cache: pre-serialised GET responses, purged by tag
+
+An endpoint opts in by tagging its response with the entities it reads:
+
+    cache_tags(request, f"user:{user_id}")
+
+CacheMiddleware keeps the status, headers and body of the tagged 200
+responses, keyed by path, query string and principal (the bearer token),
+for settings.RESPONSE_CACHE_TTL seconds, and answers the next identical
+request without reaching the app (no DB access, no serialisation).
+
+The CRUD write methods call purge(db, *tags) in their transaction; once
+it commits, the writing process drops the matching entries at once, so a
+client reads its own writes, and the other processes when the
+notification reaches them (database/notify.py). Each process has its own
+cache, the purges are shared.
+'''
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from jose import jwt, JWTError
+from sqlalchemy.orm import Session
+from starlette.requests import Request
+
+from api.conditional import check_fresh, parse_http_date
+from core.config import settings
+from database import notify
+from database.hooks import on_commit
+
+
+STATE_KEY = "cache_tags"
+
+# tags of the entities read by the cached endpoints
+ITEMS = "items"
+
+
+def user_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def owner_items_tag(user_id: int) -> str:
+    return f"items:owner:{user_id}"
+
+
+class Entry:
+    """
+    A cached response
+    """
+
+    __slots__ = ("status", "headers", "body", "tags", "expires", "etag", "last_modified")
+
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], body: bytes, tags: Set[str], expires: float):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.tags = tags
+        self.expires = expires
+        validators = {name: value.decode("latin-1") for name, value in headers if name in (b"etag", b"last-modified")}
+        self.etag = validators.get(b"etag")
+        self.last_modified = parse_http_date(validators[b"last-modified"]) if b"last-modified" in validators else None
+
+
+class ResponseCache:
+    """
+    LRU store of responses with a tag index
+
+    A response is only stored if none of its tags was purged since its
+    request started, so a write racing with a read cannot leave a stale
+    entry behind.
+
+    Methods
+    -------
+    get(self, key: str) -> Optional[Entry]
+        Get a fresh entry
+    set(self, key: str, entry: Entry, started: int) -> bool
+        Store an entry unless one of its tags was purged since started
+    purge(self, tags: Iterable[str]) -> int
+        Drop the entries of tags
+    clear(self) -> None
+        Drop every entry
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self.tags: Dict[str, Set[str]] = {}
+        self.purged: Dict[str, int] = {}
+        self.cleared = 0
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def tick(self) -> int:
+        with self.lock:
+            self.clock += 1
+            return self.clock
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: str, entry: Entry, started: int) -> bool:
+        with self.lock:
+            if self.cleared > started or any(self.purged.get(tag, 0) > started for tag in entry.tags):
+                return False
+            self._drop(key)
+            self.entries[key] = entry
+            for tag in entry.tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+            return True
+
+    def purge(self, tags: Iterable[str]) -> int:
+        with self.lock:
+            self.clock += 1
+            if len(self.purged) > self.max_entries:  # forget old purges, refusing in-flight stores instead
+                self.purged.clear()
+                self.cleared = self.clock
+            keys = set()
+            for tag in tags:
+                self.purged[tag] = self.clock
+                keys |= self.tags.pop(tag, set())
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.clock += 1
+            self.cleared = self.clock
+            self.purged.clear()
+            self.entries.clear()
+            self.tags.clear()
+
+    def _drop(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "tags": len(self.tags),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+cache = ResponseCache(settings.RESPONSE_CACHE_SIZE)
+notify.subscribe(settings.CACHE_CHANNEL, cache.purge, on_reconnect=cache.clear)
+
+
+def cache_tags(request: Request, *tags: str) -> None:
+    """
+    Let the response of the current request be cached, under tags
+    """
+    setattr(request.state, STATE_KEY, set(tags) | getattr(request.state, STATE_KEY, set()))
+
+
+def purge(db: Session, *tags: str) -> None:
+    """
+    Drop the cached responses of tags once the transaction of db commits
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    *tags : str
+        The tags of the written entities
+    """
+    on_commit(db, lambda: cache.purge(tags))  # this process before the response is sent, not when NOTIFY is back
+    notify.notify(db, settings.CACHE_CHANNEL, list(tags))
+
+
+def cache_key(scope: Dict[str, Any], headers: Dict[bytes, bytes]) -> Tuple[str, float]:
+    """
+    Get the cache key of a request and the expiry time of its principal:
+    the token expiry caps the entry lifetime, so a cached response never
+    outlives the token that was allowed to read it
+    """
+    expires = time.monotonic() + settings.RESPONSE_CACHE_TTL
+    authorization = headers.get(b"authorization", b"")
+    principal = hashlib.sha256(authorization).hexdigest() if authorization else "anonymous"
+    if authorization:
+        try:
+            exp = jwt.get_unverified_claims(authorization.split(b" ")[-1].decode()).get("exp")
+        except (JWTError, UnicodeDecodeError):
+            exp = None
+        if exp:
+            expires = min(expires, time.monotonic() + exp - time.time())
+    query = "&".join(sorted(scope["query_string"].decode("latin-1").split("&")))
+    return f"{scope['path']}?{query}#{principal}", expires
+
+
+class CacheMiddleware:
+    """
+    ASGI middleware answering GET requests from the response cache
+
+    Requests other than GET, and responses of endpoints that did not call
+    cache_tags, go through untouched. Cached responses carry X-Cache: HIT,
+    and become a 304 when their validators match the conditional headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or settings.RESPONSE_CACHE_TTL <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        key, expires = cache_key(scope, headers)
+        entry = cache.get(key)
+        if entry is not None and check_fresh(
+                *(headers[name].decode("latin-1") if name in headers else None
+                  for name in (b"if-none-match", b"if-modified-since")),
+                entry.etag, entry.last_modified):
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [(name, value) for name, value in entry.headers
+                            if name in (b"etag", b"last-modified")] + [(b"x-cache", b"HIT")],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if entry is not None:
+            await send({
+                "type": "http.response.start",
+                "status": entry.status,
+                "headers": entry.headers + [(b"x-cache", b"HIT")],
+            })
+            await send({"type": "http.response.body", "body": entry.body})
+            return
+
+        started = cache.tick()
+        scope.setdefault("state", {})
+        response: Dict[str, Any] = {"keep": False, "headers": [], "body": []}
+
+        async def send_and_keep(message):
+            if message["type"] == "http.response.start":
+                # tags are set by the endpoint, before the response starts
+                response["keep"] = message["status"] == 200 and bool(scope["state"].get(STATE_KEY))
+                response["headers"] = list(message.get("headers", []))
+                message["headers"] = response["headers"] + [(b"x-cache", b"MISS")]
+            elif message["type"] == "http.response.body" and response["keep"]:
+                response["body"].append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    cache.set(key, Entry(
+                        200, response["headers"], b"".join(response["body"]),
+                        scope["state"][STATE_KEY], expires), started)
+            await send(message)
+
+        await self.app(scope, receive, send_and_keep)
@@ -0,0 +1,96 @@
+'''broker.py
+In-process fan-out of item events to the open event streams
+
+Each process keeps the streams of its own clients; the events of every
+process (API and job workers) reach them through database/notify.py.
+'''
+
+import asyncio
+import threading
+from typing import Any, Dict, Optional, Set
+
+from core.config import settings
+
+
+class Subscription:
+    """
+    The pending events of one stream, bound to the event loop it was
+    created on; closed when the stream falls too far behind, the client
+    then resumes from the database with Last-Event-ID
+    """
+
+    def __init__(self, user_id: int, maxsize: int):
+        self.user_id = user_id
+        self.maxsize = maxsize
+        self.closed = False
+        self.loop = asyncio.get_event_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def deliver(self, message: Optional[Dict[str, Any]]) -> None:
+        """
+        Queue a message from any thread, None closes the subscription
+        """
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message: Optional[Dict[str, Any]]) -> None:
+        if self.closed:
+            return
+        if message is None or self.queue.qsize() >= self.maxsize:
+            self.closed = True
+            message = None
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Wait for the next message, None on timeout or when closed
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    """
+    Registry of the event streams of this process, by user id
+
+    Methods
+    -------
+    subscribe(self, user_id: int) -> Subscription
+        Open a subscription to the events of a user
+    unsubscribe(self, subscription: Subscription) -> None
+        Close a subscription
+    publish(self, message: Dict[str, Any]) -> None
+        Deliver an event to the subscriptions of its user
+    close_all(self) -> None
+        Close every subscription
+    """
+
+    def __init__(self):
+        self.subscriptions: Dict[int, Set[Subscription]] = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, settings.EVENTS_QUEUE_SIZE)
+        with self.lock:
+            self.subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, message: Dict[str, Any]) -> None:
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(message["user_id"], ()))
+        for subscription in subscriptions:
+            subscription.deliver(message)
+
+    def close_all(self) -> None:
+        with self.lock:
+            subscriptions = [item for items in self.subscriptions.values() for item in items]
+        for subscription in subscriptions:
+            subscription.deliver(None)
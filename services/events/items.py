@@ -0,0 +1,193 @@
+'''items.py
+Change feed of the items of a user
+
+CRUDItem writes record an ItemEvent in their own transaction, so an
+event exists if and only if its write committed, and the stream of a
+client can resume from the last event id it received. Event ids follow
+insertion, not commit order: a stream may send a lower id after a higher
+one, and a resume sends the recent ones again (see late), so clients
+apply the events by id and skip the ids they have.
+'''
+
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from database import notify
+from models.item_event import ItemEvent
+from services.events.broker import Broker
+
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+IMPORTED = "imported"
+RESET = "reset"  # the items were renumbered (database/shards.py rebalance), reload them
+
+broker = Broker()
+notify.subscribe(settings.EVENTS_CHANNEL, broker.publish, on_reconnect=broker.close_all)
+
+
+def message(event: ItemEvent, data: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": event.id, "user_id": event.user_id, "type": event.type, "data": data}
+
+
+def record(db: Session, user_id: int, type: str, data: Dict[str, Any]) -> ItemEvent:
+    """
+    Record an item event in the current transaction of db
+
+    The event is announced to the streams of every process once the
+    transaction commits (database/notify.py).
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    user_id : int
+        An owner id of the item
+    type : str
+        created, updated, deleted, imported or reset
+    data : Dict[str, Any]
+        A JSON serialisable event body
+
+    Returns
+    -------
+    Object
+        An object of ItemEvent
+    """
+    event = ItemEvent(user_id=user_id, type=type, data=json.dumps(data, default=str))
+    db.add(event)
+    db.flush()
+    notify.notify(db, settings.EVENTS_CHANNEL, message(event, data))
+    return event
+
+
+def record_many(db: Session, entries: List[Tuple[int, str, Dict[str, Any]]]) -> List[ItemEvent]:
+    """
+    Record item events in the current transaction of db, with one flush
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    entries : List[Tuple[int, str, Dict[str, Any]]]
+        The (user_id, type, data) of each event
+
+    Returns
+    -------
+    List[ItemEvent]
+        The events, in the order of entries
+    """
+    events = [ItemEvent(user_id=user_id, type=type, data=json.dumps(data, default=str))
+              for user_id, type, data in entries]
+    db.add_all(events)
+    db.flush()
+    for event, (_, _, data) in zip(events, entries):
+        notify.notify(db, settings.EVENTS_CHANNEL, message(event, data))
+    return events
+
+
+def replay(db: Session, user_id: int, after: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Get the events of a user after an event id, oldest first
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    user_id : int
+        An owner id of the items
+    after : int
+        The last event id received by the client
+    limit : Optional[int], default=None
+        A maximum number of events, settings.EVENTS_REPLAY_LIMIT when empty
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        A list of event messages
+    """
+    events = db.execute(
+        select(ItemEvent)
+        .where(ItemEvent.user_id == user_id, ItemEvent.id > after)
+        .order_by(ItemEvent.id)
+        .limit(limit or settings.EVENTS_REPLAY_LIMIT)
+    ).scalars()
+    return [message(event, json.loads(event.data)) for event in events]
+
+
+def late(db: Session, user_id: int, after: int) -> List[Dict[str, Any]]:
+    """
+    Get the events of a user numbered below an event id but created at most
+    settings.EVENTS_RESUME_WINDOW seconds before it: ids come from a
+    sequence, so a transaction may commit a lower id after a higher one was
+    sent, and the client may have missed it
+    """
+    created_at = db.execute(select(ItemEvent.created_at).where(ItemEvent.id == after)).scalar()
+    if created_at is None:
+        return []
+    events = db.execute(
+        select(ItemEvent)
+        .where(ItemEvent.user_id == user_id, ItemEvent.id < after,
+               ItemEvent.created_at >= created_at - timedelta(seconds=settings.EVENTS_RESUME_WINDOW))
+        .order_by(ItemEvent.id)
+        .limit(settings.EVENTS_REPLAY_LIMIT)
+    ).scalars()
+    return [message(event, json.loads(event.data)) for event in events]
+
+
+def resume(db: Session, user_id: int, after: int) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Get the events a client missed since an event id, with the late ones
+    below it (see late), which it may have received already
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    user_id : int
+        An owner id of the items
+    after : int
+        The last event id received by the client
+
+    Returns
+    -------
+    Tuple[List[Dict[str, Any]], bool]
+        The missed events, and whether the client must reload its items
+        instead: too many events, or some of them already pruned
+    """
+    oldest = db.execute(select(func.min(ItemEvent.id))).scalar()
+    if oldest is not None and after + 1 < oldest:
+        return [], True
+    events = replay(db, user_id, after, limit=settings.EVENTS_REPLAY_LIMIT + 1)
+    if len(events) > settings.EVENTS_REPLAY_LIMIT:
+        return [], True
+    return late(db, user_id, after) + events, False
+
+
+def prune(db: Session, retention_hours: Optional[int] = None) -> int:
+    """
+    Delete the events older than the retention, clients resuming from
+    before it are told to reload (see resume)
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    retention_hours : Optional[int], default=None
+        An age in hours, settings.EVENTS_RETENTION_HOURS when empty
+
+    Returns
+    -------
+    int
+        A number of deleted events
+    """
+    hours = retention_hours or settings.EVENTS_RETENTION_HOURS
+    result = db.execute(
+        delete(ItemEvent).where(ItemEvent.created_at < datetime.utcnow() - timedelta(hours=hours)))
+    db.commit()
+    return result.rowcount
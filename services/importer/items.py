@@ -0,0 +1,182 @@
+'''items.py
+Streaming import of items from CSV or NDJSON request bodies
+
+Rows are parsed as the body arrives, validated against ItemCreate and
+written in chunks of settings.IMPORT_CHUNK_SIZE rows, one transaction per
+chunk, so neither the file nor the whole import is held in memory. A
+chunk the database rejects is rolled back and reported with its line
+range; the chunks before it stay imported and the next ones are tried.
+'''
+
+import csv
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from api.schemas.item import ItemCreate
+from core.config import settings
+from crud.crud_item import crud_item
+
+
+logger = logging.getLogger(__name__)
+
+CSV = "csv"
+NDJSON = "ndjson"
+
+
+async def iter_lines(stream: AsyncIterator[bytes], encoding: str = "utf-8") -> AsyncIterator[str]:
+    """
+    Split a byte stream into text lines, without their line break
+    """
+    pending = b""
+    async for chunk in stream:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r").decode(encoding)
+    if pending:
+        yield pending.rstrip(b"\r").decode(encoding)
+
+
+async def iter_csv_records(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Parse a CSV stream with a header row into (line number, row) pairs
+
+    A quoted field may span lines: physical lines are joined until the
+    quotes of the record are balanced.
+    """
+    header: Optional[List[str]] = None
+    record, first_line, line_no = "", 0, 0
+    async for line in iter_lines(stream):
+        line_no += 1
+        record = f"{record}\n{line}" if record else line
+        first_line = first_line or line_no
+        if record.count('"') % 2:
+            continue
+        if record.strip():
+            values = next(csv.reader([record]))
+            if header is None:
+                header = [name.strip() for name in values]
+            else:
+                yield first_line, dict(zip(header, values))
+        record, first_line = "", 0
+    if record.strip():
+        yield first_line, {"__error__": "Unterminated quoted field"}
+
+
+async def iter_ndjson_records(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Parse a NDJSON stream into (line number, object) pairs
+    """
+    line_no = 0
+    async for line in iter_lines(stream):
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            record = {"__error__": f"Invalid JSON: {e}"}
+        yield line_no, record if isinstance(record, dict) else {"__error__": "Expected a JSON object"}
+
+
+class ImportResult:
+    """
+    Counters and per-row errors of an import
+    """
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.chunks = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def error(self, line: int, error: Any) -> None:
+        self.failed += 1
+        if len(self.errors) < settings.IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def chunk_error(self, first_line: int, last_line: int, rows: int, error: Any) -> None:
+        self.failed += rows
+        if len(self.errors) < settings.IMPORT_MAX_ERRORS:
+            self.errors.append({"lines": [first_line, last_line], "error": error})
+
+    def dict(self) -> Dict[str, Any]:
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "chunks": self.chunks,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+async def import_items(
+    db: Session,
+    user_id: int,
+    stream: AsyncIterator[bytes],
+    format: str = CSV,
+    chunk_size: Optional[int] = None
+) -> ImportResult:
+    """
+    Validate and load the items of a CSV or NDJSON stream for a user
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    user_id : int
+        An owner id of the items
+    stream : AsyncIterator[bytes]
+        A body stream (Request.stream())
+    format : str, default="csv"
+        "csv" (with a header row) or "ndjson"
+    chunk_size : Optional[int], default=None
+        A number of rows per transaction, settings.IMPORT_CHUNK_SIZE when empty
+
+    Returns
+    -------
+    Object
+        An object of ImportResult
+    """
+    chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+    records = iter_ndjson_records(stream) if format == NDJSON else iter_csv_records(stream)
+    result = ImportResult()
+    chunk: List[Dict[str, Any]] = []
+    lines: List[int] = []
+
+    async def flush() -> None:
+        try:
+            await crud_item.bulk_create_user_items(db=db, rows=chunk, user_id=user_id)
+        except DBAPIError as e:
+            db.rollback()
+            logger.warning("Import for user %s: chunk of lines %s-%s failed", user_id, lines[0], lines[-1], exc_info=True)
+            result.chunk_error(lines[0], lines[-1], len(chunk), str(e.orig).strip().splitlines()[0])
+        else:
+            result.imported += len(chunk)
+            result.chunks += 1
+        chunk.clear()
+        lines.clear()
+        logger.info(
+            "Import for user %s: %s rows imported, %s failed", user_id, result.imported, result.failed)
+
+    async for line, record in records:
+        if "__error__" in record:
+            result.error(line, record["__error__"])
+            continue
+        try:
+            item = ItemCreate(**{key: (value if value != "" else None) for key, value in record.items()})
+        except ValidationError as e:
+            result.error(line, e.errors())
+            continue
+        chunk.append(item.dict())
+        lines.append(line)
+        if len(chunk) >= chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+    return result
@@ -0,0 +1,86 @@
+'''bloom.py
+Counting Bloom filter: set membership without false negatives
+
+    bloom = CountingBloomFilter(capacity=1000000, error_rate=0.001)
+    bloom.add("alice")
+    "alice" in bloom  # True
+    "bob" in bloom    # False, or True with probability error_rate
+
+Each key increments k one-byte counters, so keys can be removed again.
+A counter reaching 255 stays there (removals leave it set), which only
+costs false positives.
+'''
+
+import hashlib
+import math
+import threading
+from typing import Any, Dict, List
+
+
+MAX_COUNT = 255
+
+
+class CountingBloomFilter:
+    """
+    Bloom filter of byte counters, sized for a capacity and error rate
+
+    Parameters
+    ----------
+    capacity : int
+        The number of keys the error rate holds for
+    error_rate : float
+        The false positive probability at capacity
+
+    Methods
+    -------
+    add(self, key: str) -> None
+        Add a key
+    remove(self, key: str) -> None
+        Remove a key that was added
+    stats(self) -> Dict[str, Any]
+        Get the size and fill of the filter
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.counters = bytearray(self.size)
+        self.keys = 0
+        self.lock = threading.Lock()
+
+    def positions(self, key: str) -> List[int]:
+        # double hashing: k positions from two 64 bit hashes of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, key: str) -> None:
+        positions = self.positions(key)
+        with self.lock:
+            for position in positions:
+                if self.counters[position] < MAX_COUNT:
+                    self.counters[position] += 1
+            self.keys += 1
+
+    def remove(self, key: str) -> None:
+        positions = self.positions(key)
+        with self.lock:
+            for position in positions:
+                if 0 < self.counters[position] < MAX_COUNT:
+                    self.counters[position] -= 1
+            self.keys = max(0, self.keys - 1)
+
+    def __contains__(self, key: str) -> bool:
+        counters = self.counters
+        return all(counters[position] for position in self.positions(key))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": self.keys,
+            "capacity": self.capacity,
+            "counters": self.size,
+            "hashes": self.hashes,
+            "error_rate": self.error_rate,
+        }
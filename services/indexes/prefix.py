@@ -0,0 +1,148 @@
+'''prefix.py
+Usernames by prefix, in a sorted array of each process
+
+    index.search("ali", limit=20)  # [(id, username), ...], None until ready
+
+The usernames and ids are kept in two parallel arrays sorted by username
+(code point order, the byte order of UTF-8): a prefix is the range
+between two bisections, so a lookup costs O(log n) whatever the number
+of users. The arrays are built by streaming the users table, then kept
+current by the user writes, which announce the names they add and remove
+on the users index channel (services/indexes/users.py). Announcements
+received during a build are applied again on top of it: adding or
+removing an (id, username) pair twice changes nothing.
+
+The announcements reach every process on PostgreSQL only: the LISTEN
+thread starts the build once it listens. Until it is ready, while
+rebuilding after notifications may have been lost, while the LISTEN
+connection is down, and on other databases, search returns None and
+callers query the database (crud_user.search_usernames).
+'''
+
+import bisect
+import logging
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from core.config import settings
+from database import notify
+from database.setup import SessionLocal
+from models.user import User
+
+
+logger = logging.getLogger(__name__)
+
+BUILD_BATCH = 10000  # rows per fetch of the build
+PREFIX_END = "\U0010ffff"  # sorts after every string of a prefix
+
+
+class PrefixIndex:
+    """
+    Sorted (username, id) arrays of the users table
+
+    Methods
+    -------
+    rebuild(self) -> None
+        Forget the arrays and build them again in a background thread
+    build(self) -> None
+        Build the arrays from the users table
+    handle(self, payload: Dict[str, Any]) -> None
+        Apply the names announced by a write (notify handler)
+    search(self, prefix: str, limit: int) -> Optional[List[Tuple[int, str]]]
+        Get the first users whose username starts with prefix
+    """
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.ids = array("q")
+        self.ready = False
+        self.backlog: Optional[List[Dict[str, Any]]] = None  # announcements received during a build
+        self.building = False
+        self.pending = False
+        self.lock = threading.Lock()
+
+    def rebuild(self) -> None:
+        with self.lock:
+            self.ready = False
+            if self.building:  # the running build starts over once done
+                self.pending = True
+                return
+            self.building = True
+        threading.Thread(target=self.run_builds, name="prefix-index", daemon=True).start()
+
+    def run_builds(self) -> None:
+        while True:
+            try:
+                self.build()
+            except Exception:
+                logger.exception("Prefix index build failed, user searches query the database")
+            with self.lock:
+                if not self.pending:
+                    self.building = False
+                    return
+                self.pending = False
+
+    def build(self) -> None:
+        started = time.monotonic()
+        with self.lock:
+            self.backlog = []
+        pairs: List[Tuple[str, int]] = []
+        with SessionLocal() as db:
+            result = db.execute(select(User.username, User.id).execution_options(stream_results=True))
+            for rows in result.partitions(BUILD_BATCH):
+                pairs.extend((username, id) for username, id in rows if username is not None)
+        pairs.sort()
+        with self.lock:
+            self.names = [username for username, _ in pairs]
+            self.ids = array("q", (id for _, id in pairs))
+            for payload in self.backlog:
+                self._apply(payload)
+            self.backlog = None
+            self.ready = not self.pending
+        logger.info("Prefix index built: %s usernames in %.2fs", len(pairs), time.monotonic() - started)
+
+    def handle(self, payload: Dict[str, Any]) -> None:
+        with self.lock:
+            if self.backlog is not None:
+                self.backlog.append(payload)
+            self._apply(payload)
+
+    def _apply(self, payload: Dict[str, Any]) -> None:
+        for id, username in payload.get("names_removed", ()):
+            position = self._find(username, id)
+            if position is not None:
+                del self.names[position]
+                del self.ids[position]
+        for id, username in payload.get("names_added", ()):
+            if self._find(username, id) is None:
+                position = bisect.bisect_right(self.names, username)
+                self.names.insert(position, username)
+                self.ids.insert(position, id)
+
+    def _find(self, username: str, id: int) -> Optional[int]:
+        position = bisect.bisect_left(self.names, username)
+        while position < len(self.names) and self.names[position] == username:
+            if self.ids[position] == id:
+                return position
+            position += 1
+        return None
+
+    def search(self, prefix: str, limit: int) -> Optional[List[Tuple[int, str]]]:
+        with self.lock:
+            if not self.ready or not notify.listening():
+                return None
+            start = bisect.bisect_left(self.names, prefix)
+            end = min(bisect.bisect_left(self.names, prefix + PREFIX_END, start), start + limit)
+            return list(zip(self.ids[start:end], self.names[start:end]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "usernames": len(self.names)}
+
+
+index = PrefixIndex()
+notify.subscribe(settings.USERS_INDEX_CHANNEL, index.handle, on_reconnect=index.rebuild)
+
@@ -0,0 +1,180 @@
+'''users.py
+Taken usernames and emails, in a Bloom filter of each process
+
+    if not index.might_exist(USERNAME, "alice"):
+        ...  # certainly available, no query
+
+The filter is built by streaming the users table, then kept current by
+the user writes, which announce their keys with notify (database/notify.py)
+so every process sees them once committed. That needs PostgreSQL: the
+LISTEN thread starts the build once it listens (see notify.subscribe
+on_reconnect). Until it is ready, while the LISTEN connection is down, and
+on other databases, whose notifications stay in the writing process, every
+key "might exist" and callers query the database.
+
+Keys are case-insensitive, as emails and usernames are under some
+collations (MySQL): a filter with more keys only has more false positives.
+
+A filter never answers "absent" for a taken key: a removal is only
+applied when the key was surely added, i.e. committed after the build
+snapshot (the writer clock, minus CLOCK_SKEW); other removals leave false
+positives, answered by the database.
+'''
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from database import notify
+from database.setup import SessionLocal
+from models.user import User
+from services.indexes.bloom import CountingBloomFilter
+
+
+logger = logging.getLogger(__name__)
+
+USERNAME = "username"
+EMAIL = "email"
+CLOCK_SKEW = 5.0  # seconds, between the clocks of the app processes
+BUILD_BATCH = 10000  # rows per fetch of the build
+
+
+def index_key(kind: str, value: str) -> str:
+    return f"{kind}:{value.lower()}"
+
+
+class UserIndex:
+    """
+    Bloom filter of the usernames and emails of the users table
+
+    Methods
+    -------
+    rebuild(self) -> None
+        Forget the filter and build it again in a background thread
+    build(self) -> None
+        Build the filter from the users table
+    handle(self, payload: Dict[str, Any]) -> None
+        Apply the keys announced by a write (notify handler)
+    might_exist(self, kind: str, value: str) -> bool
+        Check a username or email, False means certainly not taken
+    """
+
+    def __init__(self):
+        self.bloom: Optional[CountingBloomFilter] = None
+        self.ready = False
+        self.removals_after = float("inf")
+        self.building = False
+        self.pending = False
+        self.checks = 0
+        self.negatives = 0
+        self.lock = threading.Lock()
+
+    def rebuild(self) -> None:
+        with self.lock:
+            self.ready = False
+            if self.building:  # the running build starts over once done
+                self.pending = True
+                return
+            self.building = True
+        threading.Thread(target=self.run_builds, name="user-index", daemon=True).start()
+
+    def run_builds(self) -> None:
+        while True:
+            try:
+                self.build()
+            except Exception:
+                logger.exception("User index build failed, availability checks query the database")
+            with self.lock:
+                if not self.pending:
+                    self.building = False
+                    return
+                self.pending = False
+
+    def build(self) -> None:
+        started = time.monotonic()
+        with SessionLocal() as db:
+            users = db.execute(select(func.count()).select_from(User)).scalar()
+            bloom = CountingBloomFilter(
+                max(settings.AVAILABILITY_CAPACITY, 2 * users), settings.AVAILABILITY_ERROR_RATE)
+            with self.lock:
+                # writes committed from now on are added to the new filter
+                self.bloom = bloom
+                self.ready = False
+            result = db.execute(
+                select(User.username, User.email).execution_options(stream_results=True))
+            snapshot_at = time.time()
+            for rows in result.partitions(BUILD_BATCH):
+                for username, email in rows:
+                    if username is not None:
+                        bloom.add(index_key(USERNAME, username))
+                    if email is not None:
+                        bloom.add(index_key(EMAIL, email))
+        with self.lock:
+            if self.bloom is bloom and not self.pending:
+                self.removals_after = snapshot_at + CLOCK_SKEW
+                self.ready = True
+        logger.info("User index built: %s keys in %.2fs", bloom.keys, time.monotonic() - started)
+
+    def handle(self, payload: Dict[str, Any]) -> None:
+        with self.lock:
+            bloom, apply_removals = self.bloom, self.ready and payload.get("at", 0) > self.removals_after
+        if bloom is None:
+            return
+        for key in payload.get("added", ()):
+            bloom.add(key)
+        if apply_removals:
+            for key in payload.get("removed", ()):
+                bloom.remove(key)
+
+    def might_exist(self, kind: str, value: str) -> bool:
+        self.checks += 1
+        bloom = self.bloom
+        if not self.ready or not notify.listening() or bloom is None or index_key(kind, value) in bloom:
+            return True
+        self.negatives += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "checks": self.checks,
+            "answered_without_query": self.negatives,
+            **(self.bloom.stats() if self.bloom is not None else {}),
+        }
+
+
+index = UserIndex()
+notify.subscribe(settings.USERS_INDEX_CHANNEL, index.handle, on_reconnect=index.rebuild)
+
+
+def announce(
+    db: Session,
+    added: Iterable[str] = (),
+    removed: Iterable[str] = (),
+    names_added: Iterable[Tuple[int, str]] = (),
+    names_removed: Iterable[Tuple[int, str]] = ()
+) -> None:
+    """
+    Update the index of every process once the transaction of db commits
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    added : Iterable[str]
+        The index_key of the usernames and emails written
+    removed : Iterable[str]
+        The index_key of the usernames and emails deleted or replaced
+    names_added : Iterable[Tuple[int, str]]
+        The (id, username) written, for the prefix index (services/indexes/prefix.py)
+    names_removed : Iterable[Tuple[int, str]]
+        The (id, username) deleted or replaced
+    """
+    notify.notify(db, settings.USERS_INDEX_CHANNEL, {
+        "added": list(added), "removed": list(removed),
+        "names_added": list(names_added), "names_removed": list(names_removed), "at": time.time()})
@@ -0,0 +1,180 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, List, Optional
+
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.job import Job
+
+
+QUEUED = "queued"
+RUNNING = "running"
+FAILED = "failed"
+
+MAX_BACKOFF_SECONDS = 300
+
+
+def enqueue(
+    db: Session,
+    name: str,
+    *,
+    run_at: Optional[datetime] = None,
+    max_attempts: Optional[int] = None,
+    **kwargs: Any
+) -> Job:
+    """
+    Add a job to the session of the caller
+
+    The job row is only added, not committed: it becomes visible to the
+    workers when the caller commits, and disappears with a rollback.
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    name : str
+        A task name registered in services.jobs.tasks
+    run_at : Optional[datetime], default=None
+        An earliest time to run the job (UTC), now when empty
+    max_attempts : Optional[int], default=None
+        A maximum number of attempts, settings.JOB_MAX_ATTEMPTS when empty
+    **kwargs : Any
+        A JSON serialisable keyword arguments of the task
+
+    Returns
+    -------
+    Object
+        An object of Job
+    """
+    job = Job(
+        name=name,
+        payload=json.dumps(kwargs),
+        status=QUEUED,
+        attempts=0,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=run_at or datetime.utcnow(),
+    )
+    db.add(job)
+    return job
+
+
+def dequeue(
+    db: Session,
+    worker_id: str,
+    batch_size: int = 10,
+    visibility_timeout: int = 60
+) -> List[Job]:
+    """
+    Claim a batch of runnable jobs for a worker and commit the claim
+
+    Runnable jobs are queued jobs whose run_at has passed, and running jobs
+    whose lease (visibility timeout) expired because their worker died.
+    PostgreSQL claims rows with FOR UPDATE SKIP LOCKED so concurrent workers
+    never wait on each other; other databases (SQLite) claim with a single
+    UPDATE tagged by a unique token, which their write lock serialises.
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    worker_id : str
+        An identifier of the claiming worker
+    batch_size : int, default=10
+        A maximum number of jobs to claim
+    visibility_timeout : int, default=60
+        A lease duration in seconds before the jobs become runnable again
+
+    Returns
+    -------
+    List[Object]
+        An object list of detached Job, ordered by id
+    """
+    now = datetime.utcnow()
+    runnable = or_(
+        and_(Job.status == QUEUED, Job.run_at <= now),
+        and_(Job.status == RUNNING, Job.locked_until < now),
+    )
+    claim = select(Job.id).where(runnable).order_by(Job.id).limit(batch_size)
+    token = f"{worker_id}:{uuid.uuid4().hex}"
+    values = dict(
+        status=RUNNING,
+        locked_by=token,
+        locked_until=now + timedelta(seconds=visibility_timeout),
+        attempts=Job.attempts + 1,
+    )
+
+    if db.get_bind().dialect.name == "postgresql":
+        ids = db.execute(claim.with_for_update(skip_locked=True)).scalars().all()
+        if not ids:
+            db.commit()
+            return []
+        condition = Job.id.in_(ids)
+    else:
+        condition = and_(Job.id.in_(claim.scalar_subquery()), runnable)
+    db.execute(
+        update(Job).where(condition).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    jobs = db.execute(
+        select(Job).where(Job.locked_by == token).order_by(Job.id)
+    ).scalars().all()
+    # detach the claimed rows so later commits never reload a lease token
+    # that another worker may have taken over in the meantime
+    for job in jobs:
+        db.expunge(job)
+    return jobs
+
+
+def complete(db: Session, jobs: List[Job]) -> None:
+    """
+    Remove finished jobs from the queue
+
+    Jobs whose lease was taken over by another worker are left alone.
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    jobs : List[Job]
+        A list of finished jobs
+    """
+    if not jobs:
+        return
+    db.execute(
+        delete(Job)
+        .where(Job.id.in_([job.id for job in jobs]), Job.locked_by == jobs[0].locked_by)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def retry(db: Session, job: Job, error: str) -> None:
+    """
+    Reschedule a failed job with exponential backoff, or mark it failed
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    job : Job
+        A job that raised an error
+    error : str
+        A description of the error
+    """
+    values = dict(last_error=error, locked_by=None, locked_until=None)
+    if job.attempts >= job.max_attempts:
+        values.update(status=FAILED)
+    else:
+        backoff = min(2 ** job.attempts, MAX_BACKOFF_SECONDS)
+        values.update(status=QUEUED, run_at=datetime.utcnow() + timedelta(seconds=backoff))
+    db.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.locked_by == job.locked_by)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
@@ -0,0 +1,72 @@
+'''tasks.py
+Registry of the functions a job can run, by name
+'''
+
+import logging
+from typing import Callable, Dict
+
+from crud.crud_user import crud_user
+from database.setup import SessionLocal
+from services.events import items as item_events
+from services.messaging.email import send_email
+from services.stats import rollups
+
+
+logger = logging.getLogger(__name__)
+
+
+registry: Dict[str, Callable] = {}
+
+
+def register(name: str, func: Callable) -> Callable:
+    """
+    Register a function as a job task
+
+    Parameters
+    ----------
+    name : str
+        A task name used by enqueue
+    func : Callable
+        A function (or coroutine function) called with the job payload as
+        keyword arguments
+
+    Returns
+    -------
+    Callable
+        The registered function
+    """
+    registry[name] = func
+    return func
+
+
+def task(name: str) -> Callable:
+    """
+    Decorator version of register
+    """
+    def decorator(func: Callable) -> Callable:
+        return register(name, func)
+    return decorator
+
+
+register("send_email", send_email)
+
+
+@task("reconcile_item_counts")
+async def reconcile_item_counts(batch_size: int = 10000) -> None:
+    with SessionLocal() as db:
+        repaired = await crud_user.reconcile_item_counts(db, batch_size=batch_size)
+    logger.info("Item counters repaired for %s users", repaired)
+
+
+@task("prune_item_events")
+def prune_item_events(retention_hours: int = 0) -> None:
+    with SessionLocal() as db:
+        pruned = item_events.prune(db, retention_hours=retention_hours or None)
+    logger.info("%s item events pruned", pruned)
+
+
+@task("refresh_stats")
+def refresh_stats() -> None:
+    with SessionLocal() as db:
+        refreshed_at = rollups.refresh(db)
+    logger.info("Stats rollups refreshed at %s", refreshed_at)
@@ -0,0 +1,160 @@
+'''worker.py
+Job worker process, run with `python -m services.jobs.worker`
+'''
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Callable, Optional
+
+from core.config import settings
+from database.setup import SessionLocal, engine
+from services.jobs import queue
+from services.jobs.tasks import registry
+
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """
+    Poll the jobs table and run the claimed jobs
+
+    Parameters
+    ----------
+    session_factory : Callable
+        A factory of database sessions
+    batch_size : int
+        A maximum number of jobs claimed per poll
+    visibility_timeout : int
+        A lease duration in seconds of the claimed jobs
+    poll_interval : float
+        A sleep duration in seconds when the queue is empty
+    worker_id : Optional[str]
+        An identifier of the worker, host:pid when empty
+
+    Methods
+    -------
+    run_once(self) -> int
+        Claim and run one batch of jobs
+    run(self) -> None
+        Run batches until stop is called
+    stop(self, *args) -> None
+        Ask the worker to exit after the current batch
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable = SessionLocal,
+        batch_size: int = 10,
+        visibility_timeout: int = 60,
+        poll_interval: float = 1.0,
+        worker_id: Optional[str] = None
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.running = False
+
+    def run_once(self) -> int:
+        """
+        Claim and run one batch of jobs
+
+        Returns
+        -------
+        int
+            A number of claimed jobs
+        """
+        with self.session_factory() as db:
+            jobs = queue.dequeue(
+                db, self.worker_id,
+                batch_size=self.batch_size,
+                visibility_timeout=self.visibility_timeout)
+            done = []
+            for job in jobs:
+                func = registry.get(job.name)
+                try:
+                    if func is None:
+                        raise LookupError(f"Unknown task {job.name!r}")
+                    result = func(**json.loads(job.payload or "{}"))
+                    if asyncio.iscoroutine(result):
+                        asyncio.run(result)
+                except Exception as e:
+                    logger.exception("Job %s (%s) failed", job.id, job.name)
+                    queue.retry(db, job, error=repr(e))
+                else:
+                    done.append(job)
+            queue.complete(db, done)
+        return len(jobs)
+
+    def run(self) -> None:
+        """
+        Run batches until stop is called, sleeping while the queue is empty
+        """
+        self.running = True
+        while self.running:
+            if self.run_once() < self.batch_size:
+                time.sleep(self.poll_interval)
+
+    def stop(self, *args) -> None:
+        """
+        Ask the worker to exit after the current batch
+        """
+        self.running = False
+
+
+def run_worker(batch_size: int, visibility_timeout: int, poll_interval: float) -> None:
+    """
+    Entry point of one worker process
+    """
+    # connections inherited from the parent process must not be shared
+    engine.dispose()
+    worker = Worker(
+        batch_size=batch_size,
+        visibility_timeout=visibility_timeout,
+        poll_interval=poll_interval)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    logger.info("Worker %s started", worker.worker_id)
+    worker.run()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("--processes", type=int, default=settings.JOB_WORKER_PROCESSES)
+    parser.add_argument("--batch-size", type=int, default=settings.JOB_BATCH_SIZE)
+    parser.add_argument("--visibility-timeout", type=int, default=settings.JOB_VISIBILITY_TIMEOUT)
+    parser.add_argument("--poll-interval", type=float, default=settings.JOB_POLL_INTERVAL)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    worker_args = (args.batch_size, args.visibility_timeout, args.poll_interval)
+    if args.processes <= 1:
+        run_worker(*worker_args)
+        return
+    processes = [
+        multiprocessing.Process(target=run_worker, args=worker_args)
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    def terminate(*_):
+        for process in processes:
+            process.terminate()
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
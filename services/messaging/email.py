@@ -3,8 +3,10 @@ from email.message import EmailMessage
 from email.errors import MessageError
 import logging
 from core.config import settings
+from services.observability import tracing
 
 
+@tracing.traced("email.send", tracing.IO)
 def send_email(email_recipient, message):
     msg = EmailMessage()
     msg.set_content(message)
@@ -0,0 +1,77 @@
+'''pool.py
+Connection pool metrics: how long requests hold their connections
+'''
+
+import bisect
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy import event
+
+from services.observability.queries import BUCKETS_MS
+
+
+class PoolStats:
+    """
+    Checkout counters and hold time histogram of a connection pool
+
+    Methods
+    -------
+    checkout(self, dbapi_connection, connection_record, connection_proxy) -> None
+        Pool checkout listener
+    checkin(self, dbapi_connection, connection_record) -> None
+        Pool checkin listener
+    dict(self) -> Dict[str, Any]
+        Get the counters
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_out = 0
+        self.checkouts = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)
+
+    def checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        connection_record.info["checkout_at"] = time.perf_counter()
+        with self.lock:
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def checkin(self, dbapi_connection, connection_record) -> None:
+        started = connection_record.info.pop("checkout_at", None)
+        if started is None:
+            return
+        held_ms = (time.perf_counter() - started) * 1000
+        with self.lock:
+            self.checked_out -= 1
+            self.total += held_ms
+            self.max = max(self.max, held_ms)
+            self.histogram[bisect.bisect_left(BUCKETS_MS, held_ms)] += 1
+
+    def dict(self) -> Dict[str, Any]:
+        with self.lock:
+            returned = self.checkouts - self.checked_out
+            return {
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "hold_mean_ms": round(self.total / returned, 3) if returned else 0.0,
+                "hold_max_ms": round(self.max, 3),
+                "hold_histogram": {
+                    (f"le_{bound}" if i < len(BUCKETS_MS) else "inf"): self.histogram[i]
+                    for i, bound in enumerate(BUCKETS_MS + (None,))
+                },
+            }
+
+
+stats = PoolStats()
+
+
+def install(engine) -> None:
+    """
+    Record the connection hold times of an engine pool
+    """
+    event.listen(engine, "checkout", stats.checkout)
+    event.listen(engine, "checkin", stats.checkin)
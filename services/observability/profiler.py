@@ -0,0 +1,192 @@
+'''profiler.py
+On-demand request profiler: stack sampling plus SQL capture
+
+A request is profiled when it carries `X-Profile: <settings.PROFILE_TOKEN>`
+or is picked by settings.PROFILE_SAMPLE_RATE. Each profile is written to
+settings.PROFILE_DIR as `<id>.folded` (collapsed stacks, for flamegraph.pl
+or speedscope) and `<id>.sql.json` (statements with timings).
+'''
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+
+from core.config import settings
+
+
+_active: ContextVar[Optional["RequestProfile"]] = ContextVar("active_profile", default=None)
+
+
+class StackSampler(threading.Thread):
+    """
+    Sample the stack of one thread at a fixed interval
+
+    Parameters
+    ----------
+    thread_id : int
+        An ident of the thread to sample
+    interval : float
+        A delay in seconds between two samples
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+class RequestProfile:
+    """
+    Profile of one request: sampled stacks and executed statements
+
+    Parameters
+    ----------
+    method : str
+        A request method
+    path : str
+        A request path
+
+    Methods
+    -------
+    start(self) -> None
+        Start sampling the current thread
+    stop(self) -> None
+        Stop sampling
+    write(self, directory: str) -> None
+        Write the folded stacks and the statement list
+    """
+
+    def __init__(self, method: str, path: str):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.queries: List[Dict] = []
+        self.duration = 0.0
+        self.sampler = StackSampler(threading.get_ident(), settings.PROFILE_INTERVAL)
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self.sampler.start()
+
+    def stop(self) -> None:
+        self.sampler.stop()
+        self.duration = time.perf_counter() - self.started
+
+    def write(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.id)
+        with open(f"{base}.folded", "w") as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(f"{base}.sql.json", "w") as f:
+            json.dump({
+                "method": self.method,
+                "path": self.path,
+                "duration_ms": round(self.duration * 1000, 3),
+                "sql_ms": round(sum(q["duration_ms"] for q in self.queries), 3),
+                "queries": self.queries,
+            }, f, indent=2)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active.get() is not None:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _active.get()
+    if profile is None or not conn.info.get("profile_query_start"):
+        return
+    elapsed = time.perf_counter() - conn.info["profile_query_start"].pop()
+    profile.queries.append({
+        "statement": statement,
+        "executemany": executemany,
+        "duration_ms": round(elapsed * 1000, 3),
+    })
+
+
+def handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("profile_query_start"):
+        connection.info["profile_query_start"].pop()
+
+
+def install(engine) -> None:
+    """
+    Capture the statements of profiled requests executed on an engine
+    """
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+def should_profile(headers: Dict[bytes, bytes]) -> bool:
+    """
+    Check the X-Profile header against settings.PROFILE_TOKEN, then sample
+    """
+    token = headers.get(b"x-profile")
+    if token is not None and settings.PROFILE_TOKEN:
+        return token.decode("latin-1") == settings.PROFILE_TOKEN
+    return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware profiling the selected requests
+
+    Requests that are not selected go straight to the app, so the cost of a
+    disabled profiler is one header lookup.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not should_profile(dict(scope["headers"])):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        token = _active.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.stop()
+            _active.reset(token)
+            await run_in_threadpool(profile.write, settings.PROFILE_DIR)
@@ -0,0 +1,207 @@
+'''queries.py
+Statement statistics: per fingerprint latency histograms and slow query log
+'''
+
+import bisect
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import default
+
+from core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (ms) of the latency histogram buckets, the last one is open
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|:\w+|\$\d+|\?")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+_VALUES_LIST = re.compile(r"\bVALUES\s*(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\1)+", re.I)
+_SPACE = re.compile(r"\s+")
+
+# ExecutionContext.cache_hit values, see sqlalchemy.engine.default
+CACHE_OUTCOMES = {
+    default.CACHE_HIT: "hit",
+    default.CACHE_MISS: "miss",
+    default.CACHING_DISABLED: "disabled",
+    default.NO_CACHE_KEY: "no_cache_key",
+    default.NO_DIALECT_SUPPORT: "no_dialect_support",
+}
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """
+    Normalise a statement so that executions differing only by literal
+    values, placeholder style or IN/VALUES list length share one key
+
+    Parameters
+    ----------
+    statement : str
+        A SQL statement
+
+    Returns
+    -------
+    str
+        A normalised statement
+    """
+    text = _COMMENT.sub(" ", statement)
+    text = _STRING.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _SPACE.sub(" ", text).strip()
+    text = _IN_LIST.sub("IN (...)", text)
+    return _VALUES_LIST.sub(r"VALUES \1, ...", text)
+
+
+def redact(parameters: Any) -> Any:
+    """
+    Replace bound parameter values by their type name
+    """
+    if isinstance(parameters, dict):
+        return {key: f"<{type(value).__name__}>" for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):  # executemany
+            return [redact(parameters[0]), f"... {len(parameters)} rows"]
+        return [f"<{type(value).__name__}>" for value in parameters]
+    return parameters
+
+
+class StatementStats:
+    """
+    Latency statistics of one fingerprint
+    """
+
+    __slots__ = ("fingerprint", "count", "total", "max", "histogram")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, elapsed_ms: float) -> None:
+        self.count += 1
+        self.total += elapsed_ms
+        self.max = max(self.max, elapsed_ms)
+        self.histogram[bisect.bisect_left(BUCKETS_MS, elapsed_ms)] += 1
+
+    def dict(self) -> Dict[str, Any]:
+        return {
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "total_ms": round(self.total, 3),
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max, 3),
+            "histogram": {
+                (f"le_{bound}" if i < len(BUCKETS_MS) else "inf"): self.histogram[i]
+                for i, bound in enumerate(BUCKETS_MS + (None,))
+            },
+        }
+
+
+class QueryRegistry:
+    """
+    Statistics of every fingerprint seen by the instrumented engines
+
+    Methods
+    -------
+    record(self, statement: str, parameters: Any, elapsed_ms: float) -> None
+        Add one execution, log it when slower than the threshold
+    top(self, limit: int = 10, sort: str = "total") -> List[Dict[str, Any]]
+        Get the statistics of the most expensive fingerprints
+    record_cache(self, context: Any) -> None
+        Count the compiled statement cache outcome of one execution
+    cache_stats(self) -> Dict[str, Any]
+        Get the compiled statement cache counters
+    reset(self) -> None
+        Forget every statistic
+    """
+
+    SORT_KEYS = {
+        "total": lambda stats: stats.total,
+        "max": lambda stats: stats.max,
+        "count": lambda stats: stats.count,
+        "mean": lambda stats: stats.total / stats.count,
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: Dict[str, StatementStats] = {}
+        self.cache: Counter = Counter()
+
+    def record(self, statement: str, parameters: Any, elapsed_ms: float) -> None:
+        key = fingerprint(statement)
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = StatementStats(key)
+            stats.add(elapsed_ms)
+        if elapsed_ms >= settings.SLOW_QUERY_MS:
+            logger.warning(
+                "Slow query (%.1f ms): %s parameters=%s", elapsed_ms, key, redact(parameters))
+
+    def top(self, limit: int = 10, sort: str = "total") -> List[Dict[str, Any]]:
+        with self.lock:
+            ranked = sorted(self.stats.values(), key=self.SORT_KEYS[sort], reverse=True)
+            return [stats.dict() for stats in ranked[:limit]]
+
+    def record_cache(self, context: Any) -> None:
+        outcome = CACHE_OUTCOMES.get(getattr(context, "cache_hit", None))
+        if outcome is not None:
+            with self.lock:
+                self.cache[outcome] += 1
+
+    def cache_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            counters = {outcome: self.cache[outcome] for outcome in CACHE_OUTCOMES.values()}
+        lookups = counters["hit"] + counters["miss"]
+        counters["hit_ratio"] = round(counters["hit"] / lookups, 4) if lookups else None
+        return counters
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stats.clear()
+            self.cache.clear()
+
+
+registry = QueryRegistry()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    registry.record_cache(context)
+    started = conn.info.get("query_start")
+    if started:
+        registry.record(statement, parameters, (time.perf_counter() - started.pop()) * 1000)
+
+
+def handle_error(exception_context):
+    # a failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+def install(engine) -> None:
+    """
+    Record the statistics of every statement executed on an engine
+    """
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
@@ -0,0 +1,429 @@
+'''tracing.py
+Request tracing: spans for the request, CRUD calls, SQL, hashing and email
+
+A trace starts at the ASGI request (TracingMiddleware), or at a job task
+called outside a request, and is kept or dropped at its root (head
+sampling): the sampled flag of an incoming W3C traceparent header wins,
+otherwise settings.TRACE_SAMPLE_RATE decides. The children of a dropped
+root cost one ContextVar lookup.
+
+    with span("cache.lookup", kind=CPU):
+        ...
+
+    @traced("email.send", kind=IO)
+    def send_email(...):
+        ...
+
+Each span has a kind (db, cpu, io, internal) so a trace tells where its
+time went. Finished spans are exported in batches by a background thread,
+as JSON lines to settings.TRACE_FILE, or as OTLP/JSON to
+settings.TRACE_OTLP_ENDPOINT. `python -m services.observability.tracing
+<file>` prints the critical path and time per kind of each trace.
+'''
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# span kinds
+DB = "db"
+CPU = "cpu"
+IO = "io"
+INTERNAL = "internal"
+
+BATCH_SIZE = 512
+FLUSH_INTERVAL = 1.0  # seconds
+MAX_QUEUE = 10000  # finished spans waiting for export, newer ones are dropped
+
+
+class Span:
+    """
+    A timed operation of a trace
+
+    Methods
+    -------
+    end(self, error: Optional[BaseException] = None) -> None
+        Stop the span and queue it for export
+    dict(self) -> Dict[str, Any]
+        Get the exported fields
+    """
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "attributes", "start", "end_time", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: str, attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start = time.time_ns()
+        self.end_time: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        self.end_time = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        exporter.export(self)
+
+    def dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_unix_nano": self.start,
+            "end_unix_nano": self.end_time,
+            "duration_ms": round((self.end_time - self.start) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+# the span of the current task, NOT_SAMPLED inside a dropped trace
+NOT_SAMPLED = object()
+_current: ContextVar[Any] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    span = _current.get()
+    return span if isinstance(span, Span) else None
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    Parse a W3C traceparent header into (trace_id, parent_id, sampled)
+    """
+    parts = value.strip().split("-") if value else []
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def start_span(name: str, kind: str = INTERNAL, traceparent: Optional[str] = None, **attributes: Any) -> Any:
+    """
+    Start a child of the current span, or a root span sampled at the head
+
+    Returns
+    -------
+    Any
+        A Span, or NOT_SAMPLED when the trace is dropped
+    """
+    parent = _current.get()
+    if parent is NOT_SAMPLED:
+        return NOT_SAMPLED
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, kind, attributes)
+    remote = parse_traceparent(traceparent)
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+        sampled = settings.TRACE_SAMPLE_RATE > 0 and random.random() < settings.TRACE_SAMPLE_RATE
+    if not sampled:
+        return NOT_SAMPLED
+    return Span(name, trace_id, parent_id, kind, attributes)
+
+
+@contextmanager
+def span(name: str, kind: str = INTERNAL, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Trace a block as a child of the current span (a root span when none)
+    """
+    new = start_span(name, kind, **attributes)
+    token = _current.set(new)
+    try:
+        yield new if isinstance(new, Span) else None
+    except BaseException as error:
+        if isinstance(new, Span):
+            new.end(error)
+            new = None
+        raise
+    finally:
+        _current.reset(token)
+        if isinstance(new, Span):
+            new.end()
+
+
+def traced(name: str, kind: str = INTERNAL) -> Callable:
+    """
+    Decorator tracing each call of a function or coroutine function
+    """
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(name, kind):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(name, kind):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument(obj: Any, prefix: str) -> Any:
+    """
+    Trace the public coroutine methods of an object (a CRUD instance) as
+    <prefix>.<method> spans
+    """
+    for name in dir(type(obj)):
+        method = getattr(obj, name)
+        if not name.startswith("_") and asyncio.iscoroutinefunction(method):
+            setattr(obj, name, traced(f"{prefix}.{name}")(method))
+    return obj
+
+
+def set_route(method: str, route: str) -> None:
+    """
+    Name the request span after its route template (set by the route class)
+    """
+    request_span = current_span()
+    if request_span is not None and "http.target" in request_span.attributes:
+        request_span.name = f"{method} {route}"
+        request_span.attributes["http.route"] = route
+
+
+class BatchExporter:
+    """
+    Queue finished spans and write them in batches from a background thread
+
+    Methods
+    -------
+    export(self, span: Span) -> None
+        Queue a finished span
+    flush(self) -> None
+        Write the queued spans now
+    """
+
+    def __init__(self):
+        self.queue: "queue.Queue[Span]" = queue.Queue(MAX_QUEUE)
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def export(self, span: Span) -> None:
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name="trace-exporter", daemon=True)
+                    self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            while not self.queue.empty():
+                batch: List[Span] = []
+                while len(batch) < BATCH_SIZE and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                try:
+                    write_batch(batch)
+                except Exception:
+                    logger.exception("Trace export failed, %s spans lost", len(batch))
+
+
+def write_batch(batch: List[Span]) -> None:
+    if settings.TRACE_EXPORTER == "otlp":
+        request = urllib.request.Request(
+            settings.TRACE_OTLP_ENDPOINT, data=json.dumps(otlp_json(batch)).encode(),
+            headers={"Content-Type": "application/json"}, method="POST")
+        urllib.request.urlopen(request, timeout=5).close()
+        return
+    directory = os.path.dirname(settings.TRACE_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(settings.TRACE_FILE, "a") as f:
+        for finished in batch:
+            f.write(json.dumps(finished.dict(), default=str) + "\n")
+
+
+def otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_json(batch: List[Span]) -> Dict[str, Any]:
+    """
+    Get the OTLP/JSON export request of a batch of spans
+    """
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": otlp_value(settings.APP_NAME)}]},
+        "scopeSpans": [{
+            "scope": {"name": __name__},
+            "spans": [{
+                "traceId": finished.trace_id,
+                "spanId": finished.span_id,
+                "parentSpanId": finished.parent_id or "",
+                "name": finished.name,
+                "kind": 2 if finished.parent_id is None else 1,  # server, internal
+                "startTimeUnixNano": str(finished.start),
+                "endTimeUnixNano": str(finished.end_time),
+                "attributes": [
+                    {"key": key, "value": otlp_value(value)}
+                    for key, value in {**finished.attributes, "span.kind": finished.kind}.items()
+                ],
+                "status": {"code": 2, "message": finished.error} if finished.error else {"code": 1},
+            } for finished in batch],
+        }],
+    }]}
+
+
+exporter = BatchExporter()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    new = start_span("sql", DB, **{"db.system": conn.dialect.name, "db.statement": statement[:1000]})
+    if isinstance(new, Span):
+        conn.info.setdefault("trace_spans", []).append(new)
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        finished = spans.pop()
+        finished.attributes["db.rows"] = cursor.rowcount
+        finished.end()
+
+
+def handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("trace_spans"):
+        connection.info["trace_spans"].pop().end(exception_context.original_exception)
+
+
+def install(engine) -> None:
+    """
+    Trace the statements executed on an engine, inside sampled traces
+    """
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware starting the trace of each request
+
+    Sampled responses carry the trace id in X-Trace-Id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1") or None
+        root = start_span(
+            f"{scope['method']} {scope['path']}", INTERNAL, traceparent=traceparent,
+            **{"http.method": scope["method"], "http.target": scope["path"]})
+        if not isinstance(root, Span):
+            token = _current.set(NOT_SAMPLED)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _current.reset(token)
+            return
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", root.trace_id.encode())]
+            await send(message)
+
+        token = _current.set(root)
+        try:
+            await self.app(scope, receive, send_traced)
+        except BaseException as error:
+            root.end(error)
+            raise
+        else:
+            root.end()
+        finally:
+            _current.reset(token)
+
+
+def critical_path(spans: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """
+    Get the critical path of a trace (from the root, the slowest child at
+    each level, the work is sequential) and the self time per kind of its
+    spans in ms
+    """
+    children: Dict[Optional[str], List[Dict[str, Any]]] = defaultdict(list)
+    ids = {item["span_id"] for item in spans}
+    for item in spans:
+        children[item["parent_id"] if item["parent_id"] in ids else None].append(item)
+    by_kind: Dict[str, float] = defaultdict(float)
+    for item in spans:
+        child_ms = sum(child["duration_ms"] for child in children.get(item["span_id"], ()))
+        by_kind[item["kind"]] += max(0.0, item["duration_ms"] - child_ms)
+    path = []
+    level = children.get(None, [])
+    while level:
+        slowest = max(level, key=lambda item: item["duration_ms"])
+        path.append(slowest)
+        level = children.get(slowest["span_id"], [])
+    return path, dict(by_kind)
+
+
+def report(path: str) -> None:
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            item = json.loads(line)
+            traces[item["trace_id"]].append(item)
+    for trace_id, spans in traces.items():
+        steps, by_kind = critical_path(spans)
+        print(f"trace {trace_id} ({len(spans)} spans) " +
+              " ".join(f"{kind}={ms:.1f}ms" for kind, ms in sorted(by_kind.items())))
+        for depth, step in enumerate(steps):
+            print(f"  {'  ' * depth}{step['name']} {step['duration_ms']:.1f}ms [{step['kind']}]")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the critical path of each exported trace")
+    parser.add_argument("file", nargs="?", default=settings.TRACE_FILE)
+    report(parser.parse_args().file)
@@ -0,0 +1,178 @@
+'''rollups.py
+Admin dashboard statistics from rollup tables
+
+The refresh_stats job aggregates the users table into small tables:
+
+    stats_signups_daily  signups per day, only the days since the last
+                         refresh are aggregated again
+    stats_item_counts    users per (item_count, is_active), one GROUP BY
+                         over the ix_users_is_active_item_count index
+
+GET /admin/stats only reads these tables, computes the percentiles of
+items per user from the histogram with NumPy, and queues a refresh when
+they are older than settings.STATS_REFRESH_INTERVAL.
+'''
+
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Optional, Sequence
+
+from sqlalchemy import delete, func, insert, select, true
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.job import Job
+from models.stats import ItemCountBucket, SignupsDaily, StatsRollup
+from models.user import User
+from services.jobs.queue import QUEUED, enqueue
+
+
+ROLLUP = "users"
+REFRESH_TASK = "refresh_stats"
+PERCENTILES = (50, 90, 99)
+# signups committed just after a refresh may carry an earlier created_at
+LOOKBACK = timedelta(hours=1)
+
+
+def refresh(db: Session, now: Optional[datetime] = None) -> datetime:
+    """
+    Refresh the rollup tables in one transaction
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    now : Optional[datetime], default=None
+        The refresh time (UTC), now when empty
+
+    Returns
+    -------
+    datetime
+        The refresh time
+    """
+    now = now or datetime.utcnow()
+    state = db.get(StatsRollup, ROLLUP)
+
+    day = func.date(User.created_at)
+    signups = select(day, func.count()).where(User.created_at.isnot(None)).group_by(day)
+    if state is not None:
+        since = datetime.combine((state.refreshed_at - LOOKBACK).date(), time.min)
+        db.execute(delete(SignupsDaily).where(SignupsDaily.day >= since.date()))
+        signups = signups.where(User.created_at >= since)
+    db.execute(insert(SignupsDaily).from_select(["day", "signups"], signups))
+
+    is_active = func.coalesce(User.is_active, true())
+    db.execute(delete(ItemCountBucket))
+    db.execute(insert(ItemCountBucket).from_select(
+        ["item_count", "is_active", "users"],
+        select(User.item_count, is_active, func.count()).group_by(User.item_count, is_active)))
+
+    if state is None:
+        db.add(StatsRollup(name=ROLLUP, refreshed_at=now))
+    else:
+        state.refreshed_at = now
+    db.commit()
+    return now
+
+
+def percentiles(values: Sequence[int], weights: Sequence[int], ranks: Sequence[float] = PERCENTILES) -> Dict[str, Any]:
+    """
+    Get the nearest-rank percentiles and the mean of a histogram
+
+    Parameters
+    ----------
+    values : Sequence[int]
+        The bucket values (item counts)
+    weights : Sequence[int]
+        The bucket sizes (users)
+    ranks : Sequence[float], default=PERCENTILES
+        The percentiles to compute
+
+    Returns
+    -------
+    Dict[str, Any]
+        mean, max and p<rank> of the values, None when empty
+    """
+    import numpy as np  # imported on the first dashboard read, not at startup
+
+    values, weights = np.asarray(values), np.asarray(weights)
+    if not weights.sum():
+        return {"mean": None, "max": None, **{f"p{rank}": None for rank in ranks}}
+    order = np.argsort(values, kind="stable")
+    values, cumulative = values[order], np.cumsum(weights[order])
+    positions = np.searchsorted(cumulative, np.ceil(np.asarray(ranks) / 100 * cumulative[-1]))
+    return {
+        "mean": round(float(np.average(values, weights=weights[order])), 3),
+        "max": int(values[weights[order] > 0][-1]),
+        **{f"p{rank}": int(value) for rank, value in zip(ranks, values[positions])},
+    }
+
+
+def queue_refresh(db: Session) -> bool:
+    """
+    Queue a refresh_stats job, unless one is already waiting
+
+    Returns
+    -------
+    bool
+        True when a job was queued (the caller commits)
+    """
+    waiting = db.execute(
+        select(Job.id).where(Job.name == REFRESH_TASK, Job.status == QUEUED).limit(1)).first()
+    if waiting is not None:
+        return False
+    enqueue(db, REFRESH_TASK)
+    return True
+
+
+def read_stats(db: Session, days: int = 30, today: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Get the dashboard statistics from the rollup tables
+
+    Parameters
+    ----------
+    db : Session
+        The session database of app
+    days : int, default=30
+        The number of days of signups, today included
+    today : Optional[date], default=None
+        The last day of signups (UTC), today when empty
+
+    Returns
+    -------
+    Dict[str, Any]
+        users (active, inactive), items per user and signups per day,
+        with the time of the refresh they come from
+    """
+    today = today or datetime.utcnow().date()
+    state = db.get(StatsRollup, ROLLUP)
+    buckets = db.execute(
+        select(ItemCountBucket.item_count, ItemCountBucket.is_active, ItemCountBucket.users)).all()
+    daily = dict(db.execute(
+        select(SignupsDaily.day, SignupsDaily.signups)
+        .where(SignupsDaily.day > today - timedelta(days=days))).all())
+
+    import numpy as np
+
+    counts = np.array([bucket.item_count for bucket in buckets], dtype=np.int64)
+    users = np.array([bucket.users for bucket in buckets], dtype=np.int64)
+    active = np.array([bool(bucket.is_active) for bucket in buckets], dtype=bool)
+    signups = [
+        {"day": day, "signups": daily.get(day, 0)}
+        for day in (today - timedelta(days=offset) for offset in range(days - 1, -1, -1))
+    ]
+    refreshed_at = state.refreshed_at if state is not None else None
+    return {
+        "refreshed_at": refreshed_at,
+        "stale": refreshed_at is None
+        or datetime.utcnow() - refreshed_at > timedelta(seconds=settings.STATS_REFRESH_INTERVAL),
+        "users": {
+            "total": int(users.sum()),
+            "active": int(users[active].sum()),
+            "inactive": int(users[~active].sum()),
+        },
+        "items": {
+            "total": int(counts @ users),
+            "per_user": percentiles(counts, users),
+        },
+        "signups": signups,
+    }
@@ -0,0 +1,31 @@
+from tests.setup import client
+from tests.test_users import test_user_authenticate
+from services.observability.queries import fingerprint
+from services.stats.rollups import percentiles
+
+
+def test_fingerprint():
+    assert fingerprint("SELECT * FROM users WHERE id IN (1, 2, 3) AND name = 'x'") == \
+        "SELECT * FROM users WHERE id IN (...) AND name = ?"
+
+
+def test_read_query_stats():
+    token = test_user_authenticate()
+    response = client.get(
+        "/admin/queries?limit=5",
+        headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert len(response.json()) <= 5
+
+
+def test_stats_percentiles():
+    assert percentiles([0, 1, 2, 10], [5, 3, 1, 1]) == {"mean": 1.5, "max": 10, "p50": 0, "p90": 2, "p99": 10}
+
+
+def test_read_stats():
+    token = test_user_authenticate()
+    response = client.get(
+        "/admin/stats?days=7",
+        headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert len(response.json()["signups"]) == 7
@@ -0,0 +1,50 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from api.deps import get_db
+from api.routers import batch
+from tests.setup import client
+
+
+def test_batch_requests():
+    response = client.post(
+        "/batch",
+        json={"requests": [
+            {"path": "/items?limit=1"},
+            {"path": "/users/me"},
+        ]}
+    )
+    assert response.status_code == 200
+    assert [sub["status"] for sub in response.json()["responses"]] == [200, 401]
+
+
+def test_nested_batch_request():
+    response = client.post(
+        "/batch",
+        json={"requests": [{"method": "POST", "path": "/batch"}]}
+    )
+    assert response.status_code == 400
+
+
+def test_failing_sub_request_answers_500_alone():
+    app = FastAPI()
+    app.include_router(batch.router)
+
+    @app.get("/fails")
+    async def fails():
+        raise RuntimeError("unhandled")
+
+    @app.get("/works")
+    async def works():
+        return {"detail": "ok"}
+
+    db = sessionmaker(bind=create_engine("sqlite://"))()
+    app.dependency_overrides[get_db] = lambda: db
+    response = TestClient(app).post(
+        "/batch",
+        json={"requests": [{"path": "/works"}, {"path": "/fails"}, {"path": "/works"}]}
+    )
+    assert response.status_code == 200
+    assert [sub["status"] for sub in response.json()["responses"]] == [200, 500, 200]
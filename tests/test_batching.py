@@ -0,0 +1,22 @@
+import asyncio
+
+from database.batching import GroupCommitter
+
+
+def test_group_commit_batches_and_errors():
+    batches = []
+
+    def write_many(entries):
+        batches.append(list(entries))
+        return [ValueError(entry) if entry == 3 else entry * 10 for entry in entries]
+
+    committer = GroupCommitter(write_many, window_ms=5, max_entries=4)
+
+    async def scenario():
+        return await asyncio.gather(*[committer.submit(i) for i in range(10)], return_exceptions=True)
+
+    results = asyncio.get_event_loop().run_until_complete(scenario())
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert results[3].args == (3,)
+    assert [result for i, result in enumerate(results) if i != 3] == [0, 10, 20, 40, 50, 60, 70, 80, 90]
+    assert committer.stats()["batches"] == 3
@@ -0,0 +1,48 @@
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from database import notify
+from services.cache import responses
+from services.cache.responses import Entry, ResponseCache
+
+
+def entry(*tags):
+    return Entry(200, [], b"[]", set(tags), time.monotonic() + 60)
+
+
+def test_purge_drops_tagged_entries_only():
+    cache = ResponseCache(10)
+    cache.set("a", entry("user:1"), cache.tick())
+    cache.set("b", entry("user:2", "items"), cache.tick())
+    assert cache.purge(["items"]) == 1
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+
+
+def test_response_read_before_a_purge_is_not_stored():
+    cache = ResponseCache(10)
+    started = cache.tick()
+    cache.purge(["user:1"])
+    assert not cache.set("a", entry("user:1"), started)
+    assert cache.set("a", entry("user:1"), cache.tick())
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(2)
+    for key in "abc":
+        cache.set(key, entry(key), cache.tick())
+    assert cache.get("a") is None
+    assert cache.tags == {"b": {"b"}, "c": {"c"}}
+
+
+def test_writer_purges_its_own_cache_on_commit(monkeypatch):
+    engine = create_engine("sqlite://")
+    monkeypatch.setattr(notify, "notify", lambda db, channel, payload: None)  # NOTIFY not back yet
+    responses.cache.set("a", entry("user:1"), responses.cache.tick())
+    with Session(engine) as db:
+        responses.purge(db, "user:1")
+        assert responses.cache.get("a") is not None
+        db.commit()
+    assert responses.cache.get("a") is None
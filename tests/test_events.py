@@ -0,0 +1,85 @@
+import asyncio
+
+from fastapi import FastAPI
+from starlette.routing import Match
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from api.routers import items
+from api.routers.items import event_stream
+from database.base import Base, ItemEvent
+from services.events import items as events
+
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine, tables=[ItemEvent.__table__])
+
+
+def test_events_are_published_on_commit_only():
+    async def scenario():
+        subscription = events.broker.subscribe(7)
+        try:
+            with TestingSessionLocal() as db:
+                events.record(db, 7, events.CREATED, {"id": 1})
+                db.rollback()
+                events.record(db, 7, events.DELETED, {"id": 1})
+                db.commit()
+            message = await subscription.get(timeout=1)
+            assert message["type"] == events.DELETED
+            assert await subscription.get(timeout=0.01) is None
+        finally:
+            events.broker.unsubscribe(subscription)
+
+    asyncio.get_event_loop().run_until_complete(scenario())
+
+
+def test_resume_replays_missed_events():
+    with TestingSessionLocal() as db:
+        first = events.record(db, 8, events.CREATED, {"id": 1})
+        events.record(db, 9, events.CREATED, {"id": 2})
+        events.record(db, 8, events.UPDATED, {"id": 1})
+        db.commit()
+        missed, reset = events.resume(db, 8, first.id)
+        assert not reset
+        assert [message["type"] for message in missed] == [events.UPDATED]
+
+
+def test_resume_sends_late_events_again():
+    with TestingSessionLocal() as db:
+        late = events.record(db, 10, events.CREATED, {"id": 1})  # committed after the next one
+        sent = events.record(db, 10, events.CREATED, {"id": 2})
+        db.commit()
+        missed, reset = events.resume(db, 10, sent.id)
+        assert not reset
+        assert [message["id"] for message in missed] == [late.id]
+
+
+def test_stream_sends_each_id_once_in_any_order():
+    async def scenario():
+        subscription = events.broker.subscribe(11)
+        stream = event_stream(subscription, [{"id": 5, "type": events.CREATED, "data": {}}], False, 4)
+        try:
+            for message_id in (4, 7, 5, 6, 8):
+                subscription.deliver({"id": message_id, "user_id": 11, "type": events.CREATED, "data": {}})
+            chunks = []
+            async for chunk in stream:
+                if chunk.startswith("id:"):
+                    chunks.append(chunk)
+                if chunk.startswith("id: 8"):
+                    return chunks
+        finally:
+            await stream.aclose()
+
+    chunks = asyncio.get_event_loop().run_until_complete(scenario())
+    assert [chunk.split("\n")[0] for chunk in chunks] == ["id: 5", "id: 7", "id: 6", "id: 8"]
+
+
+def test_event_stream_route_is_not_taken_for_an_item_id():
+    app = FastAPI()
+    app.include_router(items.router)
+    scope = {"type": "http", "method": "GET", "path": "/users/me/items/events"}
+    route = next(route for route in app.router.routes if route.matches(scope)[0] == Match.FULL)
+    assert route.path == "/users/me/items/events"
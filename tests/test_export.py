@@ -0,0 +1,39 @@
+import csv
+import gzip
+import json
+import os
+
+from sqlalchemy import create_engine
+
+from database import export
+from database.base import Base, Item, User
+
+
+def test_export_resumes(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    Base.metadata.create_all(bind=engine, tables=[User.__table__, Item.__table__])
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {"username": f"user{i}", "email": f"user{i}@app.com", "hashed_password": "x"} for i in range(25)])
+        conn.execute(Item.__table__.insert(), [
+            {"title": f"item{i}", "description": "description", "owner_id": i % 25 + 1} for i in range(250)])
+    monkeypatch.setattr(export, "engine", engine)  # inherited by the forked workers
+    out = str(tmp_path / "export")
+
+    manifest = export.export(out, ["users", "items"], chunk_size=100, processes=2, batch_size=30)
+    assert "hashed_password" not in manifest["tables"]["users"]["columns"]
+    assert [(chunk["table"], chunk["rows"]) for chunk in manifest["chunks"]] == [
+        ("users", 25), ("items", 100), ("items", 100), ("items", 50)]
+    with gzip.open(os.path.join(out, manifest["chunks"][2]["file"]), "rt", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == manifest["tables"]["items"]["columns"]
+    assert [int(row[0]) for row in rows[1:]] == list(range(101, 201))
+
+    # an interrupted run: one chunk file missing, another never completed
+    os.remove(os.path.join(out, manifest["chunks"][1]["file"]))
+    manifest["chunks"][3]["sha256"] = None
+    export.save_manifest(out, manifest)
+    resumed = export.export(out, ["users", "items"], processes=2)
+    assert [chunk["rows"] for chunk in resumed["chunks"]] == [25, 100, 100, 50]
+    with open(os.path.join(out, export.MANIFEST)) as f:
+        assert json.load(f)["chunks"] == resumed["chunks"]
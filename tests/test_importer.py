@@ -0,0 +1,33 @@
+import asyncio
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from crud.crud_item import crud_item
+from services.importer.items import import_items
+
+
+def test_failed_chunk_is_reported_and_import_goes_on(monkeypatch):
+    written = []
+
+    async def bulk_create_user_items(db, rows, user_id):
+        if any(row["title"] == "rejected" for row in rows):
+            raise OperationalError("COPY items", {}, Exception("canceling statement due to statement timeout"))
+        written.extend(row["title"] for row in rows)
+        return len(rows)
+
+    monkeypatch.setattr(crud_item, "bulk_create_user_items", bulk_create_user_items)
+    titles = ["a", "b", "rejected", "c", "x" * 151, "d", "e"]
+
+    async def stream():
+        yield ("title\n" + "\n".join(titles) + "\n").encode()
+
+    with Session(create_engine("sqlite://")) as db:
+        result = asyncio.get_event_loop().run_until_complete(
+            import_items(db=db, user_id=1, stream=stream(), chunk_size=2))
+    assert written == ["a", "b", "d", "e"]
+    report = result.dict()
+    assert report["imported"] == 4 and report["chunks"] == 2 and report["failed"] == 3
+    assert report["errors"][0] == {"lines": [4, 5], "error": "canceling statement due to statement timeout"}
+    assert report["errors"][1]["line"] == 6  # title longer than the column
@@ -0,0 +1,57 @@
+from array import array
+
+from database import notify
+from services.indexes.bloom import CountingBloomFilter
+from services.indexes.prefix import PrefixIndex
+from services.indexes.users import EMAIL, UserIndex, index_key
+
+
+def test_counting_bloom_filter():
+    bloom = CountingBloomFilter(capacity=1000, error_rate=0.01)
+    keys = [f"username:user{index}" for index in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"email:user{index}" in bloom for index in range(10000))
+    assert false_positives < 200
+
+    for key in keys[:500]:
+        bloom.remove(key)
+    assert all(key in bloom for key in keys[500:])
+    assert sum(key in bloom for key in keys[:500]) < 50
+
+
+def test_prefix_index(monkeypatch):
+    listener = notify.Listener(engine=None)
+    listener.listening = True
+    monkeypatch.setattr(notify, "listener", listener)
+    index = PrefixIndex()
+    assert index.search("a", 10) is None  # not built, callers query the database
+    index.backlog = []
+    index.handle({"names_added": [[1, "alice"], [2, "alicia"], [3, "bob"], [4, "al"]]})
+    index.names, index.ids = ["alice", "bob"], array("q", [1, 3])  # the snapshot
+    for payload in index.backlog:  # replayed on top of it, as build does
+        index._apply(payload)
+    index.backlog, index.ready = None, True
+
+    assert index.search("ali", 10) == [(1, "alice"), (2, "alicia")]
+    assert index.search("al", 2) == [(4, "al"), (1, "alice")]
+    assert index.search("c", 10) == []
+    index.handle({"names_removed": [[2, "alicia"]], "names_added": [[2, "alina"]]})
+    assert index.search("ali", 10) == [(1, "alice"), (2, "alina")]
+
+
+def test_user_index_needs_listener(monkeypatch):
+    index = UserIndex()
+    index.bloom = CountingBloomFilter(capacity=100, error_rate=0.01)
+    index.handle({"added": [index_key(EMAIL, "Alice@App.com")]})
+    index.ready = True
+    assert index.might_exist(EMAIL, "bob@app.com")  # other processes' writes never reach this one
+
+    listener = notify.Listener(engine=None)
+    listener.listening = True
+    monkeypatch.setattr(notify, "listener", listener)
+    assert not index.might_exist(EMAIL, "bob@app.com")
+    assert index.might_exist(EMAIL, "alice@app.com")
+    listener.listening = False  # LISTEN connection lost
+    assert index.might_exist(EMAIL, "bob@app.com")
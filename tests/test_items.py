@@ -4,3 +4,17 @@ from tests.setup import client
 def test_read_items():
     response = client.get("/items")
     assert response.status_code == 200
+
+
+def test_read_items_fields():
+    response = client.get("/items?fields=id,title")
+    assert response.status_code == 200
+    assert all(set(item) == {"id", "title"} for item in response.json())
+
+
+def test_read_items_unknown_fields():
+    response = client.get("/items?fields=id,secret")
+    assert response.status_code == 400
+    assert response.json() == {
+        "detail": "Unknown fields: secret"
+    }
@@ -0,0 +1,70 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.base import Base, Job
+from services.jobs import queue
+from services.jobs.tasks import register
+from services.jobs.worker import Worker
+
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine, tables=[Job.__table__])
+
+calls = []
+register("test_record", lambda value: calls.append(value))
+
+
+def test_enqueue_is_visible_after_commit_only():
+    with TestingSessionLocal() as db:
+        queue.enqueue(db, "test_record", value=1)
+        db.rollback()
+        assert queue.dequeue(db, "worker-a") == []
+
+
+def test_dequeue_batches_and_skips_claimed_jobs():
+    with TestingSessionLocal() as db:
+        for value in range(3):
+            queue.enqueue(db, "test_record", value=value)
+        db.commit()
+        first = queue.dequeue(db, "worker-a", batch_size=2)
+        second = queue.dequeue(db, "worker-b", batch_size=2)
+        assert len(first) == 2
+        assert len(second) == 1
+        assert all(job.attempts == 1 for job in first + second)
+        queue.complete(db, first)
+        queue.complete(db, second)
+        assert db.query(Job).count() == 0
+
+
+def test_expired_lease_is_claimed_again():
+    with TestingSessionLocal() as db:
+        queue.enqueue(db, "test_record", value=1)
+        db.commit()
+        lost = queue.dequeue(db, "worker-a", visibility_timeout=-1)
+        retaken = queue.dequeue(db, "worker-b")
+        assert [job.id for job in retaken] == [job.id for job in lost]
+        assert retaken[0].attempts == 2
+        queue.complete(db, lost)
+        assert db.query(Job).count() == 1
+        queue.complete(db, retaken)
+        assert db.query(Job).count() == 0
+
+
+def test_worker_runs_and_retries_jobs():
+    register("test_fail", lambda: 1 / 0)
+    with TestingSessionLocal() as db:
+        queue.enqueue(db, "test_record", value="ok")
+        queue.enqueue(db, "test_fail", max_attempts=1)
+        db.commit()
+    worker = Worker(session_factory=TestingSessionLocal, worker_id="worker-a")
+    assert worker.run_once() == 2
+    assert "ok" in calls
+    with TestingSessionLocal() as db:
+        failed = db.query(Job).one()
+        assert failed.status == queue.FAILED
+        assert "ZeroDivisionError" in failed.last_error
+        db.delete(failed)
+        db.commit()
@@ -0,0 +1,63 @@
+import asyncio
+import signal
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.testclient import TestClient
+from uvicorn.config import Config
+from uvicorn.main import Server
+
+from api.lifecycle import DrainMiddleware, install_exit_hook, lifecycle
+from services.events.items import broker
+
+
+def test_drain_waits_for_requests_in_flight(monkeypatch):
+    monkeypatch.setattr(lifecycle, "draining", False)
+    monkeypatch.setattr(lifecycle, "in_flight", 0)
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def slow(scope, receive, send):
+        started.set()
+        await release.wait()
+        await PlainTextResponse("done")(scope, receive, send)
+
+    app = DrainMiddleware(slow)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def scenario():
+        request = asyncio.ensure_future(app({"type": "http", "path": "/items", "headers": []}, None, send))
+        await started.wait()
+        drain = asyncio.ensure_future(lifecycle.drain(timeout=5))
+        await asyncio.sleep(0.1)
+        assert not drain.done() and lifecycle.in_flight == 1
+        release.set()
+        assert await drain == 0
+        await request
+
+    asyncio.get_event_loop().run_until_complete(scenario())
+    assert sent[0]["status"] == 200
+
+    client = TestClient(DrainMiddleware(Starlette()))
+    response = client.get("/items")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+
+
+def test_sigterm_begins_drain(monkeypatch):
+    monkeypatch.setattr(Server, "handle_exit", Server.handle_exit)
+    monkeypatch.setattr(lifecycle, "draining", False)
+    install_exit_hook()
+    install_exit_hook()
+    server = Server(Config(app=Starlette()))
+    subscription = broker.subscribe(1)
+    try:
+        server.handle_exit(signal.SIGTERM, None)
+        assert server.should_exit and not server.force_exit
+        assert lifecycle.draining
+        # the event stream ends, so uvicorn does not wait for it forever
+        assert asyncio.get_event_loop().run_until_complete(subscription.get(timeout=1)) is None
+        assert subscription.closed
+    finally:
+        broker.unsubscribe(subscription)
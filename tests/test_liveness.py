@@ -0,0 +1,47 @@
+import asyncio
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import QueuePool
+from starlette.requests import Request
+from starlette.responses import Response
+
+from api.routing import retry_on_lost_connection
+from core.config import settings
+from database import liveness
+
+
+def test_idle_connections_pinged_on_checkout(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}", poolclass=QueuePool, pool_size=1,
+                           pool_reset_on_return=None)
+    liveness.install(engine)
+    pings = []
+    do_ping = engine.dialect.do_ping
+    monkeypatch.setattr(engine.dialect, "do_ping", lambda connection: pings.append(1) or do_ping(connection))
+
+    monkeypatch.setattr(settings, "LIVENESS_IDLE_PING", 3600)
+    for _ in range(3):
+        with engine.connect() as conn:
+            conn.exec_driver_sql("SELECT 1")
+    assert pings == []  # recently used, no round trip
+
+    with engine.connect() as conn:
+        conn.connection.connection.close()  # closed behind the pool's back
+    monkeypatch.setattr(settings, "LIVENESS_IDLE_PING", 0)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT 1").scalar() == 1  # replaced by a new connection
+    assert len(pings) == 1  # the new connection is not pinged
+
+
+def test_reads_retried_once_on_lost_connection():
+    calls = []
+
+    async def handler(request):
+        calls.append(1)
+        if len(calls) == 1:
+            raise DBAPIError("SELECT 1", {}, Exception("server closed the connection"), connection_invalidated=True)
+        return Response("ok")
+
+    request = Request({"type": "http", "method": "GET", "path": "/items", "headers": []})
+    response = asyncio.get_event_loop().run_until_complete(retry_on_lost_connection(request, handler))
+    assert response.body == b"ok" and len(calls) == 2
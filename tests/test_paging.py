@@ -0,0 +1,34 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from api.deps import get_db
+from api.routers import items
+from database.base import Base, Item, User
+
+
+def test_items_cursor_pages_return_every_item_once():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine, tables=[User.__table__, Item.__table__])
+    db = sessionmaker(bind=engine)()
+    db.add_all([User(username=f"page{index}", email=f"page{index}@mail.com", hashed_password="x")
+                for index in range(3)])
+    db.add_all([Item(title=f"item {index}", owner_id=3 - index % 3) for index in range(7)])  # ids not in owner order
+    db.commit()
+    app = FastAPI()
+    app.include_router(items.router)
+    app.dependency_overrides[get_db] = lambda: db
+    client = TestClient(app)
+
+    seen, cursor = [], None
+    while True:
+        response = client.get("/items", params={"limit": 2, **({"after": cursor} if cursor else {})})
+        assert response.status_code == 200
+        seen += [(item["owner_id"], item["id"]) for item in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert sorted(item_id for _, item_id in seen) == list(range(1, 8))
+    assert seen == sorted(seen)
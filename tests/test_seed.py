@@ -0,0 +1,24 @@
+from sqlalchemy import create_engine, func, select
+
+from database import seed
+from database.base import Base, Item, User
+
+
+def test_seed_synthetic_counters(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    Base.metadata.create_all(bind=engine, tables=[User.__table__, Item.__table__])
+    monkeypatch.setattr(seed, "engine", engine)
+
+    assert seed.seed_synthetic(
+        50, 400, skew=1.2, description_length=(0, 2), bcrypt_rounds=4, batch_size=64, seed=7) == (50, 400)
+    with engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(User)).scalar() == 50
+        assert conn.execute(select(func.count()).select_from(Item)).scalar() == 400
+        assert conn.execute(select(func.count()).where(Item.description.is_(None))).scalar() == 0
+        expected = {
+            owner_id: (count, last) for owner_id, count, last in conn.execute(
+                select(Item.owner_id, func.count(), func.max(Item.created_at)).group_by(Item.owner_id))
+        }
+        users = conn.execute(select(User.id, User.item_count, User.last_item_at)).all()
+    assert {id: (count, last) for id, count, last in users if count} == expected
+    assert all(last is None for _, count, last in users if not count)
@@ -0,0 +1,148 @@
+import asyncio
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from api.schemas.item import ItemCreate
+from crud.crud_item import crud_item
+from crud.crud_user import crud_user
+from database.base import Base, Item, ItemEvent, User
+from database.setup import SessionLocal, engine as setup_engine
+from database.shards import init_shards, jump_hash, rebalance, shard_router
+from services.events import items as events
+
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine, tables=[User.__table__, Item.__table__, ItemEvent.__table__])
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def shard_counts():
+    counts = []
+    for engine in shard_router.engines:
+        with engine.connect() as conn:
+            counts.append(conn.execute(select(func.count()).select_from(Item.__table__)).scalar())
+    return counts
+
+
+def test_jump_hash_moves_few_keys():
+    assert all(jump_hash(key, 1) == 0 for key in range(100))
+    moved = sum(jump_hash(key, 4) != jump_hash(key, 5) for key in range(10000))
+    assert 1500 < moved < 2500  # about 1/5
+
+
+def test_sharded_items(tmp_path):
+    urls = [f"sqlite:///{tmp_path}/shard{index}.db" for index in range(3)]
+    shard_router.configure(urls[:2])
+    SessionLocal.configure(bind=engine)
+    try:
+        init_shards()
+        with TestingSessionLocal() as db:
+            users = [User(username=f"shard{index}", email=f"shard{index}@mail.com",
+                          hashed_password="x") for index in range(6)]
+            db.add_all(users)
+            db.commit()
+            ids = [user.id for user in users]
+            for user_id in ids:
+                for index in range(3):
+                    run(crud_item.create_user_item(db, ItemCreate(title=f"item {index}"), user_id))
+            assert db.execute(select(func.count()).select_from(Item)).scalar() == 0
+            assert sum(shard_counts()) == 18
+
+            items = run(crud_item.get_user_items(db, user_id=ids[0]))
+            assert [item.owner_id for item in items] == [ids[0]] * 3
+            assert run(crud_user.get_user_summary(db, ids[0])).item_count == 3
+            assert len(run(crud_user.get_user(db, ids[0])).items) == 3
+
+            pages, cursor = [], None
+            while True:
+                page = run(crud_item.get_items(db, limit=4, after=cursor))
+                if not page:
+                    break
+                pages += [(item.owner_id, item.id) for item in page]
+                cursor = pages[-1]
+            assert len(pages) == 18
+            assert pages == sorted(pages)
+            rows = run(crud_item.get_item_rows(db, limit=100))
+            assert [(row.owner_id, row.id) for row in rows] == pages
+            assert [len(user.items) for user in run(crud_user.get_user_rows(db))] == [3] * 6
+
+            shard_router.configure(urls)
+            init_shards()
+            expected = sum(jump_hash(user_id, 2) != jump_hash(user_id, 3) for user_id in ids) * 3
+            assert rebalance() == expected
+            assert rebalance() == 0
+            assert sum(shard_counts()) == 18
+            for user_id in ids:
+                assert len(run(crud_item.get_user_items(db, user_id=user_id))) == 3
+
+            item = run(crud_item.get_user_items(db, user_id=ids[1]))[0]
+            run(crud_item.remove(db, id=item.id, user_id=ids[1]))
+            db.execute(User.__table__.update().values(item_count=0))
+            db.commit()
+            assert run(crud_user.reconcile_item_counts(db, batch_size=4)) == 6
+            assert run(crud_user.get_user_summary(db, ids[1])).item_count == 2
+    finally:
+        SessionLocal.configure(bind=setup_engine)
+        shard_router.configure([])
+
+
+def test_sharded_batch_failure_after_shard_commit(tmp_path, monkeypatch):
+    shard_router.configure([f"sqlite:///{tmp_path}/shard{index}.db" for index in range(2)])
+    SessionLocal.configure(bind=engine)
+    try:
+        init_shards()
+        with TestingSessionLocal() as db:
+            users = [User(username=f"batch{index}", email=f"batch{index}@mail.com",
+                          hashed_password="x") for index in range(4)]
+            db.add_all(users)
+            db.commit()
+            ids = [user.id for user in users]
+
+        def record_many(db, entries):
+            raise RuntimeError("events table unavailable")
+
+        monkeypatch.setattr(events, "record_many", record_many)
+        entries = [(ItemCreate(title=f"item {user_id}"), user_id) for user_id in ids]
+        results = crud_item.write_item_batch(entries)
+        assert [(item.title, item.owner_id) for item in results] == [(f"item {user_id}", user_id) for user_id in ids]
+        assert sum(shard_counts()) == 4  # committed once, not written again one by one
+    finally:
+        SessionLocal.configure(bind=setup_engine)
+        shard_router.configure([])
+
+
+def test_rebalance_keeps_item_ids(tmp_path):
+    urls = [f"sqlite:///{tmp_path}/shard{index}.db" for index in range(3)]
+    shard_router.configure(urls)
+    SessionLocal.configure(bind=engine)
+    try:
+        init_shards()
+        # 3 and 6 move to shard 2 when it is added, from shards 0 and 1
+        first, second = 3, 6
+        assert (jump_hash(first, 2), jump_hash(second, 2)) == (0, 1)
+        assert jump_hash(first, 3) == jump_hash(second, 3) == 2
+        for index, rows in enumerate([[(1, first), (2, first)], [(2, second), (5, second)]]):
+            with shard_router.engines[index].begin() as conn:
+                conn.execute(Item.__table__.insert(), [
+                    {"id": id, "owner_id": owner_id, "title": f"item {id}"} for id, owner_id in rows])
+        with TestingSessionLocal() as db:
+            before = db.execute(select(func.count()).select_from(ItemEvent)).scalar()
+
+        assert rebalance() == 4
+        assert rebalance() == 0
+        with shard_router.engines[2].connect() as conn:
+            rows = conn.execute(select(Item.id, Item.owner_id, Item.title).order_by(Item.id)).all()
+        assert rows == [(1, first, "item 1"), (2, first, "item 2"), (5, second, "item 5"), (6, second, "item 2")]
+        with TestingSessionLocal() as db:
+            resets = db.execute(select(ItemEvent.user_id, ItemEvent.type).where(ItemEvent.id > before)).all()
+        assert resets == [(second, events.RESET)]  # its item 2 is now 6
+    finally:
+        SessionLocal.configure(bind=setup_engine)
+        shard_router.configure([])
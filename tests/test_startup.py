@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+from benchmarks.startup import BUDGET_MS, DEFERRED, import_profile, loaded_modules
+
+
+def test_heavy_dependencies_are_deferred():
+    loaded = set(loaded_modules("main"))
+    assert [name for name in DEFERRED if name in loaded] == []
+
+
+# wall time depends on the machine and its load: opt in with STARTUP_BUDGET=1 (or a budget in ms)
+@pytest.mark.skipif(not os.environ.get("STARTUP_BUDGET"), reason="set STARTUP_BUDGET to check the import time")
+def test_startup_budget():
+    budget = BUDGET_MS if os.environ["STARTUP_BUDGET"] == "1" else float(os.environ["STARTUP_BUDGET"])
+    # best of 3, to not fail on one slow interpreter start
+    elapsed = min(import_profile("main")[0] for _ in range(3))
+    assert elapsed < budget
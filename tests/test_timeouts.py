@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from database import timeouts
+
+
+SLOW = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 50000000) SELECT count(*) FROM c"
+
+engine = create_engine("sqlite://")
+timeouts.install(engine)
+
+
+def test_statement_deadline():
+    token = timeouts.timeout_ms.set(50)
+    try:
+        with engine.connect() as conn:
+            with pytest.raises(OperationalError) as error:
+                conn.execute(text(SLOW))
+            assert timeouts.is_timeout(error.value)
+    finally:
+        timeouts.timeout_ms.reset(token)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT 1")).scalar() == 1
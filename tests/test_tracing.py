@@ -0,0 +1,32 @@
+import json
+
+from core.config import settings
+from services.observability import tracing
+
+
+def test_head_sampling_and_critical_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "TRACE_FILE", str(tmp_path / "spans.jsonl"))
+    monkeypatch.setattr(settings, "TRACE_SAMPLE_RATE", 0.0)
+    with tracing.span("dropped") as root:
+        assert root is None
+        with tracing.span("child") as child:
+            assert child is None
+
+    monkeypatch.setattr(settings, "TRACE_SAMPLE_RATE", 1.0)
+    with tracing.span("request") as root:
+        with tracing.span("bcrypt.hash", tracing.CPU):
+            pass
+        with tracing.span("sql", tracing.DB) as sql:
+            assert sql.trace_id == root.trace_id and sql.parent_id == root.span_id
+    tracing.exporter.flush()
+
+    spans = [json.loads(line) for line in open(settings.TRACE_FILE)]
+    assert [item["name"] for item in spans] == ["bcrypt.hash", "sql", "request"]
+    path, by_kind = tracing.critical_path(spans)
+    assert path[0]["name"] == "request"
+    assert set(by_kind) == {"cpu", "db", "internal"}
+
+
+def test_parse_traceparent():
+    assert tracing.parse_traceparent("00-" + "a" * 32 + "-" + "b" * 16 + "-01") == ("a" * 32, "b" * 16, True)
+    assert tracing.parse_traceparent("garbage") is None
@@ -27,6 +27,12 @@ def test_create_existent_user():
     }
 
 
+def test_user_availability():
+    response = client.get("/users/availability?username=test&email=free@app.com")
+    assert response.status_code == 200
+    assert response.json() == {"username": False, "email": True}
+
+
 def test_user_authenticate(username: str = "test", password: str = "password"):
     response = client.post(
         "/token",
@@ -46,6 +52,20 @@ def test_read_user_me():
     assert response.status_code == 200
 
 
+def test_read_user_me_not_modified():
+    token = test_user_authenticate()
+    response = client.get(
+        "/users/me",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    response = client.get(
+        "/users/me",
+        headers={"Authorization": f"Bearer {token}", "If-None-Match": response.headers["ETag"]}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+
 def test_read_users():
     token = test_user_authenticate()
     response = client.get(
@@ -54,6 +74,15 @@ def test_read_users():
     assert response.status_code == 200
 
 
+def test_search_users():
+    token = test_user_authenticate()
+    response = client.get(
+        "/users/search?prefix=te",
+        headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.json() == [{"id": 1, "username": "test"}]
+
+
 def test_read_user():
     user = client.get
     response = client.get("/users/1")